@@ -1,20 +1,92 @@
 import cadquery as cq
-from flask import Flask, request, send_file, jsonify
+from flask import (Flask, Request, request, send_file, jsonify, Response,
+                   has_request_context)
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge, UnsupportedMediaType
 import tempfile
 import os
-from collections import Counter
+import io
+import hashlib
+import threading
+import time
+import uuid
+import json
+import struct
+import inspect
+import math
+import re
+import mmap
+import zipfile
+import zlib
+import resource
+import multiprocessing
+import bisect
+import sys
+import hmac
+import base64
+import signal
+import ast
+import marshal
+import functools
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import Counter, OrderedDict, deque
+import numpy as np
 import cqkit
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+from OCP.STEPControl import (STEPControl_Reader, STEPControl_Writer,
+                             STEPControl_AsIs)
+from OCP.Interface import Interface_Static
+from OCP.IFSelect import IFSelect_RetDone
+from OCP.TopExp import TopExp
+from OCP.TopAbs import TopAbs_FACE, TopAbs_EDGE, TopAbs_VERTEX, TopAbs_REVERSED
+from OCP.TopTools import TopTools_IndexedMapOfShape
+from OCP.TopoDS import TopoDS, TopoDS_Shape, TopoDS_Iterator
+from OCP.BRep import BRep_Tool
+from OCP.BRepMesh import BRepMesh_IncrementalMesh
+from OCP.TopLoc import TopLoc_Location
+from OCP.BRepTools import BRepTools
+from OCP.BinTools import BinTools, BinTools_FormatVersion_VERSION_3
+from OCP.BRepAdaptor import BRepAdaptor_Surface
+from OCP.BRepGProp import BRepGProp
+from OCP.GProp import GProp_GProps
+from OCP.Bnd import Bnd_OBB
+from OCP.BRepBndLib import BRepBndLib
+from cadquery.occ_impl.shapes import geom_LUT_FACE
+import cq_gears
 
 # --- IMPORTACIONES COMPLETAS DE CQ_GEARS ---
 # Asegúrate de que los nombres de las clases coincidan con los de los archivos.
 # Por ejemplo, en bevel_gear.py la clase se llama BevelGear.
-from cq_gears.spur_gear import SpurGear
-from cq_gears.bevel_gear import BevelGear
-from cq_gears.crossed_helical_gear import CrossedHelicalGear
-from cq_gears.rack_gear import RackGear
-from cq_gears.ring_gear import RingGear
+from cq_gears.spur_gear import GearBase, SpurGear, HerringboneGear
+from cq_gears.bevel_gear import BevelGear, BevelGearPair
+from cq_gears.crossed_helical_gear import (CrossedHelicalGear, CrossedGearPair,
+                                           HyperbolicGear, HyperbolicGearPair)
+from cq_gears.rack_gear import RackGear, HerringboneRackGear
+from cq_gears.ring_gear import (RingGear, HerringboneRingGear, PlanetaryGearset,
+                                HerringbonePlanetaryGearset)
 from cq_gears.worm_gear import Worm
 
+# --- CACHÉ DE CONSTRUCCIÓN DE ENGRANES ---
+# Opcional: si CQ_GEAR_CACHE_ITEMS > 0, GearBase.build memoriza los sólidos
+# construidos (en memoria y, con CQ_GEAR_CACHE_DIR, también como BREP).
+GEAR_CACHE_ITEMS = int(os.environ.get('CQ_GEAR_CACHE_ITEMS') or 0)
+GEAR_CACHE_DIR = os.environ.get('CQ_GEAR_CACHE_DIR') or None
+if GEAR_CACHE_ITEMS > 0:
+    GearBase.build_cache = cq_gears.BuildCache(max_items=GEAR_CACHE_ITEMS,
+                                               cache_dir=GEAR_CACHE_DIR)
+
+# Los hijos desechables del sandbox solo tienen caché de engranes si se
+# configuró una (CQ_GEAR_CACHE_ITEMS o CQ_GEAR_CACHE_DIR). La de memoria
+# muere con ellos; en disco cada cliente usa un subdirectorio propio de
+# CQ_GEAR_CACHE_DIR, limitado a CQ_GEAR_CACHE_DISK_MB megabytes, para que
+# nada de lo que deje el script de un cliente lo lea el de otro.
+SANDBOX_GEAR_CACHE = GEAR_CACHE_ITEMS > 0 or GEAR_CACHE_DIR is not None
+SANDBOX_GEAR_CACHE_DISK_BYTES = int(os.environ.get('CQ_GEAR_CACHE_DISK_MB') or 256) * 1024 * 1024
+
 # --- DICCIONARIO DE EJECUCIÓN ACTUALIZADO ---
 # Añade todas las clases de engranes importadas para que esten 
 # disponibles en los scripts que se ejecutan en el endpoint /generate
@@ -22,16 +94,3113 @@ CQ_EXEC_SCOPE = {
     "cq": cq,
     "cqkit": cqkit,
     "SpurGear": SpurGear,
+    "HerringboneGear": HerringboneGear,
     "BevelGear": BevelGear,
+    "BevelGearPair": BevelGearPair,
     "CrossedHelicalGear": CrossedHelicalGear,
+    "CrossedGearPair": CrossedGearPair,
+    "HyperbolicGear": HyperbolicGear,
+    "HyperbolicGearPair": HyperbolicGearPair,
     "RackGear": RackGear,
+    "HerringboneRackGear": HerringboneRackGear,
     "RingGear": RingGear,
+    "HerringboneRingGear": HerringboneRingGear,
+    "PlanetaryGearset": PlanetaryGearset,
+    "HerringbonePlanetaryGearset": HerringbonePlanetaryGearset,
     "Worm": Worm,
     "WormGear": Worm,
 }
 
-# Inicializar la aplicación Flask
-app = Flask(__name__)
+# Clases de engranes que se pueden pedir por nombre en el endpoint /gears
+GEAR_CLASSES = {name: obj for name, obj in CQ_EXEC_SCOPE.items()
+                if isinstance(obj, type) and issubclass(obj, GearBase)}
+
+# Inicializar la aplicación Flask
+app = Flask(__name__)
+
+
+def _env_int(name, default):
+    """Lee un entero de una variable de entorno, con valor por defecto."""
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+# --- MÉTRICAS DE LATENCIA POR ETAPA ---
+class Metrics:
+    """
+    Histogramas de latencia en el formato de texto de Prometheus, sin
+    dependencias externas.
+
+    Cada observación se etiqueta con el endpoint que la produce (ver
+    `bind`). Las etapas que se ejecutan en los workers del pool se capturan
+    allí (`start_capture`/`stop_capture`) y se suman en el proceso padre
+    con `merge`, de modo que /metrics las ve aunque no ocurran en él.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+               10.0, 30.0, 60.0, 120.0)
+
+    HELP = {
+        "cq_stage_seconds": "Duración de cada etapa de un endpoint.",
+        "cq_gear_build_stage_seconds": "Duración de cada etapa de GearBase._build.",
+        "cq_request_seconds": "Duración total de la petición, incluido el envío.",
+    }
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def bind(self, endpoint):
+        """Fija el endpoint con el que se etiquetan las etapas de este hilo."""
+        self._local.endpoint = endpoint
+
+    def endpoint(self):
+        return getattr(self._local, 'endpoint', None) or 'none'
+
+    def observe(self, name, seconds, **labels):
+        capture = getattr(self._local, 'capture', None)
+        if capture is not None:
+            capture.append((name, labels, seconds))
+            return
+
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.BUCKETS), 0.0, 0]
+            i = bisect.bisect_left(self.BUCKETS, seconds)
+            if i < len(self.BUCKETS):
+                histogram[0][i] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    @contextmanager
+    def stage(self, stage):
+        """Mide el bloque como la etapa `stage` del endpoint actual."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("cq_stage_seconds", time.perf_counter() - start,
+                         endpoint=self.endpoint(), stage=stage)
+
+    def start_capture(self):
+        self._local.capture = []
+
+    def stop_capture(self):
+        """Devuelve las observaciones capturadas desde start_capture."""
+        capture, self._local.capture = self._local.capture, None
+        return capture
+
+    def merge(self, observations):
+        for name, labels, seconds in observations:
+            self.observe(name, seconds, **labels)
+
+    def render(self, gauges=()):
+        """
+        Devuelve todas las métricas en formato de texto. `gauges` es una
+        lista de (nombre, ayuda, [(etiquetas, valor), ...]).
+        """
+        with self._lock:
+            histograms = sorted((key, (list(buckets), total, count))
+                                for key, (buckets, total, count)
+                                in self._histograms.items())
+
+        lines = []
+        described = set()
+        for (name, labels), (buckets, total, count) in histograms:
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {self.HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, n in zip(self.BUCKETS, buckets):
+                cumulative += n
+                lines.append(f"{name}_bucket{_labels(labels, le=bound)} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels, le='+Inf')} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+
+        for name, help_text, samples in gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{_labels(tuple(sorted(labels.items())))} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+METRICS = Metrics()
+
+# Las etapas de construcción de los engranes (caras, cosido, operaciones)
+GearBase.stage_observer = lambda gear, stage, seconds: METRICS.observe(
+    "cq_gear_build_stage_seconds", seconds,
+    gear=type(gear).__name__, stage=stage)
+
+
+# --- PERFILADO BAJO DEMANDA ---
+class StackProfiler:
+    """
+    Perfilador determinista basado en sys.setprofile. Acumula el tiempo
+    propio de cada pila de llamadas completa, incluidas las llamadas a
+    funciones nativas (OCP), así que sirve tanto para un flamegraph
+    (`collapsed`) como para un árbol de llamadas en JSON (`call_tree`).
+    Solo mide el hilo en el que se ejecuta `run`.
+    """
+
+    def __init__(self):
+        self.totals = Counter()
+        self._stack = []
+
+    def run(self, fn, *args):
+        sys.setprofile(self._callback)
+        try:
+            return fn(*args)
+        finally:
+            sys.setprofile(None)
+            self._stack = []
+
+    def _callback(self, frame, event, arg):
+        now = time.perf_counter()
+        if event == 'call' or event == 'c_call':
+            label = _frame_label(frame) if event == 'call' else _native_label(arg)
+            path = (self._stack[-1][0] if self._stack else ()) + (label,)
+            self._stack.append([path, now, 0.0])
+        elif self._stack:
+            # return, c_return o c_exception
+            path, start, children = self._stack.pop()
+            elapsed = now - start
+            self.totals[path] += elapsed - children
+            if self._stack:
+                self._stack[-1][2] += elapsed
+
+    def collapsed(self):
+        """Pilas en formato 'a;b;c microsegundos', una por línea."""
+        return "".join(f"{';'.join(path)} {round(seconds * 1e6)}\n"
+                       for path, seconds in sorted(self.totals.items())
+                       if seconds >= 1e-6)
+
+    def call_tree(self, min_fraction=0.001, top=20):
+        """
+        Árbol de llamadas con tiempo total y propio de cada nodo; se omiten
+        las ramas de menos de `min_fraction` del total. Incluye las `top`
+        funciones con más tiempo propio, sumando todas sus pilas.
+        """
+        root = {"name": "<root>", "total_s": 0.0, "self_s": 0.0, "children": {}}
+        own = Counter()
+        for path, seconds in self.totals.items():
+            own[path[-1]] += seconds
+            node = root
+            node["total_s"] += seconds
+            for label in path:
+                node = node["children"].setdefault(
+                    label, {"name": label, "total_s": 0.0, "self_s": 0.0,
+                            "children": {}})
+                node["total_s"] += seconds
+            node["self_s"] += seconds
+
+        threshold = root["total_s"] * min_fraction
+
+        def prune(node):
+            children = sorted((child for child in node["children"].values()
+                               if child["total_s"] >= threshold),
+                              key=lambda child: -child["total_s"])
+            node["children"] = [prune(child) for child in children]
+            return node
+
+        return {
+            "total_s": root["total_s"],
+            "hotspots": [{"name": name, "self_s": seconds}
+                         for name, seconds in own.most_common(top)],
+            "tree": prune(root)["children"],
+        }
+
+    def render(self, fmt):
+        return self.collapsed() if fmt == 'collapsed' else self.call_tree()
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    module = frame.f_globals.get('__name__') or os.path.basename(code.co_filename)
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def _native_label(fn):
+    owner = getattr(fn, '__self__', None)
+    # Las funciones de pybind11 (OCP) cuelgan de un PyCapsule y solo
+    # conocen su módulo, p. ej. OCP.BRepAlgoAPI.Build
+    if owner is None or isinstance(owner, type(sys)) \
+            or type(owner).__name__ == 'PyCapsule':
+        module = getattr(fn, '__module__', None) or 'builtins'
+        return f"{module.replace('OCP.OCP.', 'OCP.')}.{fn.__name__}"
+    owner_name = owner.__name__ if isinstance(owner, type) else type(owner).__name__
+    return f"{owner_name}.{fn.__name__}"
+
+
+def profiled_call(fn, *args):
+    """Ejecuta `fn(*args)` bajo StackProfiler; devuelve (resultado, perfil)."""
+    profiler = StackProfiler()
+    return profiler.run(fn, *args), profiler
+
+
+# Tokens (separados por comas) que pueden pedir el perfilado de una
+# petición con la cabecera X-Profile; sin tokens el perfilado está apagado.
+PROFILE_TOKENS = [token.strip() for token in
+                  os.environ.get('CQ_PROFILE_TOKENS', '').split(',')
+                  if token.strip()]
+PROFILE_FORMATS = ('json', 'collapsed')
+
+
+class ProfileAccessError(Exception):
+    """Se pidió el perfilado con un token que no está autorizado."""
+
+
+def _requested_profile(headers):
+    """
+    Devuelve el formato de perfil pedido ('json' o 'collapsed', según
+    X-Profile-Format) o None si la petición no pide perfilado.
+    """
+    token = headers.get('X-Profile')
+    if token is None:
+        return None
+    if not any(hmac.compare_digest(token.encode(), allowed.encode())
+               for allowed in PROFILE_TOKENS):
+        raise ProfileAccessError("Token de perfilado no autorizado.")
+
+    fmt = headers.get('X-Profile-Format', 'json').lower()
+    if fmt not in PROFILE_FORMATS:
+        raise ValueError(f"Formato de perfil no soportado: {fmt!r}. Opciones: {', '.join(PROFILE_FORMATS)}.")
+    return fmt
+
+
+# --- CACHÉ DE RESULTADOS DIRECCIONADA POR CONTENIDO ---
+class ContentCache:
+    """
+    Caché de bytes indexada por un hash del contenido que los produce.
+
+    Mantiene las entradas más recientes en memoria (limitadas por número y por
+    tamaño total) y, si se indica `cache_dir`, las escribe también en disco,
+    donde sobreviven a la expulsión de memoria y a los reinicios del worker.
+    La política de expulsión puede ser 'lru' (un acierto renueva la entrada)
+    o 'fifo' (las entradas se expulsan en orden de inserción).
+    """
+
+    def __init__(self, max_entries=128, max_bytes=256 * 1024 * 1024,
+                 cache_dir=None, max_disk_bytes=1024 * 1024 * 1024,
+                 policy='lru', suffix='.bin'):
+        if policy not in ('lru', 'fifo'):
+            raise ValueError(f"Política de expulsión desconocida: {policy!r}")
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.policy = policy
+        self.suffix = suffix
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        """Calcula la clave SHA-256 de una secuencia de cadenas o bytes."""
+        digest = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode('utf-8')
+            digest.update(len(part).to_bytes(8, 'little'))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key + self.suffix)
+
+    def get(self, key):
+        """Devuelve los bytes almacenados para `key`, o None si no existen."""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                if self.policy == 'lru':
+                    self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+
+        data = self._read_disk(key)
+
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, data)
+            return data
+
+    def put(self, key, data):
+        """Guarda `data` bajo `key` en memoria y, si procede, en disco."""
+        with self._lock:
+            self._store(key, data)
+        self._write_disk(key, data)
+
+    def _store(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._size -= len(self._entries.pop(key))
+        self._entries[key] = data
+        self._size += len(data)
+
+        while (len(self._entries) > self.max_entries or
+               self._size > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self.evictions += 1
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        if self.policy == 'lru':
+            os.utime(path)
+        return data
+
+    def _write_disk(self, key, data):
+        if not self.cache_dir:
+            return
+        # Escritura atómica: otro proceso nunca ve un archivo a medias
+        path = self._disk_path(key)
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, delete=False) as f:
+            f.write(data)
+        os.replace(f.name, path)
+        self._prune_disk()
+
+    def _prune_disk(self):
+        files = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(self.suffix):
+                st = entry.stat()
+                files.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        """Devuelve los contadores y la ocupación actual de la caché."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "policy": self.policy,
+                "cache_dir": self.cache_dir,
+            }
+
+
+# Caché de los STEP producidos por /generate. Se configura por entorno:
+# CQ_RESULT_CACHE_ENTRIES, CQ_RESULT_CACHE_BYTES, CQ_RESULT_CACHE_DIR,
+# CQ_RESULT_CACHE_DISK_BYTES y CQ_RESULT_CACHE_POLICY ('lru' o 'fifo').
+RESULT_CACHE = ContentCache(
+    max_entries=_env_int('CQ_RESULT_CACHE_ENTRIES', 128),
+    max_bytes=_env_int('CQ_RESULT_CACHE_BYTES', 256 * 1024 * 1024),
+    cache_dir=os.environ.get('CQ_RESULT_CACHE_DIR') or None,
+    max_disk_bytes=_env_int('CQ_RESULT_CACHE_DISK_BYTES', 1024 * 1024 * 1024),
+    policy=os.environ.get('CQ_RESULT_CACHE_POLICY', 'lru'),
+    suffix='.step',
+)
+
+# Caché de STEP ya importados, en BREP binario y por SHA-256 del archivo,
+# compartida por /analyze y /modify. Se configura con CQ_STEP_CACHE_BYTES,
+# CQ_STEP_CACHE_ENTRIES y CQ_STEP_CACHE_DIR (necesario para compartirla
+# entre los procesos del pool).
+STEP_CACHE = ContentCache(
+    max_entries=_env_int('CQ_STEP_CACHE_ENTRIES', 1024),
+    max_bytes=_env_int('CQ_STEP_CACHE_BYTES', 512 * 1024 * 1024),
+    cache_dir=os.environ.get('CQ_STEP_CACHE_DIR') or None,
+    max_disk_bytes=_env_int('CQ_STEP_CACHE_DISK_BYTES', 4 * 1024 * 1024 * 1024),
+    suffix='.bin.brep',
+)
+
+
+# --- COMPRESIÓN ---
+# Codificaciones que se ofrecen en las respuestas, por orden de preferencia
+# si el cliente acepta varias con la misma calidad. zstd solo está
+# disponible si está instalado el paquete zstandard.
+CONTENT_ENCODINGS = ('zstd', 'gzip') if zstandard is not None else ('gzip',)
+ENCODING_ALIASES = {'gzip': 'gzip', 'x-gzip': 'gzip', 'zstd': 'zstd'}
+# Archivos subidos que se descomprimen al recibirlos, por extensión
+# ('.stp.gz') o por tipo de contenido.
+COMPRESSED_SUFFIXES = {'.gz': 'gzip', '.zst': 'zstd'}
+COMPRESSED_MIMETYPES = {'application/gzip': 'gzip', 'application/x-gzip': 'gzip',
+                        'application/zstd': 'zstd'}
+# Las respuestas más pequeñas que esto no se comprimen
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_CHUNK_BYTES = 256 * 1024
+GZIP_LEVEL = _env_int('CQ_GZIP_LEVEL', 6)
+ZSTD_LEVEL = _env_int('CQ_ZSTD_LEVEL', 3)
+
+
+class CompressedUploadError(BadRequest):
+    """Una subida comprimida que no se puede descomprimir."""
+
+
+def _content_encoding(value):
+    """
+    Normaliza una cabecera Content-Encoding. Devuelve None para 'identity'
+    o si no hay cabecera, y lanza UnsupportedMediaType si no se soporta.
+    """
+    value = (value or '').strip().lower()
+    if value in ('', 'identity'):
+        return None
+    encoding = ENCODING_ALIASES.get(value)
+    if encoding is None or encoding not in CONTENT_ENCODINGS:
+        raise UnsupportedMediaType(
+            f"Content-Encoding no soportado: {value!r}. Opciones: {', '.join(CONTENT_ENCODINGS)}.")
+    return encoding
+
+
+def _compressor(encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def _decompressor(encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def _decompress(decoder, data):
+    try:
+        return decoder.decompress(data)
+    except (zlib.error, *((zstandard.ZstdError,) if zstandard is not None else ())) as e:
+        raise CompressedUploadError(f"No se pudo descomprimir la subida: {str(e)}")
+
+
+def _check_decompressed(decoder):
+    """
+    Al acabarse la entrada, comprueba que el descompresor llegó al final del
+    flujo (el pie del gzip o el fin del frame zstd): si no, la subida está
+    truncada y lo descomprimido sería solo una parte.
+    """
+    if not decoder.eof:
+        raise CompressedUploadError("La subida comprimida está incompleta: el flujo termina antes de tiempo.")
+
+
+def _compressed_chunks(data, encoding):
+    """
+    Comprime `data` por trozos mientras se envía, sin tener en memoria una
+    segunda copia completa ya comprimida.
+    """
+    compressor = _compressor(encoding)
+    view = memoryview(data)
+    for start in range(0, len(view), COMPRESS_CHUNK_BYTES):
+        chunk = compressor.compress(view[start:start + COMPRESS_CHUNK_BYTES])
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+class DecodingReader:
+    """
+    Envuelve el cuerpo de una petición con Content-Encoding y lo descomprime
+    a medida que el parser de formularios lo va leyendo.
+    """
+
+    def __init__(self, raw, encoding):
+        self.raw = raw
+        self._decoder = _decompressor(encoding)
+        self._pending = b''
+        self._offset = 0
+
+    def read(self, size=-1):
+        while self._offset >= len(self._pending):
+            chunk = self.raw.read(COMPRESS_CHUNK_BYTES)
+            if not chunk:
+                _check_decompressed(self._decoder)
+                return b''
+            self._pending = _decompress(self._decoder, chunk)
+            self._offset = 0
+        if size is None or size < 0:
+            size = len(self._pending) - self._offset
+        data = self._pending[self._offset:self._offset + size]
+        self._offset += len(data)
+        return data
+
+
+# --- SUBIDAS DE ARCHIVOS ---
+class StepUpload:
+    """
+    Un STEP subido, con su SHA-256 y su tamaño. El contenido está en
+    memoria (`data`) si es pequeño o en un archivo temporal (`path`) si
+    no, así se puede pasar a otros procesos sin copiarlo entero.
+    """
+
+    def __init__(self, data=None, path=None, digest=None, size=None):
+        self.data = data
+        self.path = path
+        self.digest = digest or hashlib.sha256(data).hexdigest()
+        self.size = len(data) if size is None else size
+
+    def open(self):
+        if self.data is not None:
+            return io.BytesIO(self.data)
+        return open(self.path, 'rb')
+
+    def read(self):
+        with self.open() as stream:
+            return stream.read()
+
+    def loaded(self):
+        """Copia en memoria, para usarla después de terminar la petición."""
+        if self.data is not None:
+            return self
+        return StepUpload(self.read(), digest=self.digest, size=self.size)
+
+
+class SpooledUpload:
+    """
+    Destino de un archivo subido mientras Werkzeug procesa el multipart: los
+    datos se acumulan en memoria hasta `max_memory` bytes y a partir de ahí
+    se vuelcan a un archivo temporal en `directory`. El SHA-256 se calcula
+    a medida que llegan los trozos; el archivo se borra al cerrarse.
+
+    Si `encoding` no es None, los trozos llegan comprimidos y se guardan ya
+    descomprimidos. `max_size` limita el tamaño descomprimido.
+    """
+
+    def __init__(self, max_memory, directory=None, encoding=None, max_size=None):
+        self.max_memory = max_memory
+        self.directory = directory
+        self.max_size = max_size
+        self.path = None
+        self.size = 0
+        self._file = io.BytesIO()
+        self._hash = hashlib.sha256()
+        self._decoder = _decompressor(encoding) if encoding is not None else None
+
+    def write(self, data):
+        if self._decoder is not None:
+            data = _decompress(self._decoder, data)
+        if self.max_size is not None and self.size + len(data) > self.max_size:
+            raise RequestEntityTooLarge()
+        self._hash.update(data)
+        self.size += len(data)
+        if self.path is None and self.size > self.max_memory:
+            fd, self.path = tempfile.mkstemp(suffix='.upload', dir=self.directory)
+            spilled = os.fdopen(fd, 'w+b')
+            spilled.write(self._file.getbuffer())
+            self._file = spilled
+        return self._file.write(data)
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def readline(self, size=-1):
+        return self._file.readline(size)
+
+    def seek(self, offset, whence=0):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def close(self):
+        self._file.close()
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def finish(self):
+        """Se llama al terminar de recibir el archivo."""
+        if self._decoder is not None:
+            _check_decompressed(self._decoder)
+
+    def upload(self):
+        """El StepUpload con lo recibido; válido hasta que se cierre."""
+        if self.path is None:
+            return StepUpload(self._file.getvalue(), digest=self._hash.hexdigest())
+        self._file.flush()
+        return StepUpload(path=self.path, digest=self._hash.hexdigest(),
+                          size=self.size)
+
+
+class UploadRequest(Request):
+    """
+    Petición cuyos archivos se reciben en SpooledUpload. Un formulario
+    enviado con Content-Encoding se descomprime mientras se procesa, y cada
+    archivo comprimido ('.stp.gz', '.step.zst') al guardarse.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        suffix = os.path.splitext(filename or '')[1].lower()
+        encoding = (COMPRESSED_SUFFIXES.get(suffix)
+                    or COMPRESSED_MIMETYPES.get((content_type or '').lower()))
+        if encoding not in CONTENT_ENCODINGS:
+            encoding = None
+        return SpooledUpload(UPLOAD_SPOOL_BYTES, UPLOAD_DIR, encoding,
+                             MAX_UPLOAD_MB * 1024 * 1024)
+
+    def _get_stream_for_parsing(self):
+        stream = super()._get_stream_for_parsing()
+        encoding = _content_encoding(self.headers.get('Content-Encoding'))
+        if encoding is None:
+            return stream
+        return DecodingReader(stream, encoding)
+
+    def _load_form_data(self):
+        # Leer el cuerpo de la petición es la etapa 'upload' de las métricas
+        if "form" in self.__dict__:
+            return
+        with METRICS.stage('upload'):
+            super()._load_form_data()
+        for _, file_storage in self.files.items(multi=True):
+            if isinstance(file_storage.stream, SpooledUpload):
+                file_storage.stream.finish()
+
+
+def _step_upload(file_storage):
+    """El StepUpload de un campo de archivo de la petición."""
+    stream = file_storage.stream
+    if isinstance(stream, SpooledUpload):
+        return stream.upload()
+    return StepUpload(file_storage.read())
+
+
+# Tamaño máximo de una petición y de cada archivo ya descomprimido
+# (CQ_MAX_UPLOAD_MB), memoria que puede ocupar cada archivo subido antes
+# de volcarse a disco
+# (CQ_UPLOAD_SPOOL_MB) y directorio de esos archivos (CQ_UPLOAD_DIR).
+MAX_UPLOAD_MB = _env_int('CQ_MAX_UPLOAD_MB', 512)
+UPLOAD_SPOOL_BYTES = _env_int('CQ_UPLOAD_SPOOL_MB', 8) * 1024 * 1024
+UPLOAD_DIR = os.environ.get('CQ_UPLOAD_DIR') or None
+
+app.request_class = UploadRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 1024 * 1024
+
+
+# --- FORMATOS DE SALIDA ---
+# Formato -> (extensión, mimetype). STEP conserva el mimetype original.
+OUTPUT_FORMATS = {
+    'step': ('.step', 'application/octet-stream'),
+    'brep': ('.brep', 'application/octet-stream'),
+    'stl': ('.stl', 'model/stl'),
+    'glb': ('.glb', 'model/gltf-binary'),
+    'mesh': ('.cqmesh', 'application/vnd.cadquery.mesh'),
+    'svg': ('.svg', 'image/svg+xml'),
+    'dxf': ('.dxf', 'image/vnd.dxf'),
+    'polyline': ('.json', 'application/json'),
+}
+
+# Contornos 2D (sección en Z = 0) que se obtienen con GearBase.outline sin
+# construir el sólido. Solo en /gears y para las clases de OUTLINE_CLASSES.
+OUTLINE_FORMATS = ('svg', 'dxf', 'polyline')
+OUTLINE_CLASSES = sorted(name for name, cls in GEAR_CLASSES.items()
+                         if cls._outline is not GearBase._outline)
+
+# Formatos que se obtienen triangulando la pieza con una única tolerancia
+MESH_FORMATS = ('stl', 'glb')
+
+# Negociación por cabecera Accept; el primero es el que se elige con */*
+ACCEPT_FORMATS = {
+    'application/step': 'step',
+    'model/step': 'step',
+    'application/x-brep': 'brep',
+    'model/stl': 'stl',
+    'model/gltf-binary': 'glb',
+    'application/vnd.cadquery.mesh': 'mesh',
+}
+
+# Deflexión lineal (unidades del modelo) y angular (radianes) por defecto
+DEFAULT_TOLERANCE = 0.1
+DEFAULT_ANGULAR_TOLERANCE = 0.1
+
+# Niveles de detalle por defecto del formato 'mesh': deflexión lineal como
+# fracción de la diagonal de la caja envolvente y deflexión angular.
+DEFAULT_LODS = ((0.01, 0.5), (0.002, 0.25), (0.0005, 0.1))
+MAX_LODS = 8
+
+
+def _requested_output(params, outline=False):
+    """
+    Determina el formato de salida pedido: el parámetro 'format' (en el JSON,
+    el formulario o la query string) o, si no se indica, la cabecera Accept.
+    Para STL y GLB también lee 'tolerance' y 'angular_tolerance', y para
+    'mesh' los niveles de detalle de 'lods'. Los formatos de contorno 2D
+    solo se aceptan con `outline`.
+    """
+    def param(name):
+        return params.get(name) or request.args.get(name)
+
+    fmt = param('format')
+    if not fmt:
+        mimetype = request.accept_mimetypes.best_match(list(ACCEPT_FORMATS))
+        fmt = ACCEPT_FORMATS.get(mimetype, 'step')
+    fmt = fmt.lower()
+
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Formato de salida no soportado: {fmt!r}. Opciones: {', '.join(OUTPUT_FORMATS)}.")
+    if fmt in OUTLINE_FORMATS and not outline:
+        raise ValueError(f"El formato {fmt!r} es un contorno 2D de engrane y solo está disponible en /gears.")
+
+    output = {"fmt": fmt}
+    if fmt in MESH_FORMATS:
+        output["tolerance"] = float(param('tolerance') or DEFAULT_TOLERANCE)
+        output["angular_tolerance"] = float(param('angular_tolerance') or DEFAULT_ANGULAR_TOLERANCE)
+        if output["tolerance"] <= 0 or output["angular_tolerance"] <= 0:
+            raise ValueError("'tolerance' y 'angular_tolerance' deben ser mayores que 0.")
+    if fmt == 'mesh':
+        output["lods"] = _requested_lods(param('lods'))
+    return output
+
+
+def _requested_lods(value):
+    """
+    Lee los niveles de detalle de 'lods': una lista (o su JSON, en un
+    formulario) de objetos {"tolerance", "angular_tolerance"}. Devuelve
+    pares [tolerance, angular_tolerance], o None si no se indican.
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            raise ValueError("'lods' debe ser una lista en JSON.")
+    if not isinstance(value, list) or not 1 <= len(value) <= MAX_LODS:
+        raise ValueError(f"'lods' debe ser una lista de 1 a {MAX_LODS} niveles.")
+
+    lods = []
+    for lod in value:
+        try:
+            tolerance = float(lod['tolerance'])
+            angular_tolerance = float(lod.get('angular_tolerance', DEFAULT_ANGULAR_TOLERANCE))
+        except (TypeError, KeyError, ValueError, AttributeError):
+            raise ValueError("Cada nivel de 'lods' necesita un 'tolerance' numérico y, opcionalmente, 'angular_tolerance'.")
+        if tolerance <= 0 or angular_tolerance <= 0:
+            raise ValueError("'tolerance' y 'angular_tolerance' deben ser mayores que 0.")
+        lods.append([tolerance, angular_tolerance])
+    return lods
+
+
+def _download_name(stem, output):
+    return stem + OUTPUT_FORMATS[output["fmt"]][0]
+
+
+def _send_model_bytes(data, download_name, cache_status=None):
+    """
+    Envía un modelo ya serializado en memoria como archivo adjunto. Si el
+    cliente acepta gzip o zstd (Accept-Encoding), se envía comprimido.
+    """
+    ext = os.path.splitext(download_name)[1]
+    mimetype = next((mime for e, mime in OUTPUT_FORMATS.values() if e == ext),
+                    'application/octet-stream')
+    encoding = None
+    if len(data) >= COMPRESS_MIN_BYTES:
+        encoding = request.accept_encodings.best_match(CONTENT_ENCODINGS)
+
+    if encoding is None:
+        response = send_file(io.BytesIO(data), as_attachment=True,
+                             download_name=download_name,
+                             mimetype=mimetype)
+    else:
+        response = Response(_compressed_chunks(data, encoding), mimetype=mimetype)
+        response.headers['Content-Encoding'] = encoding
+        response.headers.set('Content-Disposition', 'attachment',
+                             filename=download_name)
+    response.vary.add('Accept-Encoding')
+    if cache_status is not None:
+        response.headers['X-Cache'] = cache_status
+    return response
+
+# --- EJECUCIÓN DE SCRIPTS DE CADQUERY ---
+# Estas funciones se usan tanto en los endpoints síncronos como en los
+# procesos de la cola de trabajos, por eso reciben y devuelven bytes.
+class ScriptResultError(Exception):
+    """El script se ejecutó, pero no dejó ningún Workplane o Shape."""
+
+
+def _find_result(local_scope):
+    """Busca en el 'local_scope' el resultado que ha dejado el script."""
+    for val in local_scope.values():
+        if isinstance(val, (cq.Workplane, cq.Shape)):
+            return val
+    return None
+
+
+def _to_shape(result):
+    """Convierte un Workplane en un Compound, igual que cq.exporters.export."""
+    if isinstance(result, cq.Workplane):
+        return cq.Compound.makeCompound(
+            val for val in result.vals() if isinstance(val, cq.Shape))
+    return result
+
+
+def _export_step_bytes(result):
+    """
+    Exporta un Workplane o Shape a STEP en memoria, con el writer de OCC
+    basado en streams y la misma configuración que Shape.exportStep.
+    """
+    writer = STEPControl_Writer()
+    Interface_Static.SetIVal_s("write.surfacecurve.mode", 1)
+    Interface_Static.SetIVal_s("write.precision.mode", 0)
+    writer.Transfer(_to_shape(result).wrapped, STEPControl_AsIs)
+
+    stream = io.BytesIO()
+    if writer.WriteStream(stream) != IFSelect_RetDone:
+        raise ValueError("No se pudo exportar el modelo a STEP.")
+    return stream.getvalue()
+
+
+def _import_step(upload):
+    """
+    Importa un StepUpload leyéndolo como stream, desde memoria o desde su
+    archivo temporal. Devuelve un Workplane con las formas raíz, igual que
+    cq.importers.importStep.
+    """
+    reader = STEPControl_Reader()
+    with upload.open() as stream:
+        status = reader.ReadStream("upload.step", stream)
+    if status != IFSelect_RetDone:
+        raise ValueError("STEP File could not be loaded")
+    for i in range(reader.NbRootsForTransfer()):
+        reader.TransferRoot(i + 1)
+
+    shapes = [cq.Shape.cast(reader.Shape(i + 1))
+              for i in range(reader.NbShapes())]
+    return cq.Workplane("XY").newObject(shapes)
+
+
+def mesh_arrays(shape, tolerance=DEFAULT_TOLERANCE,
+                angular_tolerance=DEFAULT_ANGULAR_TOLERANCE):
+    """
+    Triangula una forma con el mallador de OCC (en paralelo) y devuelve
+    (vértices, triángulos, normales) como arrays de NumPy: float32 (n, 3),
+    uint32 (m, 3) y float32 (n, 3). Las normales son por vértice y se
+    promedian solo dentro de cada cara, así las aristas quedan marcadas.
+    """
+    BRepMesh_IncrementalMesh(shape.wrapped, tolerance, False,
+                             angular_tolerance, True)
+
+    face_map = TopTools_IndexedMapOfShape()
+    TopExp.MapShapes_s(shape.wrapped, TopAbs_FACE, face_map)
+
+    vertex_blocks, triangle_blocks = [], []
+    offset = 0
+    for j in range(1, face_map.Extent() + 1):
+        face = TopoDS.Face_s(face_map.FindKey(j))
+        loc = TopLoc_Location()
+        poly = BRep_Tool.Triangulation_s(face, loc)
+        if poly is None:
+            continue
+
+        trsf = loc.Transformation()
+        nodes = np.array([poly.Node(i).Transformed(trsf).Coord()
+                          for i in range(1, poly.NbNodes() + 1)])
+        triangles = np.array([poly.Triangle(i).Get()
+                              for i in range(1, poly.NbTriangles() + 1)]) - 1
+        if face.Orientation() == TopAbs_REVERSED:
+            triangles = triangles[:, ::-1]
+
+        vertex_blocks.append(nodes)
+        triangle_blocks.append(triangles + offset)
+        offset += len(nodes)
+
+    if not vertex_blocks:
+        raise ValueError("El modelo no tiene caras que triangular.")
+
+    vertices = np.concatenate(vertex_blocks).astype(np.float32)
+    triangles = np.concatenate(triangle_blocks).astype(np.uint32)
+
+    # Normales de cara ponderadas por área, acumuladas en sus vértices
+    corners = vertices[triangles]
+    face_normals = np.cross(corners[:, 1] - corners[:, 0],
+                            corners[:, 2] - corners[:, 0])
+    normals = np.zeros_like(vertices)
+    for k in range(3):
+        np.add.at(normals, triangles[:, k], face_normals)
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    normals /= np.where(lengths > 0.0, lengths, 1.0)
+
+    return vertices, triangles, normals
+
+
+def _stl_bytes(vertices, triangles):
+    """Escribe un STL binario a partir de los arrays de mesh_arrays."""
+    corners = vertices[triangles]
+    normals = np.cross(corners[:, 1] - corners[:, 0],
+                       corners[:, 2] - corners[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    normals /= np.where(lengths > 0.0, lengths, 1.0)
+
+    records = np.zeros(len(triangles), dtype=[('normal', '<f4', (3,)),
+                                              ('corners', '<f4', (3, 3)),
+                                              ('attributes', '<u2')])
+    records['normal'] = normals
+    records['corners'] = corners
+
+    header = b'cadquery-service binary STL'.ljust(80, b' ')
+    return header + struct.pack('<I', len(triangles)) + records.tobytes()
+
+
+def _glb_bytes(vertices, triangles, normals):
+    """Escribe un glTF binario (GLB) con una sola malla indexada."""
+    buffers = [vertices.astype('<f4').tobytes(),
+               normals.astype('<f4').tobytes(),
+               triangles.astype('<u4').tobytes()]
+    offsets = np.cumsum([0] + [len(b) for b in buffers]).tolist()
+    binary = b''.join(buffers)
+
+    gltf = {
+        "asset": {"version": "2.0", "generator": "cadquery-service"},
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [{"mesh": 0}],
+        "meshes": [{"primitives": [{
+            "attributes": {"POSITION": 0, "NORMAL": 1},
+            "indices": 2,
+            "mode": 4,
+        }]}],
+        "buffers": [{"byteLength": len(binary)}],
+        "bufferViews": [
+            {"buffer": 0, "byteOffset": offsets[0], "byteLength": len(buffers[0]), "target": 34962},
+            {"buffer": 0, "byteOffset": offsets[1], "byteLength": len(buffers[1]), "target": 34962},
+            {"buffer": 0, "byteOffset": offsets[2], "byteLength": len(buffers[2]), "target": 34963},
+        ],
+        "accessors": [
+            {"bufferView": 0, "componentType": 5126, "count": len(vertices), "type": "VEC3",
+             "min": vertices.min(axis=0).tolist(), "max": vertices.max(axis=0).tolist()},
+            {"bufferView": 1, "componentType": 5126, "count": len(normals), "type": "VEC3"},
+            {"bufferView": 2, "componentType": 5125, "count": triangles.size, "type": "SCALAR"},
+        ],
+    }
+
+    # Los chunks deben estar alineados a 4 bytes
+    json_chunk = json.dumps(gltf, separators=(',', ':')).encode('utf-8')
+    json_chunk += b' ' * (-len(json_chunk) % 4)
+    binary += b'\x00' * (-len(binary) % 4)
+
+    length = 12 + 8 + len(json_chunk) + 8 + len(binary)
+    return b''.join((
+        struct.pack('<4sII', b'glTF', 2, length),
+        struct.pack('<I4s', len(json_chunk), b'JSON'), json_chunk,
+        struct.pack('<I4s', len(binary), b'BIN\x00'), binary,
+    ))
+
+
+def _mesh_lods_bytes(shape, lods=None):
+    """
+    Triangula la forma a varios niveles de detalle y los empaqueta en un
+    único binario little-endian para visores web:
+
+        cabecera   4s b'CQMS', u32 versión (1), u32 número de niveles
+        por nivel  f32 tolerance, f32 angular_tolerance, u32 vértices,
+                   u32 triángulos, u32 offset, u32 longitud en bytes
+        datos      por nivel, a partir de su offset: vértices f32 (n, 3),
+                   normales f32 (n, 3) e índices u32 (m, 3)
+
+    Sin `lods` se usan DEFAULT_LODS, relativos al tamaño de la pieza. Los
+    niveles se mallan de grueso a fino sobre la misma forma: el mallador de
+    OCC solo rehace las caras cuya malla no llega a la nueva tolerancia.
+    """
+    if lods is None:
+        diagonal = shape.BoundingBox().DiagonalLength
+        lods = [[diagonal * fraction, angle] for fraction, angle in DEFAULT_LODS]
+
+    # Una malla previa más fina impediría obtener los niveles gruesos
+    BRepTools.Clean_s(shape.wrapped)
+    order = sorted(range(len(lods)), key=lambda i: (-lods[i][0], -lods[i][1]))
+    meshes = {i: mesh_arrays(shape, *lods[i]) for i in order}
+
+    header_size = 12 + 24 * len(lods)
+    table, blocks = [], []
+    offset = header_size
+    for i, (tolerance, angular_tolerance) in enumerate(lods):
+        vertices, triangles, normals = meshes[i]
+        block = b''.join((vertices.astype('<f4').tobytes(),
+                          normals.astype('<f4').tobytes(),
+                          triangles.astype('<u4').tobytes()))
+        table.append(struct.pack('<ffIIII', tolerance, angular_tolerance,
+                                 len(vertices), len(triangles),
+                                 offset, len(block)))
+        blocks.append(block)
+        offset += len(block)
+
+    return b''.join([struct.pack('<4sII', b'CQMS', 1, len(lods))] + table + blocks)
+
+
+def export_model_bytes(result, fmt='step', tolerance=DEFAULT_TOLERANCE,
+                       angular_tolerance=DEFAULT_ANGULAR_TOLERANCE, lods=None):
+    """Serializa un Workplane o Shape en memoria en el formato pedido."""
+    with METRICS.stage('export'):
+        return _export_model_bytes(result, fmt, tolerance, angular_tolerance,
+                                   lods)
+
+
+def _export_model_bytes(result, fmt, tolerance, angular_tolerance, lods):
+    if fmt == 'step':
+        return _export_step_bytes(result)
+
+    shape = _to_shape(result)
+    if fmt == 'brep':
+        return _shapes_to_brep([shape])
+    if fmt == 'mesh':
+        return _mesh_lods_bytes(shape, lods)
+
+    vertices, triangles, normals = mesh_arrays(shape, tolerance,
+                                               angular_tolerance)
+    if fmt == 'stl':
+        return _stl_bytes(vertices, triangles)
+    if fmt == 'glb':
+        return _glb_bytes(vertices, triangles, normals)
+
+    raise ValueError(f"Formato de salida no soportado: {fmt!r}")
+
+
+def _shapes_to_brep(shapes):
+    """Serializa una lista de formas como un Compound en BREP binario."""
+    stream = io.BytesIO()
+    # Sin triangulación y en la versión 3 del formato: la versión 4 de
+    # OCC 7.7 no relee algunas formas que ella misma escribe.
+    BinTools.Write_s(cq.Compound.makeCompound(shapes).wrapped, stream,
+                     False, False, BinTools_FormatVersion_VERSION_3)
+    return stream.getvalue()
+
+
+def _shapes_from_brep(brep_data):
+    """Recupera la lista de formas guardada por _shapes_to_brep."""
+    compound = TopoDS_Shape()
+    BinTools.Read_s(compound, io.BytesIO(brep_data))
+    shapes = []
+    iterator = TopoDS_Iterator(compound)
+    while iterator.More():
+        shapes.append(cq.Shape.cast(iterator.Value()))
+        iterator.Next()
+    return shapes
+
+
+def import_step_cached(upload):
+    """
+    Igual que _import_step, pero consulta antes STEP_CACHE: si ya se
+    importó un archivo con el mismo SHA-256 (calculado al recibirlo), las
+    formas se cargan desde su BREP binario sin volver a interpretar el STEP.
+    """
+    with METRICS.stage('import'):
+        brep_data = STEP_CACHE.get(upload.digest)
+        if brep_data is not None:
+            return cq.Workplane("XY").newObject(_shapes_from_brep(brep_data))
+
+        imported_wp = _import_step(upload)
+        STEP_CACHE.put(upload.digest, _shapes_to_brep(imported_wp.vals()))
+        return imported_wp
+
+
+# --- COMPILACIÓN Y ANÁLISIS ESTÁTICO DE SCRIPTS ---
+class CompiledScript:
+    """
+    Un script ya compilado, junto con los engranes de cq_gears que construye
+    con argumentos literales (`gear_specs`, en el formato de /gears).
+    """
+
+    def __init__(self, digest, code, gear_specs):
+        self.digest = digest
+        self.code = code
+        self.gear_specs = gear_specs
+
+    def __reduce__(self):
+        # pickle no sabe serializar objetos código, marshal sí
+        return (_unmarshal_script,
+                (self.digest, marshal.dumps(self.code), self.gear_specs))
+
+
+def _unmarshal_script(digest, code_data, gear_specs):
+    return CompiledScript(digest, marshal.loads(code_data), gear_specs)
+
+
+def _literal_arguments(args, keywords):
+    """(args, kwargs) de una llamada si todos son literales; si no, None."""
+    if any(isinstance(arg, ast.Starred) for arg in args) \
+            or any(kw.arg is None for kw in keywords):
+        return None
+    try:
+        return ([ast.literal_eval(arg) for arg in args],
+                {kw.arg: ast.literal_eval(kw.value) for kw in keywords})
+    except (ValueError, TypeError, SyntaxError, RecursionError):
+        return None
+
+
+def find_gear_specs(tree):
+    """
+    Busca en el AST de un script los engranes que se construyen con
+    argumentos literales: `Workplane.gear(SpurGear(...), bore_d=...)`,
+    `addGear(...)` y `SpurGear(...).build(...)`, también a través de una
+    variable asignada una sola vez que solo se usa en esas llamadas (si se
+    toca un atributo o se pasa a otra función, el engrane puede cambiar
+    antes de construirse). Devuelve especificaciones de /gears.
+    """
+    def gear_constructor(node):
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) \
+                and node.func.id in GEAR_CLASSES:
+            literal = _literal_arguments(node.args, node.keywords)
+            if literal is not None:
+                return {"class": node.func.id,
+                        "args": literal[0], "kwargs": literal[1]}
+        return None
+
+    assigned = {}
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            for target in targets:
+                if isinstance(target, ast.Name):
+                    # Una variable reasignada ya no identifica un engrane
+                    first = target.id not in assigned
+                    assigned[target.id] = (gear_constructor(node.value)
+                                           if first and node.value is not None
+                                           else None)
+
+    parents = {child: node for node in ast.walk(tree)
+               for child in ast.iter_child_nodes(node)}
+
+    def built_as_is(name):
+        parent = parents.get(name)
+        if isinstance(parent, ast.Call) and isinstance(parent.func, ast.Attribute) \
+                and parent.func.attr in ('gear', 'addGear') \
+                and len(parent.args) == 1 and parent.args[0] is name:
+            return True
+        return isinstance(parent, ast.Attribute) and parent.attr == 'build' \
+            and getattr(parents.get(parent), 'func', None) is parent
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Store) \
+                and not built_as_is(node):
+            assigned[node.id] = None
+
+    def gear_of(node):
+        if isinstance(node, ast.Name):
+            return assigned.get(node.id)
+        return gear_constructor(node)
+
+    specs = {}
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call) or not isinstance(node.func, ast.Attribute):
+            continue
+        if node.func.attr in ('gear', 'addGear') and len(node.args) == 1:
+            gear = gear_of(node.args[0])
+        elif node.func.attr == 'build' and not node.args:
+            gear = gear_of(node.func.value)
+        else:
+            continue
+
+        build_args = _literal_arguments([], node.keywords)
+        if gear is None or build_args is None:
+            continue
+        spec = dict(gear, build_args=build_args[1])
+        try:
+            spec = normalize_gear_spec(spec)
+        except GearSpecError:
+            continue
+        specs[json.dumps(spec, sort_keys=True)] = spec
+
+    return list(specs.values())
+
+
+class ScriptCache:
+    """
+    LRU de scripts compilados, indexada por el SHA-256 de su código fuente.
+    Los clientes basados en plantillas repiten los mismos scripts miles de
+    veces: así solo se compilan y analizan una vez.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._scripts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compile(self, source):
+        """Devuelve el CompiledScript de `source`; lanza SyntaxError."""
+        if isinstance(source, CompiledScript):
+            return source
+
+        digest = hashlib.sha256(source.encode('utf-8')).hexdigest()
+        with self._lock:
+            script = self._scripts.get(digest)
+            if script is not None:
+                self._scripts.move_to_end(digest)
+                self.hits += 1
+                return script
+            self.misses += 1
+
+        tree = ast.parse(source, '<string>')
+        script = CompiledScript(digest, compile(tree, '<string>', 'exec'),
+                                find_gear_specs(tree))
+
+        with self._lock:
+            self._scripts[digest] = script
+            while len(self._scripts) > self.max_entries:
+                self._scripts.popitem(last=False)
+        return script
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._scripts),
+                    "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses}
+
+
+# Número de scripts compilados que se conservan (CQ_SCRIPT_CACHE_ENTRIES)
+SCRIPT_CACHE = ScriptCache(max_entries=_env_int('CQ_SCRIPT_CACHE_ENTRIES', 256))
+
+
+def _preload_gear_builds(prebuilt):
+    """
+    Deja en GearBase.build_cache los engranes que el proceso padre ya
+    construyó (pares (spec, BREP) de prebuild_gears), para que el script
+    los encuentre hechos al llamar a build().
+    """
+    if GearBase.build_cache is None:
+        return
+    for spec, brep_data in prebuilt:
+        gear = GEAR_CLASSES[spec["class"]](*spec["args"], **spec["kwargs"])
+        GearBase.build_cache.put(gear.build_key(**spec["build_args"]),
+                                 _shapes_from_brep(brep_data)[0])
+
+
+def run_generate_script(script_code, output=None, prebuilt=()):
+    """
+    Ejecuta un script de /generate y devuelve el modelo resultante
+    serializado según `output` (ver _requested_output; STEP por defecto).
+    `script_code` puede ser el código fuente o un CompiledScript, y
+    `prebuilt` los engranes precalculados por prebuild_gears.
+    """
+    script = SCRIPT_CACHE.compile(script_code)
+    _preload_gear_builds(prebuilt)
+
+    local_scope = {}
+    with METRICS.stage('exec'):
+        exec(script.code, CQ_EXEC_SCOPE, local_scope)
+
+    result_solid = _find_result(local_scope)
+    if result_solid is None:
+        raise ScriptResultError("No se encontró un objeto 'Workplane' o 'Shape' de CadQuery en el resultado del script.")
+
+    return export_model_bytes(result_solid, **(output or {}))
+
+
+def _exec_modify_script(script_code, model):
+    """Ejecuta un script de modificación sobre `model` y devuelve el resultado."""
+    script = SCRIPT_CACHE.compile(script_code)
+    local_scope = {'model': model}
+    with METRICS.stage('exec'):
+        exec(script.code, {"cq": cq}, local_scope)
+
+    result_solid = _find_result(local_scope)
+    if result_solid is None:
+        raise ScriptResultError("No se encontró un objeto resultante en el script de modificación.")
+    return result_solid
+
+
+def run_modify_script(upload, script_code, output=None):
+    """Aplica un script de /modify sobre un StepUpload y devuelve el resultado."""
+    script = SCRIPT_CACHE.compile(script_code)
+    result_solid = _exec_modify_script(script, import_step_cached(upload))
+    return export_model_bytes(result_solid, **(output or {}))
+
+
+def run_modify_script_brep(upload, script_code, output=None, step_brep=None):
+    """
+    Como run_modify_script, pero sin tocar STEP_CACHE, para procesos cuya
+    caché se pierde (el sandbox): el modelo llega ya importado en
+    `step_brep` o se importa aquí. Devuelve (modelo serializado, BREP del
+    STEP importado o None si venía en `step_brep`) para que el padre
+    rellene su STEP_CACHE.
+    """
+    script = SCRIPT_CACHE.compile(script_code)
+    model, imported = _import_step_brep(upload, step_brep)
+    result_solid = _exec_modify_script(script, model)
+    return export_model_bytes(result_solid, **(output or {})), imported
+
+
+def _import_step_brep(upload, step_brep):
+    """
+    El modelo de un StepUpload en un proceso sin STEP_CACHE propia: desde
+    `step_brep` si el padre ya lo tenía o importándolo aquí. Devuelve
+    (modelo, BREP del STEP importado o None).
+    """
+    with METRICS.stage('import'):
+        if step_brep is not None:
+            return cq.Workplane("XY").newObject(_shapes_from_brep(step_brep)), None
+        model = _import_step(upload)
+        return model, _shapes_to_brep(model.vals())
+
+
+def convert_step_brep(upload, output=None, step_brep=None):
+    """
+    Importa un StepUpload (o toma su `step_brep`) y lo vuelve a serializar
+    según `output`. Como run_modify_script_brep, no toca STEP_CACHE y
+    devuelve (modelo serializado, BREP del STEP importado o None).
+    """
+    model, imported = _import_step_brep(upload, step_brep)
+    return export_model_bytes(model, **(output or {})), imported
+
+
+def _convert_cache_key(upload, output):
+    return RESULT_CACHE.key('convert', upload.digest,
+                            cq.__version__, json.dumps(output, sort_keys=True))
+
+
+def _generate_cache_key(script_code, output):
+    # La clave incluye las versiones de las librerías: una actualización de
+    # cadquery o cq_gears puede cambiar la geometría generada.
+    return RESULT_CACHE.key(script_code, cq.__version__, cq_gears.__version__,
+                            json.dumps(output, sort_keys=True))
+
+
+# --- ENGRANES DESCRITOS EN JSON ---
+class GearSpecError(ValueError):
+    """La especificación JSON de un engrane no es válida."""
+
+
+def normalize_gear_spec(spec):
+    """
+    Valida una especificación de /gears y la devuelve en forma canónica:
+    {"class", "args", "kwargs", "build_args"}. Construye el objeto (sin
+    generar el sólido) para que los errores de parámetros salgan aquí.
+    """
+    if not isinstance(spec, dict):
+        raise GearSpecError("La especificación debe ser un objeto JSON.")
+
+    class_name = spec.get('class')
+    if class_name not in GEAR_CLASSES:
+        raise GearSpecError(f"Clase de engrane desconocida: {class_name!r}. Opciones: {', '.join(sorted(GEAR_CLASSES))}.")
+
+    normalized = {
+        "class": class_name,
+        "args": spec.get('args', []),
+        "kwargs": spec.get('kwargs', {}),
+        "build_args": spec.get('build_args', {}),
+    }
+    if not isinstance(normalized["args"], list):
+        raise GearSpecError("'args' debe ser una lista.")
+    if not isinstance(normalized["kwargs"], dict) or not isinstance(normalized["build_args"], dict):
+        raise GearSpecError("'kwargs' y 'build_args' deben ser objetos.")
+
+    gear_cls = GEAR_CLASSES[class_name]
+    try:
+        # Se valida contra __init__: GearBase.__new__ acepta cualquier cosa
+        inspect.signature(gear_cls.__init__).bind(
+            None, *normalized["args"], **normalized["kwargs"])
+        gear_cls(*normalized["args"], **normalized["kwargs"])
+    except (TypeError, ValueError, AssertionError) as e:
+        raise GearSpecError(f"Parámetros inválidos para {class_name}: {str(e)}")
+
+    return normalized
+
+
+def build_gear_spec(spec, output=None):
+    """Construye el engrane de una especificación normalizada y lo serializa."""
+    gear_cls = GEAR_CLASSES[spec["class"]]
+    gear = gear_cls(*spec["args"], **spec["kwargs"])
+    if output and output["fmt"] in OUTLINE_FORMATS:
+        return outline_gear_bytes(gear, output["fmt"], spec["build_args"])
+    with METRICS.stage('build'):
+        body = gear.build(**spec["build_args"])
+    return export_model_bytes(body, **(output or {}))
+
+
+def outline_gear_bytes(gear, fmt, build_args):
+    """
+    Serializa el contorno 2D de un engrane sin construir el sólido: taladro,
+    radios y dientes ausentes se aplican como operaciones sobre polígonos.
+    'polyline' es un JSON con los lazos cerrados (el exterior primero).
+    """
+    with METRICS.stage('outline'):
+        if fmt == 'polyline':
+            loops = gear.outline(**build_args)
+            return json.dumps({"units": "mm",
+                               "loops": [loop.tolist() for loop in loops]}).encode('utf-8')
+        return gear.export_outline(fmt, **build_args).encode('utf-8')
+
+
+def _gear_cache_key(spec, output):
+    return RESULT_CACHE.key('gears', json.dumps(spec, sort_keys=True),
+                            cq.__version__, cq_gears.__version__,
+                            json.dumps(output, sort_keys=True))
+
+
+# Peticiones idénticas en curso: clave -> Future con el resultado compartido
+_INFLIGHT = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+
+def _coalesced(key, fn, *args):
+    """
+    Ejecuta `fn(*args)` una sola vez para todas las peticiones simultáneas
+    con la misma clave; las demás esperan y reciben el mismo resultado.
+    """
+    with _INFLIGHT_LOCK:
+        future = _INFLIGHT.get(key)
+        owner = future is None
+        if owner:
+            future = _INFLIGHT[key] = Future()
+
+    if not owner:
+        return future.result()
+
+    try:
+        future.set_result(fn(*args))
+    except BaseException as e:
+        future.set_exception(e)
+    finally:
+        with _INFLIGHT_LOCK:
+            del _INFLIGHT[key]
+    return future.result()
+
+
+def prebuild_gears(gear_specs):
+    """
+    Precalcula los engranes que un script va a construir, antes de
+    ejecutarlo. Se guardan en RESULT_CACHE como BREP (las mismas entradas
+    que /gears con format=brep) y se devuelven como pares (spec, BREP)
+    para run_generate_script. Los que fallan se omiten: el script dará
+    su propio error. Solo sirve si el script usará GearBase.build_cache,
+    que en el sandbox solo existe si está configurada (SANDBOX_GEAR_CACHE).
+    """
+    if not (SANDBOX_GEAR_CACHE if SCRIPT_SANDBOX.enabled
+            else GearBase.build_cache is not None):
+        return []
+
+    output = {"fmt": "brep"}
+    prebuilt = []
+    for spec in gear_specs:
+        key = _gear_cache_key(spec, output)
+        brep_data = RESULT_CACHE.get(key)
+        if brep_data is None:
+            try:
+                brep_data = _coalesced(key, _execute_script,
+                                       build_gear_spec, spec, output)
+            except ResourceExceededError:
+                raise
+            except Exception:
+                continue
+            RESULT_CACHE.put(key, brep_data)
+        prebuilt.append((spec, brep_data))
+    return prebuilt
+
+
+# --- ANÁLISIS DE SÓLIDOS ---
+# Tipos de cara en un orden fijo, para indexarlos en arrays
+FACE_KINDS = tuple(dict.fromkeys(geom_LUT_FACE.values()))
+_FACE_KIND_INDEX = {geom: FACE_KINDS.index(kind) for geom, kind in geom_LUT_FACE.items()}
+HISTOGRAM_BINS = 10
+
+
+def _histogram(values):
+    counts, bin_edges = np.histogram(values, bins=HISTOGRAM_BINS)
+    return {"bin_edges": bin_edges.tolist(), "counts": counts.tolist()}
+
+
+def _face_kind_totals(kinds, weights=None):
+    """Suma por tipo de cara (o cuenta, sin `weights`), omitiendo los ceros."""
+    totals = np.bincount(kinds, weights=weights, minlength=len(FACE_KINDS))
+    return {FACE_KINDS[i]: totals[i].item() for i in np.flatnonzero(totals)}
+
+
+def _oriented_bounding_box(shape):
+    obb = Bnd_OBB()
+    BRepBndLib.AddOBB_s(shape, obb, True, False, False)
+    center = obb.Center()
+    return {
+        "center": {"x": center.X(), "y": center.Y(), "z": center.Z()},
+        "axes": [[d.X(), d.Y(), d.Z()]
+                 for d in (obb.XDirection(), obb.YDirection(), obb.ZDirection())],
+        "lengths": [2 * obb.XHSize(), 2 * obb.YHSize(), 2 * obb.ZHSize()],
+    }
+
+
+def analyze_solid(solid_shape, solid_index):
+    """
+    Analiza un sólido en una sola pasada: los mapas de topología se
+    construyen una vez con TopExp, las propiedades de masa se calculan una
+    vez con GProp y las caras y aristas se recorren en un único bucle cada
+    una. Las medidas por cara y por arista se guardan en arrays de NumPy y
+    los totales y los histogramas se calculan sobre ellos.
+    """
+    shape = solid_shape.wrapped
+
+    face_map = TopTools_IndexedMapOfShape()
+    edge_map = TopTools_IndexedMapOfShape()
+    vertex_map = TopTools_IndexedMapOfShape()
+    TopExp.MapShapes_s(shape, TopAbs_FACE, face_map)
+    TopExp.MapShapes_s(shape, TopAbs_EDGE, edge_map)
+    TopExp.MapShapes_s(shape, TopAbs_VERTEX, vertex_map)
+
+    props = GProp_GProps()
+    BRepGProp.VolumeProperties_s(shape, props)
+    center = props.CentreOfMass()
+    # Tensor de inercia respecto al centro de masas, con densidad 1
+    matrix = props.MatrixOfInertia()
+    inertia = np.array([[matrix.Value(i, j) for j in range(1, 4)] for i in range(1, 4)])
+    principal_moments, principal_axes = np.linalg.eigh(inertia)
+
+    face_kinds = np.empty(face_map.Extent(), dtype=np.intp)
+    face_areas = np.empty(face_map.Extent())
+    for j in range(1, face_map.Extent() + 1):
+        face = TopoDS.Face_s(face_map.FindKey(j))
+        face_kinds[j - 1] = _FACE_KIND_INDEX[BRepAdaptor_Surface(face).GetType()]
+        face_props = GProp_GProps()
+        BRepGProp.SurfaceProperties_s(face, face_props)
+        face_areas[j - 1] = face_props.Mass()
+
+    edge_lengths = np.empty(edge_map.Extent())
+    for j in range(1, edge_map.Extent() + 1):
+        edge_props = GProp_GProps()
+        BRepGProp.LinearProperties_s(edge_map.FindKey(j), edge_props)
+        edge_lengths[j - 1] = edge_props.Mass()
+
+    bounds = solid_shape.BoundingBox()
+
+    return {
+        "solid_index": solid_index,
+        "volume": props.Mass(),
+        "center_of_mass": {
+            "x": center.X(),
+            "y": center.Y(),
+            "z": center.Z(),
+        },
+        "bounding_box": {
+            "length_x": bounds.xlen,
+            "length_y": bounds.ylen,
+            "length_z": bounds.zlen,
+        },
+        "oriented_bounding_box": _oriented_bounding_box(shape),
+        "surface_area": face_areas.sum().item(),
+        "inertia": {
+            "tensor": inertia.tolist(),
+            "principal_moments": principal_moments.tolist(),
+            # Un eje principal por fila, en el orden de los momentos
+            "principal_axes": principal_axes.T.tolist(),
+        },
+        "topology": {
+            "faces": face_map.Extent(),
+            "edges": edge_map.Extent(),
+            "vertices": vertex_map.Extent(),
+        },
+        "face_types": _face_kind_totals(face_kinds),
+        "face_type_areas": _face_kind_totals(face_kinds, face_areas),
+        "histograms": {
+            "face_area": _histogram(face_areas),
+            "edge_length": _histogram(edge_lengths),
+        },
+    }
+
+
+class NoSolidsError(ValueError):
+    """El archivo STEP se pudo leer, pero no contiene sólidos."""
+
+
+def analyze_step_file(file_name, upload):
+    """Importa un StepUpload y devuelve el informe de /analyze de sus sólidos."""
+    # --- LÍNEA CORREGIDA ---
+    # Usamos .solids().vals() para extraer los objetos Shape.
+    solids = import_step_cached(upload).solids().vals()
+
+    if not solids:
+        raise NoSolidsError("No se encontraron sólidos en el archivo STEP proporcionado.")
+
+    with METRICS.stage('analyze'):
+        reports = [analyze_solid(solid_shape, i + 1)
+                   for i, solid_shape in enumerate(solids)]
+
+    return {
+        "file_name": file_name,
+        "summary": {
+            "total_solids": len(solids),
+        },
+        "solids": reports
+    }
+
+
+def analyze_batch_item(file_name, upload, mode='full'):
+    """
+    Analiza un archivo de un lote. Nunca lanza excepciones: los errores se
+    devuelven en el informe del archivo para no hacer fallar al resto.
+    """
+    start = time.perf_counter()
+    try:
+        report = ANALYZE_MODES[mode](file_name, upload)
+    except Exception as e:
+        report = {"file_name": file_name,
+                  "error": f"Error al analizar el archivo STEP: {str(e)}"}
+    report["elapsed_s"] = time.perf_counter() - start
+    return report
+
+
+def _batch_step_files(uploads, spools):
+    """
+    Expande las subidas de un lote en pares (nombre, StepUpload). Los .zip
+    se abren y se toman los .step/.stp que contienen, descomprimidos en
+    SpooledUpload que se añaden a `spools` para que el llamante los cierre.
+    Lo descomprimido de todos los .zip, como cada archivo suelto, no puede
+    pasar de CQ_MAX_UPLOAD_MB: si no, RequestEntityTooLarge.
+    """
+    max_size = MAX_UPLOAD_MB * 1024 * 1024
+    total = 0
+    for upload in uploads:
+        if not zipfile.is_zipfile(upload.stream):
+            yield upload.filename, _step_upload(upload)
+            continue
+
+        upload.stream.seek(0)
+        with zipfile.ZipFile(upload.stream) as archive:
+            for info in archive.infolist():
+                name = info.filename
+                if info.is_dir() or not name.lower().endswith(('.step', '.stp')):
+                    continue
+                # El tamaño declarado descarta a tiempo las bombas zip; el
+                # real lo vuelve a limitar SpooledUpload mientras se escribe
+                if total + info.file_size > max_size:
+                    raise RequestEntityTooLarge()
+                spool = SpooledUpload(UPLOAD_SPOOL_BYTES, UPLOAD_DIR,
+                                      max_size=max_size - total)
+                spools.append(spool)
+                with archive.open(info) as member:
+                    for chunk in iter(lambda: member.read(COMPRESS_CHUNK_BYTES), b''):
+                        spool.write(chunk)
+                total += spool.size
+                yield f"{upload.filename}/{name}", spool.upload()
+
+
+# --- ANÁLISIS RÁPIDO DE STEP ---
+# El modo 'quick' de /analyze recorre el texto del STEP sin construir formas
+# de OCC: interpreta la cabecera y las entidades de producto y del resto
+# solo cuenta los tipos. Sirve para decidir qué hacer con un archivo antes
+# de pagar el importStep completo.
+_STEP_MAGIC = b'ISO-10303-21'
+# La cabecera tiene que estar al principio; no se busca más allá.
+_STEP_HEADER_WINDOW = 1024 * 1024
+_STEP_HEADER = re.compile(rb"HEADER\s*;(.*?)ENDSEC\s*;", re.S)
+_STEP_HEADER_ENTITY = re.compile(rb"(FILE_DESCRIPTION|FILE_NAME|FILE_SCHEMA)\s*(?=\()")
+# '#12 = NOMBRE (' o '#12 = (' para las entidades complejas
+_STEP_INSTANCE = re.compile(rb"#(\d+)\s*=\s*([A-Z_][A-Z0-9_]*)?\s*(?=\()")
+# Lo mismo saltando los comentarios /* */ (grupo 1 vacío); es más lento, solo
+# se usa si el archivo tiene alguno
+_STEP_INSTANCE_OR_COMMENT = re.compile(
+    rb"/\*.*?\*/|#(\d+)\s*=\s*([A-Z_][A-Z0-9_]*)?\s*(?=\()", re.S)
+# Hasta el ';' que cierra la entidad, saltando los textos entre comillas
+_STEP_RECORD = re.compile(rb"(?:'(?:[^']|'')*'|[^';])*")
+_STEP_TOKEN = re.compile(r"[^,()\s']+")
+_STEP_X2 = re.compile(r"\\X2\\((?:[0-9A-Fa-f]{4})+)\\X0\\")
+_STEP_X = re.compile(r"\\X\\([0-9A-Fa-f]{2})")
+_STEP_PRODUCT_TYPES = {
+    b'PRODUCT', b'PRODUCT_DEFINITION_FORMATION',
+    b'PRODUCT_DEFINITION_FORMATION_WITH_SPECIFIED_SOURCE',
+    b'PRODUCT_DEFINITION', b'NEXT_ASSEMBLY_USAGE_OCCURRENCE',
+}
+# BREP_WITH_VOIDS es un subtipo de MANIFOLD_SOLID_BREP
+_STEP_SOLID_TYPES = (b'MANIFOLD_SOLID_BREP', b'BREP_WITH_VOIDS')
+
+
+class NotStepError(ValueError):
+    """El archivo no empieza como un STEP (ISO 10303-21)."""
+
+
+@contextmanager
+def _step_buffer(upload):
+    """
+    El contenido de un StepUpload como buffer de solo lectura: los bytes si
+    está en memoria o un mmap de su archivo temporal, que el sistema va
+    paginando sin copiarlo al proceso.
+    """
+    if upload.data is not None or upload.size == 0:
+        yield upload.data or b''
+        return
+    with open(upload.path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        yield buffer
+
+
+def _step_string(raw):
+    """Decodifica un texto STEP: comillas dobladas y escapes \\X\\ y \\X2\\."""
+    text = raw.replace("''", "'")
+    text = _STEP_X2.sub(lambda m: bytes.fromhex(m.group(1)).decode('utf-16-be'), text)
+    return _STEP_X.sub(lambda m: chr(int(m.group(1), 16)), text)
+
+
+def _step_arguments(record):
+    """
+    Interpreta los argumentos de una entidad, desde su '(' exterior. Devuelve
+    listas anidadas con los textos como str, las referencias '#n' como int,
+    None para '$' y el resto de valores tal cual aparecen.
+    """
+    try:
+        text = record.decode('utf-8')
+    except UnicodeDecodeError:
+        text = record.decode('latin-1')
+    pos = 0
+
+    def parse_list():
+        nonlocal pos
+        pos += 1
+        items = []
+        while True:
+            while text[pos].isspace():
+                pos += 1
+            char = text[pos]
+            if char == ')':
+                pos += 1
+                return items
+            if char == ',':
+                pos += 1
+            elif char == '(':
+                items.append(parse_list())
+            elif char == "'":
+                end = pos + 1
+                while True:
+                    end = text.index("'", end)
+                    if not text.startswith("''", end):
+                        break
+                    end += 2
+                items.append(_step_string(text[pos + 1:end]))
+                pos = end + 1
+            else:
+                token = _STEP_TOKEN.match(text, pos).group()
+                pos += len(token)
+                if token.startswith('#') and token[1:].isdigit():
+                    token = int(token[1:])
+                elif token == '$':
+                    token = None
+                items.append(token)
+
+    try:
+        return parse_list()
+    except (IndexError, ValueError, AttributeError):
+        return []
+
+
+def _step_record(buffer, pos):
+    """Los argumentos de la entidad cuyo '(' está en `pos`."""
+    return _step_arguments(buffer[pos:_STEP_RECORD.match(buffer, pos).end()])
+
+
+def _arg(args, index, default=None):
+    return args[index] if len(args) > index else default
+
+
+def _step_header(buffer):
+    """Lee la sección HEADER. Devuelve (cabecera, esquemas, fin de la sección)."""
+    if not bytes(buffer[:64]).lstrip().startswith(_STEP_MAGIC):
+        raise NotStepError("El archivo no es un STEP (ISO 10303-21) válido.")
+    match = _STEP_HEADER.search(buffer, 0, _STEP_HEADER_WINDOW)
+    if match is None:
+        raise NotStepError("No se encontró la sección HEADER del archivo STEP.")
+
+    header, schema = {}, []
+    for entity in _STEP_HEADER_ENTITY.finditer(buffer, match.start(1), match.end(1)):
+        name, args = entity.group(1), _step_record(buffer, entity.end())
+        if name == b'FILE_DESCRIPTION':
+            header["description"] = _arg(args, 0, [])
+            header["implementation_level"] = _arg(args, 1)
+        elif name == b'FILE_NAME':
+            for i, key in enumerate(("name", "time_stamp", "author", "organization",
+                                     "preprocessor_version", "originating_system",
+                                     "authorization")):
+                header[key] = _arg(args, i)
+        else:
+            schema = _arg(args, 0, [])
+    return header, schema, match.end()
+
+
+def _step_assembly(records):
+    """
+    Reconstruye productos y ensamblajes a partir de las entidades
+    PRODUCT, PRODUCT_DEFINITION_FORMATION, PRODUCT_DEFINITION y
+    NEXT_ASSEMBLY_USAGE_OCCURRENCE, indexadas por su número de instancia.
+    """
+    products = {ref: {"id": _arg(args, 0), "name": _arg(args, 1),
+                      "description": _arg(args, 2)}
+                for ref, (kind, args) in records.items() if kind == b'PRODUCT'}
+
+    def product_of(definition):
+        # PRODUCT_DEFINITION -> PRODUCT_DEFINITION_FORMATION -> PRODUCT
+        _, args = records.get(definition, (None, []))
+        _, args = records.get(_arg(args, 2), (None, []))
+        return _arg(args, 2)
+
+    def label(ref):
+        product = products.get(ref, {})
+        return product.get("name") or product.get("id") or f"#{ref}"
+
+    occurrences = Counter()
+    for kind, args in records.values():
+        if kind == b'NEXT_ASSEMBLY_USAGE_OCCURRENCE':
+            occurrences[product_of(_arg(args, 3)), product_of(_arg(args, 4))] += 1
+
+    children = {child for _, child in occurrences}
+    return list(products.values()), {
+        "roots": [label(ref) for ref in products if ref not in children],
+        "occurrences": sum(occurrences.values()),
+        "components": [{"parent": label(parent), "child": label(child), "quantity": n}
+                       for (parent, child), n in occurrences.items()],
+    }
+
+
+def quick_scan_step(file_name, upload):
+    """
+    Informe del modo 'quick' de /analyze: cabecera, esquema, recuento de
+    entidades por tipo, productos y estructura de ensamblaje, en una sola
+    pasada por el texto y sin importar el STEP.
+    """
+    with METRICS.stage('scan'), _step_buffer(upload) as buffer:
+        header, schema, data_start = _step_header(buffer)
+
+        entity_types = Counter()
+        records = {}
+        instances = _STEP_INSTANCE
+        if buffer.find(b'/*', data_start) != -1:
+            instances = _STEP_INSTANCE_OR_COMMENT
+        for instance in instances.finditer(buffer, data_start):
+            if instance.group(1) is None:
+                continue
+            kind = instance.group(2)
+            entity_types[kind] += 1
+            if kind in _STEP_PRODUCT_TYPES:
+                records[int(instance.group(1))] = (kind, _step_record(buffer, instance.end()))
+
+    complex_entities = entity_types.pop(None, 0)
+    products, assembly = _step_assembly(records)
+    solids = sum(entity_types[kind] for kind in _STEP_SOLID_TYPES)
+    return {
+        "file_name": file_name,
+        "mode": "quick",
+        "size_bytes": upload.size,
+        "header": header,
+        "schema": schema,
+        "summary": {
+            "total_solids": solids,
+            "total_entities": sum(entity_types.values()) + complex_entities,
+            "complex_entities": complex_entities,
+            "products": len(products),
+        },
+        "entity_types": {kind.decode('ascii'): n for kind, n in entity_types.most_common()},
+        "products": products,
+        "assembly": assembly,
+    }
+
+
+# Funciones de análisis de /analyze según el parámetro 'mode'
+ANALYZE_MODES = {
+    'full': analyze_step_file,
+    'quick': quick_scan_step,
+}
+
+
+# --- COLA DE TRABAJOS ASÍNCRONOS ---
+def warm_up():
+    """
+    Calienta el kernel de OCC construyendo y exportando un engrane de
+    referencia. En modo fork-server se ejecuta una sola vez en el proceso
+    padre; los workers lo heredan al hacer fork (copy-on-write).
+    """
+    reference = cq.Workplane('XY').gear(SpurGear(1.0, 12, 2.0, bore_d=2.0))
+    _export_step_bytes(reference)
+
+
+def _current_rss():
+    """Memoria residente actual del proceso, en bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # Sin /proc, el pico de memoria (KiB en Linux) es la mejor estimación
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _forkserver_context():
+    """
+    Contexto de multiprocessing cuyos procesos nacen por fork de un servidor
+    que ya importó cadquery, OCP, cqkit y cq_gears y calentó OCC.
+    """
+    mp_context = multiprocessing.get_context('forkserver')
+    # El fork-server busca cq_prewarm desde el directorio de trabajo (el de
+    # la aplicación en el Dockerfile); cq_prewarm añade su propio directorio
+    # a sys.path para importar app. Los hijos reciben además el sys.path de
+    # este proceso antes de cargar su función, así que funcionan aunque la
+    # precarga no se encuentre: solo pierden el calentamiento.
+    mp_context.set_forkserver_preload(['cq_prewarm'])
+    return mp_context
+
+
+def _pooled_call(fn, args, endpoint=None):
+    """
+    Ejecuta `fn` en un worker e informa de su pid, su memoria residente y
+    las métricas de etapas que ha medido (para sumarlas en el padre).
+    """
+    METRICS.bind(endpoint)
+    METRICS.start_capture()
+    try:
+        result = fn(*args)
+    finally:
+        observations = METRICS.stop_capture()
+    return result, os.getpid(), _current_rss(), observations
+
+
+def _bound_call(endpoint, fn, args):
+    """Ejecuta `fn` en un hilo etiquetando sus métricas con `endpoint`."""
+    METRICS.bind(endpoint)
+    return fn(*args)
+
+
+class JobQueue:
+    """
+    Ejecuta trabajos largos en un pool de procesos locales.
+
+    Cada trabajo recibe un identificador con el que el cliente consulta su
+    estado y descarga el resultado. Los trabajos terminados se olvidan
+    pasados `ttl` segundos.
+
+    Con `mode='process'` cada worker es un intérprete nuevo (spawn): un fork
+    de este proceso, que tiene muchos hilos, podría heredar tomado el cerrojo
+    de alguna caché y bloquearse. Con `mode='forkserver'` los workers se
+    crean por fork desde un servidor de un solo hilo que ya importó
+    cadquery, OCP, cqkit y cq_gears y calentó OCC (ver cq_prewarm.py). Como
+    la fragmentación de memoria de OCC hace crecer a los workers sin límite,
+    el pool se recicla cuando un worker llega a `max_jobs_per_worker`
+    trabajos o supera `max_worker_rss` bytes; los trabajos en curso terminan
+    en el pool antiguo.
+
+    Los trabajos enviados con `local=True` no van al pool: corren en uno de
+    `max_workers` hilos de este proceso, para funciones que ya delegan en
+    otro proceso (p. ej. ScriptSandbox.run).
+    """
+
+    def __init__(self, max_workers=None, ttl=3600, mode='process',
+                 max_jobs_per_worker=0, max_worker_rss=0):
+        if mode not in ('process', 'forkserver'):
+            raise ValueError(f"Modo de ejecución desconocido: {mode!r}")
+
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.ttl = ttl
+        self.mode = mode
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.max_worker_rss = max_worker_rss
+        self.recycled = 0
+        self.pending = 0
+        self._executor = None
+        self._threads = None
+        self._worker_jobs = Counter()
+        self._worker_rss = {}
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # El pool se crea en el primer envío, no al importar el módulo
+        if self._executor is None:
+            if self.mode == 'forkserver':
+                mp_context = _forkserver_context()
+            else:
+                mp_context = multiprocessing.get_context('spawn')
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=mp_context)
+            self._worker_jobs = Counter()
+            self._worker_rss = {}
+        return self._executor
+
+    def _dispatch(self, fn, args):
+        # Se llama con self._lock tomado
+        executor = self._get_executor()
+        self.pending += 1
+        return executor, executor.submit(_pooled_call, fn, args,
+                                         METRICS.endpoint())
+
+    def _dispatch_local(self, fn, args):
+        # Se llama con self._lock tomado
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(max_workers=self.max_workers,
+                                               thread_name_prefix='cq-job')
+        self.pending += 1
+        return self._threads.submit(_bound_call, METRICS.endpoint(), fn, args)
+
+    def _collect_local(self, future):
+        try:
+            return future.result()
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def _collect(self, executor, future):
+        """Devuelve el resultado de un trabajo y recicla el pool si procede."""
+        try:
+            result, pid, rss, observations = future.result()
+        except BrokenProcessPool:
+            # Un worker murió (p. ej. por el OOM killer): el pool no es usable
+            self._recycle(executor)
+            raise
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+        METRICS.merge(observations)
+        with self._lock:
+            self._worker_jobs[pid] += 1
+            self._worker_rss[pid] = rss
+            worn_out = (self.max_jobs_per_worker and
+                        self._worker_jobs[pid] >= self.max_jobs_per_worker)
+            bloated = self.max_worker_rss and rss > self.max_worker_rss
+
+        if worn_out or bloated:
+            self._recycle(executor)
+
+        return result
+
+    def _recycle(self, executor):
+        with self._lock:
+            if executor is not self._executor:
+                return
+            self._executor = None
+            self.recycled += 1
+        # Los trabajos ya enviados al pool antiguo terminan normalmente
+        executor.shutdown(wait=False)
+
+    def run(self, fn, *args):
+        """Ejecuta `fn(*args)` en el pool y espera su resultado."""
+        with self._lock:
+            executor, future = self._dispatch(fn, args)
+        return self._collect(executor, future)
+
+    def run_all(self, fn, args_list):
+        """
+        Ejecuta `fn(*args)` para cada elemento de `args_list` en paralelo.
+        Devuelve una lista de pares (resultado, excepción) en el mismo orden.
+        Si un worker muere, los trabajos afectados se reintentan de uno en
+        uno, de modo que solo falla el que lo provocó.
+        """
+        with self._lock:
+            dispatched = [self._dispatch(fn, args) for args in args_list]
+
+        outcomes = []
+        for args, (executor, future) in zip(args_list, dispatched):
+            try:
+                outcomes.append((self._collect(executor, future), None))
+            except BrokenProcessPool:
+                try:
+                    outcomes.append((self.run(fn, *args), None))
+                except Exception as e:
+                    outcomes.append((None, e))
+            except Exception as e:
+                outcomes.append((None, e))
+        return outcomes
+
+    def submit(self, kind, download_name, fn, *args, on_success=None,
+               local=False):
+        """
+        Encola `fn(*args)` y devuelve el identificador del trabajo. Con
+        `local`, `fn` corre en un hilo de este proceso y no en el pool.
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "kind": kind,
+            "status": "queued",
+            "submitted_at": time.time(),
+            "finished_at": None,
+            "error": None,
+            "result": None,
+            "download_name": download_name,
+        }
+
+        with self._lock:
+            self._expire()
+            self._jobs[job_id] = job
+            if local:
+                executor, job["future"] = None, self._dispatch_local(fn, args)
+            else:
+                executor, job["future"] = self._dispatch(fn, args)
+
+        def _done(future):
+            result, error = None, None
+            try:
+                if executor is None:
+                    result = self._collect_local(future)
+                else:
+                    result = self._collect(executor, future)
+            except Exception as e:
+                error = e
+            with self._lock:
+                job["finished_at"] = time.time()
+                if error is None:
+                    job["status"] = "done"
+                    job["result"] = result
+                else:
+                    job["status"] = "error"
+                    job["error"] = error
+            if error is None and on_success is not None:
+                on_success(result)
+
+        job["future"].add_done_callback(_done)
+        return job_id
+
+    def complete(self, kind, download_name, result):
+        """Registra un trabajo ya resuelto (p. ej. por la caché)."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._expire()
+            self._jobs[job_id] = {
+                "id": job_id,
+                "kind": kind,
+                "status": "done",
+                "submitted_at": now,
+                "finished_at": now,
+                "error": None,
+                "result": result,
+                "download_name": download_name,
+                "future": None,
+            }
+        return job_id
+
+    def get(self, job_id):
+        """Devuelve el registro del trabajo, o None si no existe."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job["status"] == "queued" \
+                    and job["future"].running():
+                job["status"] = "running"
+            return job
+
+    def _expire(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["finished_at"] is not None
+                   and now - job["finished_at"] > self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def stats(self):
+        """Cuenta los trabajos conocidos por estado."""
+        with self._lock:
+            counts = Counter(job["status"] for job in self._jobs.values())
+        return {"workers": self.max_workers, "mode": self.mode,
+                "recycled": self.recycled, **counts}
+
+    def gauges(self):
+        """Profundidad de la cola y memoria de los workers, para /metrics."""
+        with self._lock:
+            worker_rss = sorted(self._worker_rss.items())
+            pending = self.pending
+        return [
+            ("cq_job_queue_depth", "Trabajos enviados al pool y aún sin recoger.",
+             [({}, pending)]),
+            ("cq_worker_rss_bytes", "Memoria residente de cada worker del pool tras su último trabajo.",
+             [({"pid": pid}, rss) for pid, rss in worker_rss]),
+        ]
+
+
+# Número de procesos del pool (CQ_JOB_WORKERS, por defecto uno por núcleo),
+# segundos que se conservan los resultados (CQ_JOB_TTL), modo de ejecución
+# (CQ_EXEC_MODE: 'process' o 'forkserver') y límites de reciclado de los
+# workers (CQ_WORKER_MAX_JOBS trabajos, CQ_WORKER_MAX_RSS_MB megabytes).
+JOB_QUEUE = JobQueue(max_workers=_env_int('CQ_JOB_WORKERS', 0),
+                     ttl=_env_int('CQ_JOB_TTL', 3600),
+                     mode=os.environ.get('CQ_EXEC_MODE', 'process'),
+                     max_jobs_per_worker=_env_int('CQ_WORKER_MAX_JOBS', 0),
+                     max_worker_rss=_env_int('CQ_WORKER_MAX_RSS_MB', 0) * 1024 * 1024)
+
+
+def _execute(fn, *args):
+    """
+    Ejecuta el trabajo de un endpoint síncrono. En modo fork-server se
+    delega en los workers precalentados del pool; si no, en este proceso.
+    """
+    if JOB_QUEUE.mode == 'forkserver':
+        return JOB_QUEUE.run(fn, *args)
+    return fn(*args)
+
+
+# --- EJECUCIÓN AISLADA DE SCRIPTS ---
+class ResourceExceededError(Exception):
+    """Un trabajo del sandbox superó uno de los límites de ScriptSandbox."""
+
+    MESSAGES = {
+        "wall_time": "El trabajo superó el tiempo máximo de ejecución",
+        "cpu_time": "El trabajo superó el tiempo máximo de CPU",
+        "memory": "El trabajo superó la memoria máxima",
+    }
+
+    def __init__(self, resource_name, limit):
+        super().__init__(f"{self.MESSAGES[resource_name]} ({limit}).")
+        self.resource_name = resource_name
+        self.limit = limit
+
+    def to_dict(self):
+        return {"error": str(self), "error_type": "resource_exceeded",
+                "resource": self.resource_name, "limit": self.limit}
+
+
+def _raise_resource_exceeded(resource_name, limit):
+    def _handler(signum, frame):
+        raise ResourceExceededError(resource_name, limit)
+    return _handler
+
+
+def _limited_call(fn, args, endpoint, timeout, cpu_seconds, max_memory):
+    """
+    Ejecuta `fn(*args)` en un proceso hijo con un tiempo máximo y un tiempo
+    de CPU contados desde ahora, y devuelve el mensaje para el padre.
+    """
+    if cpu_seconds:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+        soft = int(usage.ru_utime + usage.ru_stime) + cpu_seconds
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+        # El límite blando envía SIGXCPU; el duro no se toca, porque un
+        # proceso sin privilegios no puede volver a subirlo.
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+        signal.signal(signal.SIGXCPU,
+                      _raise_resource_exceeded("cpu_time", f"{cpu_seconds} s"))
+    if timeout:
+        signal.signal(signal.SIGALRM,
+                      _raise_resource_exceeded("wall_time", f"{timeout} s"))
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+
+    try:
+        message = ("ok", _pooled_call(fn, args, endpoint))
+    except ResourceExceededError as e:
+        message = ("resource", (e.resource_name, e.limit))
+    except MemoryError as e:
+        message = (("resource", ("memory", f"{max_memory // (1024 * 1024)} MB"))
+                   if max_memory else ("error", e))
+    except Exception as e:
+        message = ("error", e)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        if cpu_seconds:
+            resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+    return message
+
+
+def _process_cpu_seconds(pid):
+    """Tiempo de CPU (usuario + sistema) de otro proceso, o None sin /proc."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # Los campos 14 y 15 (utime, stime), contados tras el nombre
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _send_message(conn, message):
+    try:
+        conn.send(message)
+    except Exception:
+        # La excepción del script no siempre se puede serializar
+        conn.send(("error", RuntimeError(repr(message[1]))))
+
+
+def _sandbox_gear_cache_dir():
+    """
+    Directorio de la caché de engranes de los hijos del sandbox para el
+    cliente de la petición en curso, o None si no hay caché en disco.
+    """
+    if not SANDBOX_GEAR_CACHE or GEAR_CACHE_DIR is None or not has_request_context():
+        return None
+    client = hashlib.sha256(str(_client_id()).encode('utf-8')).hexdigest()[:32]
+    return os.path.join(GEAR_CACHE_DIR, 'clients', client)
+
+
+def _sandboxed_call(conn, fn, args, endpoint, gear_cache_dir, timeout,
+                    cpu_seconds, max_memory):
+    """Cuerpo del proceso hijo de ScriptSandbox.run."""
+    # Una caché propia permite usar los engranes precalculados (ver
+    # prebuild_gears); nunca la heredada del fork-server, que es común.
+    GearBase.build_cache = None
+    if SANDBOX_GEAR_CACHE:
+        GearBase.build_cache = cq_gears.BuildCache(
+            max_items=GEAR_CACHE_ITEMS or 32, cache_dir=gear_cache_dir,
+            max_disk_bytes=SANDBOX_GEAR_CACHE_DISK_BYTES)
+    if max_memory:
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+    if cpu_seconds:
+        # Si el script está dentro de OCC y no atiende SIGXCPU, el kernel
+        # lo mata al llegar al límite duro.
+        resource.setrlimit(resource.RLIMIT_CPU,
+                           (cpu_seconds, cpu_seconds + ScriptSandbox.GRACE))
+
+    _send_message(conn, _limited_call(fn, args, endpoint, timeout,
+                                      cpu_seconds, max_memory))
+    conn.close()
+    # Ya con la respuesta enviada: los engranes construidos, al disco
+    if GearBase.build_cache is not None:
+        GearBase.build_cache.flush()
+
+
+class ScriptSandbox:
+    """
+    Ejecuta el código de los usuarios en un proceso hijo desechable, con
+    límites de espacio de direcciones (`max_memory` bytes) y tiempo de CPU
+    (`cpu_seconds`) vía setrlimit y un tiempo máximo de ejecución
+    (`timeout` segundos).
+
+    El tiempo máximo es cooperativo: el hijo lanza ResourceExceededError
+    con SIGALRM en cuanto vuelve a ejecutar Python. Si sigue atascado
+    dentro de OCC, el padre lo mata pasados GRACE segundos más. Los hijos
+    nacen del fork-server precalentado, así que arrancan en milisegundos
+    y un script desbocado nunca tumba al worker de gunicorn.
+    """
+
+    GRACE = 5
+    # Cada cuántos segundos se mide el tiempo de CPU del hijo mientras se
+    # espera su respuesta (para saber de qué murió si lo matan)
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, timeout=0, cpu_seconds=0, max_memory=0):
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.max_memory = max_memory
+        self.exceeded = Counter()
+
+    @property
+    def enabled(self):
+        return bool(self.timeout or self.cpu_seconds or self.max_memory)
+
+    def start(self, target, *args, duplex=False):
+        """
+        Arranca un proceso hijo `target(conn, *args, timeout, cpu_seconds,
+        max_memory)` y devuelve (proceso, extremo del pipe del padre). Con
+        `duplex` el padre también puede enviarle órdenes por el pipe.
+        """
+        mp_context = _forkserver_context()
+        receiver, sender = mp_context.Pipe(duplex=duplex)
+        process = mp_context.Process(
+            target=target, daemon=True,
+            args=(sender,) + args + (self.timeout, self.cpu_seconds,
+                                     self.max_memory))
+        process.start()
+        sender.close()
+        return process, receiver
+
+    def receive(self, process, receiver):
+        """
+        Espera la respuesta de un hijo a una llamada limitada y devuelve
+        (resultado, memoria residente del hijo). Si el hijo no responde a
+        tiempo lo mata; si murió, o superó un límite, lanza la excepción.
+        """
+        deadline = time.monotonic() + self.timeout + self.GRACE if self.timeout else None
+        cpu_start = cpu_last = _process_cpu_seconds(process.pid)
+        while not receiver.poll(self.POLL_INTERVAL):
+            cpu_last = _process_cpu_seconds(process.pid) or cpu_last
+            if deadline is not None and time.monotonic() >= deadline:
+                process.kill()
+                process.join()
+                self._exceeded("wall_time", f"{self.timeout} s")
+        try:
+            status, payload = receiver.recv()
+        except EOFError:
+            process.join()
+            cpu_used = cpu_last - cpu_start if cpu_start is not None else None
+            self._died(process, cpu_used)
+
+        if status == "resource":
+            self._exceeded(*payload)
+        if status == "error":
+            raise payload
+        result, _, rss, observations = payload
+        METRICS.merge(observations)
+        return result, rss
+
+    def run(self, fn, *args, gear_cache_dir=None):
+        """
+        Ejecuta `fn(*args)` en el sandbox y devuelve su resultado. Los
+        engranes se guardan en `gear_cache_dir` (ver _sandbox_gear_cache_dir).
+        """
+        process, receiver = self.start(_sandboxed_call, fn, args,
+                                       METRICS.endpoint(), gear_cache_dir)
+        try:
+            result, _ = self.receive(process, receiver)
+            process.join(self.GRACE)
+        finally:
+            if process.is_alive():
+                process.kill()
+            process.join()
+            receiver.close()
+        return result
+
+    def _died(self, process, cpu_used=None):
+        # El hijo murió sin responder: por el límite duro de CPU (SIGKILL
+        # tras SIGXCPU) o por memoria (el OOM killer también usa SIGKILL).
+        # Un SIGKILL solo es del límite de CPU si el hijo ya había pasado
+        # el blando: el duro está GRACE segundos de CPU más allá. Solo se
+        # atribuye a la memoria si hay límite de memoria.
+        exitcode = process.exitcode
+        cpu_killed = (exitcode == -signal.SIGKILL and self.cpu_seconds
+                      and cpu_used is not None and cpu_used >= self.cpu_seconds)
+        if exitcode == -signal.SIGXCPU or cpu_killed:
+            self._exceeded("cpu_time", f"{self.cpu_seconds} s")
+        if exitcode == -signal.SIGKILL and self.max_memory:
+            self._exceeded("memory", f"{self.max_memory // (1024 * 1024)} MB")
+        if exitcode is not None and exitcode < 0:
+            try:
+                name = signal.Signals(-exitcode).name
+            except ValueError:
+                name = "desconocida"
+            raise RuntimeError(
+                f"El proceso del script terminó de forma anormal por la señal {-exitcode} ({name}).")
+        raise RuntimeError(f"El proceso del script terminó inesperadamente (código {exitcode}).")
+
+    def _exceeded(self, resource_name, limit):
+        self.exceeded[resource_name] += 1
+        raise ResourceExceededError(resource_name, limit)
+
+    def stats(self):
+        return {"timeout_s": self.timeout, "cpu_s": self.cpu_seconds,
+                "max_memory_mb": self.max_memory // (1024 * 1024),
+                "exceeded": dict(self.exceeded)}
+
+
+# Límites de los scripts de /generate y /modify, también en sus trabajos
+# asíncronos (/jobs/generate, /jobs/modify), de los engranes de /gears,
+# cuya clase y parámetros elige el cliente, y de los STEP de /tessellate:
+# tiempo de ejecución
+# (CQ_SCRIPT_TIMEOUT, por debajo del timeout de gunicorn), tiempo de CPU
+# (CQ_SCRIPT_CPU_S) y espacio de direcciones (CQ_SCRIPT_MAX_MEMORY_MB; OCC
+# reserva mucha memoria virtual por hilo, así que no debe ser muy justo).
+# Con los tres a 0 los scripts se ejecutan como el resto de trabajos.
+SCRIPT_SANDBOX = ScriptSandbox(
+    timeout=_env_int('CQ_SCRIPT_TIMEOUT', 90),
+    cpu_seconds=_env_int('CQ_SCRIPT_CPU_S', 300),
+    max_memory=_env_int('CQ_SCRIPT_MAX_MEMORY_MB', 4096) * 1024 * 1024)
+
+
+def _execute_script(fn, *args):
+    """
+    Como _execute, pero para trabajos que ejecutan código del usuario: con
+    el sandbox activado corren en un proceso propio y no en el pool.
+    """
+    if SCRIPT_SANDBOX.enabled:
+        return SCRIPT_SANDBOX.run(fn, *args,
+                                  gear_cache_dir=_sandbox_gear_cache_dir())
+    return _execute(fn, *args)
+
+
+def _execute_profiled(profile, fn, *args):
+    """
+    Igual que _execute_script, pero devuelve (resultado, perfil). Si
+    `profile` es un formato de PROFILE_FORMATS, el trabajo se ejecuta bajo
+    StackProfiler allí donde corra; si es None, el perfil es None.
+    """
+    if profile is None:
+        return _execute_script(fn, *args), None
+    result, profiler = _execute_script(profiled_call, fn, *args)
+    return result, profiler.render(profile)
+
+
+def _submit_script_job(kind, download_name, fn, *args, on_success=None):
+    """
+    Encola un trabajo que ejecuta código del usuario. Con el sandbox
+    activado corre en un hijo suyo, con los mismos límites que en los
+    endpoints síncronos; si no, en el pool como el resto de trabajos.
+    """
+    if SCRIPT_SANDBOX.enabled:
+        # El trabajo corre fuera de la petición: su cliente se fija ahora
+        run = functools.partial(SCRIPT_SANDBOX.run,
+                                gear_cache_dir=_sandbox_gear_cache_dir())
+        return JOB_QUEUE.submit(kind, download_name, run, fn, *args,
+                                on_success=on_success, local=True)
+    return JOB_QUEUE.submit(kind, download_name, fn, *args,
+                            on_success=on_success)
+
+
+def _sandboxed_modify(upload, script_code, output, gear_cache_dir=None):
+    """
+    Trabajo de /jobs/modify en el sandbox, con la STEP_CACHE de este
+    proceso (ver run_modify_script_brep).
+    """
+    step_brep = STEP_CACHE.get(upload.digest)
+    model_data, imported = SCRIPT_SANDBOX.run(run_modify_script_brep, upload,
+                                              script_code, output, step_brep,
+                                              gear_cache_dir=gear_cache_dir)
+    if imported is not None:
+        STEP_CACHE.put(upload.digest, imported)
+    return model_data
+
+
+def _send_profiled_model(data, download_name, profile):
+    """Con perfilado, el modelo viaja en base64 junto al perfil en un JSON."""
+    return jsonify({"download_name": download_name,
+                    "model_base64": base64.b64encode(data).decode('ascii'),
+                    "profile": profile})
+
+
+# --- SESIONES DE MODIFICACIÓN CON ESTADO ---
+def _session_open(state, upload):
+    state["model"] = import_step_cached(upload)
+    state["edits"] = 0
+    return _session_summary(state)
+
+
+def _session_modify(state, script_code):
+    result = _exec_modify_script(script_code, state["model"])
+    if isinstance(result, cq.Shape):
+        result = cq.Workplane("XY").newObject([result])
+    state["model"] = result
+    state["edits"] += 1
+    return _session_summary(state)
+
+
+def _session_export(state, output):
+    return export_model_bytes(state["model"], **(output or {}))
+
+
+def _session_summary(state):
+    return {"edits": state["edits"], "objects": len(state["model"].vals())}
+
+
+SESSION_COMMANDS = {
+    "modify": _session_modify,
+    "export": _session_export,
+}
+
+
+def _session_worker(conn, upload, endpoint, timeout, cpu_seconds, max_memory):
+    """
+    Cuerpo del proceso que mantiene el modelo de una sesión: lo importa una
+    vez y atiende órdenes (nombre, argumentos, endpoint) hasta que el pipe
+    se cierra. Cada orden tiene sus propios límites de tiempo y de CPU.
+    """
+    if max_memory:
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+
+    state = {}
+    message = _limited_call(_session_open, (state, upload), endpoint,
+                            timeout, cpu_seconds, max_memory)
+    _send_message(conn, message)
+    if message[0] != "ok":
+        conn.close()
+        return
+
+    while True:
+        try:
+            command, args, endpoint = conn.recv()
+        except EOFError:
+            break
+        _send_message(conn, _limited_call(SESSION_COMMANDS[command],
+                                          (state,) + args, endpoint, timeout,
+                                          cpu_seconds, max_memory))
+    conn.close()
+
+
+class SessionNotFoundError(LookupError):
+    """La sesión no existe, expiró o fue expulsada."""
+
+
+class SessionManager:
+    """
+    Sesiones de /modify con estado. Cada sesión es un proceso hijo del
+    fork-server que importa el STEP una sola vez y conserva `model` en
+    memoria, así cada edición solo cuesta su propia operación; el modelo se
+    exporta únicamente cuando se descarga.
+
+    Los procesos tienen los mismos límites que ScriptSandbox, contados por
+    orden. Las sesiones sin uso durante `idle_timeout` segundos se cierran,
+    y si hay más de `max_sessions` o su memoria residente suma más de
+    `memory_budget` bytes se expulsan las usadas hace más tiempo. Las
+    expulsiones se hacen al abrir o usar una sesión y, para las inactivas,
+    en un hilo que revisa cada REAP_INTERVAL segundos como mucho.
+    """
+
+    REAP_INTERVAL = 60
+
+    def __init__(self, sandbox, idle_timeout=900, max_sessions=8,
+                 memory_budget=0):
+        self.sandbox = sandbox
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.memory_budget = memory_budget
+        self.evicted = Counter()
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def open(self, upload):
+        """Crea una sesión con el StepUpload dado; devuelve (id, resumen)."""
+        self._start_reaper()
+        process, conn = self.sandbox.start(_session_worker, upload,
+                                           METRICS.endpoint(), duplex=True)
+        try:
+            summary, rss = self.sandbox.receive(process, conn)
+        except BaseException:
+            self._terminate({"process": process, "conn": conn})
+            raise
+
+        now = time.time()
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._sessions[session_id] = {
+                "process": process, "conn": conn, "lock": threading.Lock(),
+                "created_at": now, "last_used": now, "rss": rss,
+            }
+            victims = self._evictions(keep=session_id)
+        for victim in victims:
+            self._terminate(victim)
+        return session_id, summary
+
+    def call(self, session_id, command, *args):
+        """Envía una orden de SESSION_COMMANDS a la sesión y espera su resultado."""
+        with self._lock:
+            victims = self._evictions(keep=session_id)
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+        for victim in victims:
+            self._terminate(victim)
+        if session is None:
+            raise SessionNotFoundError(f"La sesión {session_id!r} no existe o ha expirado.")
+
+        with session["lock"]:
+            if not session["process"].is_alive():
+                raise SessionNotFoundError(f"La sesión {session_id!r} no existe o ha expirado.")
+            try:
+                session["conn"].send((command, args, METRICS.endpoint()))
+                result, session["rss"] = self.sandbox.receive(session["process"],
+                                                              session["conn"])
+            finally:
+                session["last_used"] = time.time()
+                if not session["process"].is_alive():
+                    # Un script que no respetó los límites se lleva la sesión
+                    self.close(session_id)
+                    self.evicted["error"] += 1
+
+        with self._lock:
+            victims = self._evictions(keep=session_id)
+        for victim in victims:
+            self._terminate(victim)
+        return result
+
+    def close(self, session_id):
+        """Cierra una sesión; devuelve False si no existía."""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self._terminate(session)
+        return True
+
+    def _evictions(self, keep=None):
+        # Se llama con self._lock tomado. Las sesiones ocupadas no se tocan.
+        now = time.time()
+        victims = []
+        for session_id, session in list(self._sessions.items()):
+            if session_id != keep and not session["lock"].locked() \
+                    and now - session["last_used"] > self.idle_timeout:
+                victims.append(self._sessions.pop(session_id))
+                self.evicted["idle"] += 1
+
+        for session_id, session in list(self._sessions.items()):
+            over_budget = self.memory_budget and \
+                sum(s["rss"] for s in self._sessions.values()) > self.memory_budget
+            if len(self._sessions) <= self.max_sessions and not over_budget:
+                break
+            if session_id != keep and not session["lock"].locked():
+                victims.append(self._sessions.pop(session_id))
+                self.evicted["lru"] += 1
+        return victims
+
+    def reap(self):
+        """Cierra las sesiones inactivas o que sobran; devuelve cuántas."""
+        with self._lock:
+            victims = self._evictions()
+        for victim in victims:
+            self._terminate(victim)
+        return len(victims)
+
+    def _start_reaper(self):
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reap_loop,
+                                            name='cq-session-reaper', daemon=True)
+        self._reaper.start()
+
+    def _reap_loop(self):
+        interval = max(1, min(self.idle_timeout, self.REAP_INTERVAL))
+        while True:
+            time.sleep(interval)
+            try:
+                self.reap()
+            except Exception:
+                # Un fallo al cerrar un proceso no debe parar el hilo; se
+                # reintenta en la siguiente pasada
+                pass
+
+    def _terminate(self, session):
+        session["conn"].close()
+        session["process"].join(1)
+        if session["process"].is_alive():
+            session["process"].kill()
+            session["process"].join()
+
+    def stats(self):
+        with self._lock:
+            sessions = len(self._sessions)
+            rss = sum(s["rss"] for s in self._sessions.values())
+        return {"sessions": sessions, "max_sessions": self.max_sessions,
+                "rss_bytes": rss,
+                "memory_budget_mb": self.memory_budget // (1024 * 1024),
+                "idle_timeout_s": self.idle_timeout,
+                "evicted": dict(self.evicted)}
+
+    def gauges(self):
+        stats = self.stats()
+        return [
+            ("cq_sessions", "Sesiones de modificación abiertas.",
+             [({}, stats["sessions"])]),
+            ("cq_session_rss_bytes", "Memoria residente total de los procesos de sesión.",
+             [({}, stats["rss_bytes"])]),
+        ]
+
+
+# Sesiones de /sessions: segundos sin uso antes de cerrarse
+# (CQ_SESSION_IDLE_S), número máximo (CQ_SESSION_MAX) y memoria residente
+# total que pueden ocupar (CQ_SESSION_MEMORY_MB, 0 sin límite).
+SESSIONS = SessionManager(
+    SCRIPT_SANDBOX,
+    idle_timeout=_env_int('CQ_SESSION_IDLE_S', 900),
+    max_sessions=_env_int('CQ_SESSION_MAX', 8),
+    memory_budget=_env_int('CQ_SESSION_MEMORY_MB', 4096) * 1024 * 1024)
+
+
+# --- CONTROL DE ADMISIÓN ---
+class ServiceOverloadedError(Exception):
+    """No se admite la petición: no hay sitio en su carril o en la cola."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    def to_dict(self):
+        return {"error": str(self), "retry_after_s": self.retry_after}
+
+
+class Lane:
+    """
+    Un carril de ejecución: como mucho `slots` peticiones a la vez y
+    `max_queue` esperando, de las que cada cliente puede tener
+    `max_client_queue`.
+    """
+
+    def __init__(self, name, slots, max_queue, max_client_queue):
+        self.name = name
+        self.slots = max(1, slots)
+        self.max_queue = max_queue
+        self.max_client_queue = max_client_queue
+        self.active = 0
+        self.queued = 0
+        # cliente -> turnos en espera, en orden de llegada
+        self.waiting = OrderedDict()
+        # Media móvil del tiempo que se ocupa un hueco, en segundos
+        self.service_time = None
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def retry_after(self):
+        """Segundos estimados hasta que se vacíe la cola actual."""
+        per_request = self.service_time or 1.0
+        return min(300, max(1, math.ceil(per_request * (self.queued + 1) / self.slots)))
+
+
+class AdmissionController:
+    """
+    Reparte las peticiones costosas en carriles independientes, de modo que
+    un /analyze nunca espera detrás de un /generate de varios minutos.
+
+    Dentro de cada carril, las peticiones que esperan se atienden por turnos
+    entre clientes: al liberarse un hueco pasa la más antigua del cliente
+    siguiente, y ese cliente pasa al final de la ronda. Así un cliente con
+    muchas peticiones solo retrasa una vez a cada uno de los demás. Si la
+    cola está llena, o una petición espera más de `queue_timeout` segundos,
+    se lanza ServiceOverloadedError.
+    """
+
+    SMOOTHING = 0.2
+
+    def __init__(self, lanes, queue_timeout):
+        self.lanes = {lane.name: lane for lane in lanes}
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+
+    def acquire(self, lane_name, client):
+        """Espera un hueco en el carril. Devuelve el turno para release()."""
+        lane = self.lanes[lane_name]
+        with self._lock:
+            if lane.active < lane.slots and not lane.waiting:
+                lane.active += 1
+                lane.admitted += 1
+                return lane, time.perf_counter()
+            if (lane.queued >= lane.max_queue or
+                    len(lane.waiting.get(client, ())) >= lane.max_client_queue):
+                lane.rejected += 1
+                raise ServiceOverloadedError(
+                    f"El servicio está saturado (carril '{lane.name}'). Vuelve a intentarlo más tarde.",
+                    lane.retry_after())
+            turn = {"event": threading.Event(), "granted": False}
+            lane.waiting.setdefault(client, deque()).append(turn)
+            lane.queued += 1
+
+        turn["event"].wait(self.queue_timeout)
+        with self._lock:
+            if not turn["granted"]:
+                queue = lane.waiting[client]
+                queue.remove(turn)
+                if not queue:
+                    del lane.waiting[client]
+                lane.queued -= 1
+                lane.timeouts += 1
+                raise ServiceOverloadedError(
+                    f"La petición esperó más de {self.queue_timeout} s en el carril '{lane.name}'.",
+                    lane.retry_after())
+            lane.admitted += 1
+        return lane, time.perf_counter()
+
+    def release(self, turn):
+        """Libera el hueco, o se lo pasa al siguiente cliente de la ronda."""
+        lane, started = turn
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            if lane.service_time is None:
+                lane.service_time = elapsed
+            else:
+                lane.service_time += self.SMOOTHING * (elapsed - lane.service_time)
+
+            if not lane.waiting:
+                lane.active -= 1
+                return
+            client, queue = next(iter(lane.waiting.items()))
+            waiter = queue.popleft()
+            if queue:
+                lane.waiting.move_to_end(client)
+            else:
+                del lane.waiting[client]
+            lane.queued -= 1
+            waiter["granted"] = True
+            waiter["event"].set()
+
+    def stats(self):
+        with self._lock:
+            return {name: {"slots": lane.slots,
+                           "active": lane.active,
+                           "queued": lane.queued,
+                           "waiting_clients": len(lane.waiting),
+                           "max_queue": lane.max_queue,
+                           "admitted": lane.admitted,
+                           "rejected": lane.rejected,
+                           "timeouts": lane.timeouts,
+                           "service_time_s": lane.service_time}
+                    for name, lane in self.lanes.items()}
+
+    def gauges(self):
+        stats = self.stats()
+        return [
+            ("cq_lane_active", "Peticiones ejecutándose en cada carril.",
+             [({"lane": name}, lane["active"]) for name, lane in stats.items()]),
+            ("cq_lane_queued", "Peticiones esperando turno en cada carril.",
+             [({"lane": name}, lane["queued"]) for name, lane in stats.items()]),
+            ("cq_lane_rejected", "Peticiones rechazadas con 503 en cada carril (acumulado).",
+             [({"lane": name}, lane["rejected"] + lane["timeouts"])
+              for name, lane in stats.items()]),
+        ]
+
+
+def _lane(name, slots, max_queue):
+    # Huecos (CQ_LANE_<NOMBRE>_SLOTS) y cola (CQ_LANE_<NOMBRE>_QUEUE) de un carril
+    prefix = f'CQ_LANE_{name.upper()}'
+    return Lane(name, _env_int(f'{prefix}_SLOTS', slots),
+                _env_int(f'{prefix}_QUEUE', max_queue),
+                _env_int('CQ_CLIENT_QUEUE', 4))
+
+
+# Carriles: 'analyze' para /analyze, 'build' para lo que ejecuta scripts o
+# construye modelos y 'session' para las sesiones. Cada petición espera
+# como mucho CQ_QUEUE_TIMEOUT_S segundos su turno. Los hilos de gunicorn
+# (Dockerfile) deben cubrir la suma de huecos y colas.
+ADMISSION = AdmissionController(
+    [_lane('analyze', 2, 8), _lane('build', 2, 8), _lane('session', 2, 4)],
+    queue_timeout=_env_int('CQ_QUEUE_TIMEOUT_S', 60))
+ENDPOINT_LANES = {
+    'analyze_model': 'analyze',
+    'generate_model': 'build',
+    'modify_model': 'build',
+    'build_gear': 'build',
+    'tessellate_model': 'build',
+    'open_session': 'session',
+    'modify_session': 'session',
+    'get_session_model': 'session',
+}
+# Los trabajos asíncronos no ocupan carril, pero no se aceptan más si hay
+# CQ_JOB_QUEUE_MAX pendientes en el pool (0 sin límite).
+JOB_ENDPOINTS = {'submit_generate_job', 'submit_modify_job'}
+JOB_QUEUE_MAX = _env_int('CQ_JOB_QUEUE_MAX', 64)
+JOB_RETRY_AFTER_S = 30
+# Proxies de confianza (CQ_TRUSTED_PROXIES, direcciones separadas por comas):
+# solo a ellos se les acepta X-Client-Id o X-Forwarded-For para identificar
+# al cliente. Cualquier otra petición cuenta por la dirección que conecta.
+TRUSTED_PROXIES = frozenset(
+    address.strip() for address in os.environ.get('CQ_TRUSTED_PROXIES', '').split(',')
+    if address.strip())
+
+
+def _client_id():
+    """
+    El cliente para el reparto por turnos: la dirección que conecta o, si es
+    un proxy de confianza, el X-Client-Id que este indica o el primer salto
+    de X-Forwarded-For que no es un proxy de confianza, leyendo desde la
+    derecha: los de la izquierda los escribe el propio cliente.
+    """
+    address = request.remote_addr
+    if address not in TRUSTED_PROXIES:
+        return address
+    client_id = request.headers.get('X-Client-Id')
+    if client_id:
+        return client_id
+    hops = [hop.strip() for value in request.headers.getlist('X-Forwarded-For')
+            for hop in value.split(',')]
+    for hop in reversed(hops):
+        if hop and hop not in TRUSTED_PROXIES:
+            return hop
+    return address
+
+
+def _job_status(job):
+    status = {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "submitted_at": job["submitted_at"],
+        "finished_at": job["finished_at"],
+    }
+    if job["error"] is not None:
+        status["error"] = str(job["error"])
+    return status
+
+
+# --- MEDICIÓN DE LAS PETICIONES ---
+@app.before_request
+def _start_request_metrics():
+    METRICS.bind(request.endpoint)
+    request.environ['cq.start'] = time.perf_counter()
+
+
+@app.before_request
+def _admit_request():
+    """Espera turno en el carril del endpoint antes de leer la petición."""
+    if request.endpoint in JOB_ENDPOINTS and JOB_QUEUE_MAX and JOB_QUEUE.pending >= JOB_QUEUE_MAX:
+        raise ServiceOverloadedError("La cola de trabajos está llena. Vuelve a intentarlo más tarde.",
+                                     JOB_RETRY_AFTER_S)
+    lane = ENDPOINT_LANES.get(request.endpoint)
+    if lane is not None:
+        with METRICS.stage('queue'):
+            request.environ['cq.turn'] = ADMISSION.acquire(lane, _client_id())
+
+
+@app.teardown_request
+def _release_request(exc):
+    turn = request.environ.pop('cq.turn', None)
+    if turn is not None:
+        ADMISSION.release(turn)
+
+
+@app.after_request
+def _finish_request_metrics(response):
+    """
+    La etapa 'send' va desde que la vista devuelve la respuesta hasta que
+    el servidor termina de enviarla y la cierra.
+    """
+    endpoint = request.endpoint or 'none'
+    start = request.environ.get('cq.start')
+    sent_from = time.perf_counter()
+
+    def _on_close():
+        now = time.perf_counter()
+        METRICS.observe("cq_stage_seconds", now - sent_from,
+                        endpoint=endpoint, stage='send')
+        if start is not None:
+            METRICS.observe("cq_request_seconds", now - start,
+                            endpoint=endpoint)
+
+    # send_file marca direct_passthrough y Werkzeug entonces se salta los
+    # call_on_close; los modelos ya están en memoria, así que no se pierde nada.
+    response.direct_passthrough = False
+    response.call_on_close(_on_close)
+    return response
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def _upload_too_large(e):
+    return jsonify({"error": f"La petición supera el tamaño máximo de {MAX_UPLOAD_MB} MB."}), 413
+
+
+@app.errorhandler(ServiceOverloadedError)
+def _overloaded(e):
+    response = jsonify(e.to_dict())
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
+
+
+@app.errorhandler(UnsupportedMediaType)
+@app.errorhandler(CompressedUploadError)
+def _bad_upload_encoding(e):
+    return jsonify({"error": e.description}), e.code
+
 
 # --- ENDPOINT PARA HEALTH CHECK ---
 @app.route('/', methods=['GET'])
@@ -39,73 +3208,121 @@ def health_check():
     """Responde a los chequeos de salud de la plataforma de despliegue."""
     return "CadQuery Service is running.", 200
 
+# --- ENDPOINT PARA CONSULTAR LA CACHÉ DE RESULTADOS ---
+@app.route('/cache', methods=['GET'])
+def cache_stats():
+    """Devuelve los contadores de aciertos, fallos y expulsiones de la caché."""
+    return jsonify({"result_cache": RESULT_CACHE.stats(),
+                    "step_cache": STEP_CACHE.stats(),
+                    "jobs": JOB_QUEUE.stats(),
+                    "sandbox": SCRIPT_SANDBOX.stats(),
+                    "scripts": SCRIPT_CACHE.stats(),
+                    "sessions": SESSIONS.stats(),
+                    "lanes": ADMISSION.stats()})
+
+# --- ENDPOINT DE MÉTRICAS (FORMATO PROMETHEUS) ---
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Histogramas de latencia por endpoint y etapa (queue, upload, import,
+    exec, build, analyze, export, send), etapas de construcción de los
+    engranes, profundidad de la cola, ocupación de los carriles y memoria
+    residente de los workers.
+    """
+    gauges = JOB_QUEUE.gauges() + SESSIONS.gauges() + ADMISSION.gauges() + [
+        ("cq_process_rss_bytes", "Memoria residente del proceso que atiende las peticiones.",
+         [({}, _current_rss())]),
+    ]
+    return Response(METRICS.render(gauges),
+                    mimetype='text/plain; version=0.0.4')
+
 # --- ENDPOINT PARA ANALIZAR UN ARCHIVO .STEP ---
 @app.route('/analyze', methods=['POST'])
 def analyze_model():
     """
     Recibe un archivo .step y devuelve un desglose de su contenido en JSON.
+    Si recibe varios 'step_file' o un .zip, los analiza en paralelo en el
+    pool de procesos y devuelve un informe combinado. Con mode=quick solo se
+    recorre el texto del STEP (ver quick_scan_step), sin importarlo.
     """
     if 'step_file' not in request.files:
         return jsonify({"error": "No se encontró el archivo 'step_file' en la petición."}), 400
 
-    step_file = request.files['step_file']
-    input_path = None
-
-    try:
-        with tempfile.NamedTemporaryFile(suffix=".step", delete=False) as temp_input_file:
-            step_file.save(temp_input_file.name)
-            input_path = temp_input_file.name
-
-        # --- LÍNEA CORREGIDA ---
-        # importStep devuelve un Workplane. Usamos .solids().vals() para extraer los objetos Shape.
-        imported_wp = cq.importers.importStep(input_path)
-        solids = imported_wp.solids().vals()
-        
-        if not solids:
-            return jsonify({"error": "No se encontraron sólidos en el archivo STEP proporcionado."}), 400
-        
-        analysis_report = {
-            "file_name": step_file.filename,
-            "summary": {
-                "total_solids": len(solids),
-            },
-            "solids": []
-        }
+    try:
+        profile = _requested_profile(request.headers)
+    except ProfileAccessError as e:
+        return jsonify({"error": str(e)}), 403
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-        for i, solid_shape in enumerate(solids):
-            faces = solid_shape.Faces()
-            bounds = solid_shape.BoundingBox()
-            face_types = Counter(f.geomType() for f in faces)
-
-            solid_info = {
-                "solid_index": i + 1,
-                "volume": solid_shape.Volume(),
-                "center_of_mass": {
-                    "x": solid_shape.Center().x,
-                    "y": solid_shape.Center().y,
-                    "z": solid_shape.Center().z,
-                },
-                "bounding_box": {
-                    "length_x": bounds.xlen,
-                    "length_y": bounds.ylen,
-                    "length_z": bounds.zlen,
-                },
-                "topology": {
-                    "faces": len(faces),
-                    "edges": len(solid_shape.Edges()),
-                    "vertices": len(solid_shape.Vertices()),
-                },
-                "face_types": dict(face_types)
-            }
-            analysis_report["solids"].append(solid_info)
+    mode = (request.form.get('mode') or request.args.get('mode') or 'full').lower()
+    if mode not in ANALYZE_MODES:
+        return jsonify({"error": f"Modo de análisis no soportado: {mode!r}. Opciones: {', '.join(ANALYZE_MODES)}."}), 400
+    analyze = ANALYZE_MODES[mode]
 
-        return jsonify(analysis_report)
+    uploads = request.files.getlist('step_file')
+    if len(uploads) > 1 or any(u.filename.lower().endswith('.zip') for u in uploads):
+        if profile is not None:
+            return jsonify({"error": "El perfilado solo está disponible para un único archivo."}), 400
+        return _analyze_batch(uploads, mode)
 
+    step_file = uploads[0]
+
+    try:
+        # El STEP se lee directamente del stream de la petición.
+        upload = _step_upload(step_file)
+        if profile is None:
+            return jsonify(analyze(step_file.filename, upload))
+        report, profiler = profiled_call(analyze, step_file.filename, upload)
+        report["profile"] = profiler.render(profile)
+        return jsonify(report)
+    except (NoSolidsError, NotStepError) as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": f"Error al analizar el archivo STEP: {str(e)}"}), 500
+
+
+def _analyze_batch(uploads, mode='full'):
+    spools = []
+    try:
+        return _analyze_batch_files(uploads, mode, spools)
     finally:
-        if input_path and os.path.exists(input_path):
-            os.remove(input_path)
+        for spool in spools:
+            spool.close()
+
+
+def _analyze_batch_files(uploads, mode, spools):
+    start = time.perf_counter()
+    try:
+        step_files = [(file_name, upload, mode)
+                      for file_name, upload in _batch_step_files(uploads, spools)]
+    except zipfile.BadZipFile as e:
+        return jsonify({"error": f"Archivo zip inválido: {str(e)}"}), 400
+
+    if not step_files:
+        return jsonify({"error": "El lote no contiene archivos .step."}), 400
+
+    files = []
+    outcomes = JOB_QUEUE.run_all(analyze_batch_item, step_files)
+    for (file_name, _, _), (report, error) in zip(step_files, outcomes):
+        if error is not None:
+            # El worker murió analizando este archivo
+            report = {"file_name": file_name,
+                      "error": f"Error al analizar el archivo STEP: {repr(error)}"}
+        files.append(report)
+
+    failed = sum(1 for report in files if "error" in report)
+    return jsonify({
+        "summary": {
+            "total_files": len(files),
+            "analyzed": len(files) - failed,
+            "failed": failed,
+            "total_solids": sum(report["summary"]["total_solids"]
+                                for report in files if "error" not in report),
+            "elapsed_s": time.perf_counter() - start,
+        },
+        "files": files,
+    })
 
 
 # --- Endpoint para GENERAR una nueva pieza desde código Python ---
@@ -115,33 +3332,47 @@ def generate_model():
     if not data or 'script' not in data:
         return jsonify({"error": "Se requiere un JSON con la clave 'script'"}), 400
     script_code = data['script']
-    file_path = None
     try:
-        local_scope = {}
-        # ¡LÍNEA CORREGIDA! Ahora usamos el diccionario CQ_EXEC_SCOPE
-        exec(script_code, CQ_EXEC_SCOPE, local_scope)
+        output = _requested_output(data)
+        profile = _requested_profile(request.headers)
+    except ProfileAccessError as e:
+        return jsonify({"error": str(e)}), 403
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return _generate_response(script_code, output,
+                              _download_name('generated_model', output), profile)
 
-        result_solid = None
-        # Buscamos en el 'local_scope' el resultado que ha dejado el script
-        for val in local_scope.values():
-            if isinstance(val, (cq.Workplane, cq.Shape)):
-                result_solid = val
-                break
-        
-        if result_solid is None:
-            return jsonify({"error": "No se encontró un objeto 'Workplane' o 'Shape' de CadQuery en el resultado del script."}), 400
-        
-        with tempfile.NamedTemporaryFile(suffix=".step", delete=False) as temp_file:
-            file_path = temp_file.name
-            cq.exporters.export(result_solid, file_path)
-            
-        return send_file(file_path, as_attachment=True, download_name='generated_model.step', mimetype='application/octet-stream')
+
+def _generate_response(script_code, output, download_name, profile=None):
+    """Ejecuta (o saca de la caché) un script de /generate y lo envía."""
+    cache_key = _generate_cache_key(script_code, output)
+    # Al perfilar se ignora la caché: interesa medir el script, no la caché
+    cached = RESULT_CACHE.get(cache_key) if profile is None else None
+    if cached is not None:
+        return _send_model_bytes(cached, download_name, 'HIT')
+
+    try:
+        script = SCRIPT_CACHE.compile(script_code)
+    except SyntaxError as e:
+        return jsonify({"error": f"Error de sintaxis en el script: {str(e)}"}), 400
+
+    try:
+        # Al perfilar interesa ver también la construcción de los engranes
+        prebuilt = prebuild_gears(script.gear_specs) if profile is None else ()
+        model_data, profile_data = _execute_profiled(
+            profile, run_generate_script, script, output, prebuilt)
+    except ScriptResultError as e:
+        return jsonify({"error": str(e)}), 400
+    except ResourceExceededError as e:
+        return jsonify(e.to_dict()), 422
     except Exception as e:
         # Usamos repr(e) para obtener un error más detallado si es necesario
         return jsonify({"error": f"Error al ejecutar el script de CadQuery: {repr(e)}"}), 500
-    finally:
-        if file_path and os.path.exists(file_path):
-            os.remove(file_path)
+
+    RESULT_CACHE.put(cache_key, model_data)
+    if profile_data is not None:
+        return _send_profiled_model(model_data, download_name, profile_data)
+    return _send_model_bytes(model_data, download_name, 'MISS')
 
 # --- Endpoint para MODIFICAR un archivo .STEP existente ---
 @app.route('/modify', methods=['POST'])
@@ -152,36 +3383,273 @@ def modify_model():
         return jsonify({"error": "No se encontró el 'script' de modificación en el formulario."}), 400
     step_file = request.files['step_file']
     script_code = request.form['script']
-    input_path, output_path = None, None
-    try:
-        with tempfile.NamedTemporaryFile(suffix=".step", delete=False) as temp_input_file:
-            step_file.save(temp_input_file.name)
-            input_path = temp_input_file.name
-        imported_wp = cq.importers.importStep(input_path)
-        local_scope = {'model': imported_wp}
-        exec(script_code, {"cq": cq}, local_scope)
-        result_solid = None
-        for val in local_scope.values():
-            if isinstance(val, (cq.Workplane, cq.Shape)):
-                result_solid = val
-                break
-        if result_solid is None:
-            return jsonify({"error": "No se encontró un objeto resultante en el script de modificación."}), 400
-        with tempfile.NamedTemporaryFile(suffix=".step", delete=False) as temp_output_file:
-            output_path = temp_output_file.name
-            cq.exporters.export(result_solid, output_path)
-        return send_file(output_path, as_attachment=True, download_name='modified_model.step', mimetype='application/octet-stream')
+    try:
+        output = _requested_output(request.form)
+        profile = _requested_profile(request.headers)
+    except ProfileAccessError as e:
+        return jsonify({"error": str(e)}), 403
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        script = SCRIPT_CACHE.compile(script_code)
+    except SyntaxError as e:
+        return jsonify({"error": f"Error de sintaxis en el script: {str(e)}"}), 400
+    # STEP_CACHE se consulta y se rellena aquí: la del hijo del sandbox se
+    # pierde con él.
+    upload = _step_upload(step_file)
+    step_brep = STEP_CACHE.get(upload.digest)
+    try:
+        (model_data, imported), profile_data = _execute_profiled(
+            profile, run_modify_script_brep, upload, script, output, step_brep)
+    except ScriptResultError as e:
+        return jsonify({"error": str(e)}), 400
+    except ResourceExceededError as e:
+        return jsonify(e.to_dict()), 422
     except Exception as e:
         return jsonify({"error": f"Error al modificar el modelo: {str(e)}"}), 500
-    finally:
-        if input_path and os.path.exists(input_path):
-            os.remove(input_path)
-        if output_path and os.path.exists(output_path):
-            os.remove(output_path)
+    if imported is not None:
+        STEP_CACHE.put(upload.digest, imported)
+    download_name = _download_name('modified_model', output)
+    if profile_data is not None:
+        return _send_profiled_model(model_data, download_name, profile_data)
+    return _send_model_bytes(model_data, download_name)
+
+# --- ENDPOINTS DE SESIONES DE MODIFICACIÓN ---
+@app.route('/sessions', methods=['POST'])
+def open_session():
+    """
+    Sube un STEP una sola vez y abre una sesión sobre él. Después, cada
+    POST /sessions/<id>/modify aplica un script al 'model' en memoria y
+    GET /sessions/<id>/model descarga el resultado actual.
+    """
+    if 'step_file' not in request.files:
+        return jsonify({"error": "No se encontró el archivo 'step_file' en la petición."}), 400
+    try:
+        session_id, summary = SESSIONS.open(_step_upload(request.files['step_file']))
+    except ResourceExceededError as e:
+        return jsonify(e.to_dict()), 422
+    except Exception as e:
+        return jsonify({"error": f"Error al abrir la sesión: {str(e)}"}), 500
+    return jsonify({"session_id": session_id,
+                    "idle_timeout_s": SESSIONS.idle_timeout, **summary}), 201
+
+@app.route('/sessions/<session_id>/modify', methods=['POST'])
+def modify_session(session_id):
+    """Aplica un script de modificación al modelo de la sesión."""
+    data = request.get_json(silent=True) or request.form
+    if 'script' not in data:
+        return jsonify({"error": "No se encontró el 'script' de modificación."}), 400
+    try:
+        script = SCRIPT_CACHE.compile(data['script'])
+    except SyntaxError as e:
+        return jsonify({"error": f"Error de sintaxis en el script: {str(e)}"}), 400
+
+    start = time.perf_counter()
+    try:
+        summary = SESSIONS.call(session_id, "modify", script)
+    except SessionNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except ScriptResultError as e:
+        return jsonify({"error": str(e)}), 400
+    except ResourceExceededError as e:
+        return jsonify(e.to_dict()), 422
+    except Exception as e:
+        return jsonify({"error": f"Error al modificar el modelo: {str(e)}"}), 500
+    return jsonify({"session_id": session_id,
+                    "elapsed_s": time.perf_counter() - start, **summary})
+
+@app.route('/sessions/<session_id>/model', methods=['GET'])
+def get_session_model(session_id):
+    """Exporta el modelo actual de la sesión en el formato pedido."""
+    try:
+        output = _requested_output(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        model_data = SESSIONS.call(session_id, "export", output)
+    except SessionNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except ResourceExceededError as e:
+        return jsonify(e.to_dict()), 422
+    except Exception as e:
+        return jsonify({"error": f"Error al exportar el modelo: {str(e)}"}), 500
+    return _send_model_bytes(model_data, _download_name('session_model', output))
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def close_session(session_id):
+    """Cierra la sesión y libera su proceso."""
+    if not SESSIONS.close(session_id):
+        return jsonify({"error": f"La sesión {session_id!r} no existe o ha expirado."}), 404
+    return '', 204
 
+# --- Endpoint para CONSTRUIR un engrane a partir de una especificación JSON ---
+@app.route('/gears', methods=['POST'])
+def build_gear():
+    """
+    Construye un engrane de cq_gears sin ejecutar código. Ejemplo:
+    {"class": "SpurGear", "args": [1.0, 20, 5.0], "kwargs": {"helix_angle": 20},
+     "build_args": {"bore_d": 5.0}, "format": "step"}
+    Las especificaciones iguales comparten caché y, si llegan a la vez, una
+    única construcción. Con "format" 'svg', 'dxf' o 'polyline' se devuelve
+    el contorno 2D (para corte láser o por agua) sin construir el sólido.
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "Se requiere un JSON con la especificación del engrane."}), 400
+    try:
+        spec = normalize_gear_spec(data)
+        output = _requested_output(data, outline=True)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if output["fmt"] in OUTLINE_FORMATS and spec["class"] not in OUTLINE_CLASSES:
+        return jsonify({"error": f"El contorno 2D no está disponible para {spec['class']}. Opciones: {', '.join(OUTLINE_CLASSES)}."}), 400
+    return _gear_response(spec, output, _download_name('gear', output))
+
+
+def _gear_response(spec, output, download_name):
+    """Construye (o saca de la caché) un engrane de /gears y lo envía."""
+    cache_key = _gear_cache_key(spec, output)
+    cached = RESULT_CACHE.get(cache_key)
+    if cached is not None:
+        return _send_model_bytes(cached, download_name, 'HIT')
+
+    # La clase y los parámetros los elige el cliente: incluso un contorno 2D
+    # puede agotar la memoria o el tiempo, así que todo pasa por el sandbox.
+    try:
+        model_data = _coalesced(cache_key, _execute_script, build_gear_spec,
+                                spec, output)
+    except ResourceExceededError as e:
+        return jsonify(e.to_dict()), 422
+    except Exception as e:
+        return jsonify({"error": f"Error al construir el engrane: {repr(e)}"}), 500
+
+    RESULT_CACHE.put(cache_key, model_data)
+    return _send_model_bytes(model_data, download_name, 'MISS')
+
+# --- Endpoint para TRIANGULAR una pieza con varios niveles de detalle ---
+@app.route('/tessellate', methods=['POST'])
+def tessellate_model():
+    """
+    Devuelve la malla de una pieza en el formato binario 'mesh' (ver
+    _mesh_lods_bytes), lista para subir a la GPU sin procesarla. La pieza
+    puede ser un 'step_file' (formulario), un 'script' de /generate o una
+    especificación de /gears (JSON). 'lods' fija los niveles de detalle.
+    """
+    if 'step_file' in request.files:
+        params = request.form
+    else:
+        params = request.get_json(silent=True)
+        if not params or ('script' not in params and 'class' not in params):
+            return jsonify({"error": "Se requiere un 'step_file', o un JSON con un 'script' o una especificación de engrane."}), 400
+
+    try:
+        output = {"fmt": "mesh", "lods": _requested_lods(
+            params.get('lods') or request.args.get('lods'))}
+        profile = _requested_profile(request.headers)
+    except ProfileAccessError as e:
+        return jsonify({"error": str(e)}), 403
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    download_name = _download_name('model', output)
+
+    if 'script' in params:
+        return _generate_response(params['script'], output, download_name, profile)
 
+    if 'class' in params:
+        try:
+            spec = normalize_gear_spec(params)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return _gear_response(spec, output, download_name)
 
+    upload = _step_upload(request.files['step_file'])
+    cache_key = _convert_cache_key(upload, output)
+    cached = RESULT_CACHE.get(cache_key)
+    if cached is not None:
+        return _send_model_bytes(cached, download_name, 'HIT')
 
+    # El STEP lo parsea y lo triangula OCC: viene del cliente, así que se
+    # hace en el sandbox, con STEP_CACHE consultada y rellenada aquí.
+    step_brep = STEP_CACHE.get(upload.digest)
+    try:
+        model_data, imported = _coalesced(cache_key, _execute_script,
+                                          convert_step_brep, upload, output,
+                                          step_brep)
+    except ResourceExceededError as e:
+        return jsonify(e.to_dict()), 422
+    except Exception as e:
+        return jsonify({"error": f"Error al triangular el archivo STEP: {str(e)}"}), 500
+
+    if imported is not None:
+        STEP_CACHE.put(upload.digest, imported)
+    RESULT_CACHE.put(cache_key, model_data)
+    return _send_model_bytes(model_data, download_name, 'MISS')
+
+# --- ENDPOINTS DE TRABAJOS ASÍNCRONOS ---
+@app.route('/jobs/generate', methods=['POST'])
+def submit_generate_job():
+    """Encola un script de /generate y devuelve el id del trabajo."""
+    data = request.get_json()
+    if not data or 'script' not in data:
+        return jsonify({"error": "Se requiere un JSON con la clave 'script'"}), 400
+    script_code = data['script']
+    try:
+        output = _requested_output(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    download_name = _download_name('generated_model', output)
+
+    cache_key = _generate_cache_key(script_code, output)
+    cached = RESULT_CACHE.get(cache_key)
+    if cached is not None:
+        job_id = JOB_QUEUE.complete('generate', download_name, cached)
+    else:
+        job_id = _submit_script_job(
+            'generate', download_name,
+            run_generate_script, script_code, output,
+            on_success=lambda model_data: RESULT_CACHE.put(cache_key, model_data))
 
+    return jsonify(_job_status(JOB_QUEUE.get(job_id))), 202
+
+@app.route('/jobs/modify', methods=['POST'])
+def submit_modify_job():
+    """Encola una modificación de un STEP y devuelve el id del trabajo."""
+    if 'step_file' not in request.files:
+        return jsonify({"error": "No se encontró el archivo 'step_file' en la petición."}), 400
+    if 'script' not in request.form:
+        return jsonify({"error": "No se encontró el 'script' de modificación en el formulario."}), 400
+    try:
+        output = _requested_output(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # El trabajo sobrevive a la petición y a su archivo temporal
+    upload = _step_upload(request.files['step_file']).loaded()
+    download_name = _download_name('modified_model', output)
+    if SCRIPT_SANDBOX.enabled:
+        job_id = JOB_QUEUE.submit('modify', download_name, _sandboxed_modify,
+                                  upload, request.form['script'], output,
+                                  _sandbox_gear_cache_dir(), local=True)
+    else:
+        job_id = JOB_QUEUE.submit('modify', download_name, run_modify_script,
+                                  upload, request.form['script'], output)
+    return jsonify(_job_status(JOB_QUEUE.get(job_id))), 202
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Devuelve el estado de un trabajo: queued, running, done o error."""
+    job = JOB_QUEUE.get(job_id)
+    if job is None:
+        return jsonify({"error": "Trabajo no encontrado."}), 404
+    return jsonify(_job_status(job))
 
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """Descarga el resultado de un trabajo terminado."""
+    job = JOB_QUEUE.get(job_id)
+    if job is None:
+        return jsonify({"error": "Trabajo no encontrado."}), 404
+    if job["status"] == "error":
+        return jsonify(_job_status(job)), 500
+    if job["status"] != "done":
+        return jsonify(_job_status(job)), 409
+    return _send_model_bytes(job["result"], job["download_name"])
@@ -0,0 +1,387 @@
+"""
+Generador de carga y medidor de latencia del servicio.
+
+Reproduce un corpus de peticiones realistas (cq_bench_corpus.json) contra la
+aplicación, dentro del mismo proceso con el cliente de pruebas de Flask o
+contra un servidor ya arrancado (--url http://localhost:8000), y muestra el
+rendimiento y los percentiles p50/p95/p99 por endpoint y por petición.
+
+El corpus tiene dos partes:
+  - "fixtures": archivos STEP de varios tamaños, descritos como
+    especificaciones de /gears; se construyen contra el propio servicio al
+    empezar.
+  - "requests": peticiones con nombre, peso relativo, método, ruta y cuerpo
+    ("json", o "form" más "files", que nombra un fixture por campo).
+
+Por defecto cada petición se altera para que no la sirva ninguna caché del
+servicio y se mida el camino en frío: a los scripts de /generate y
+/modify se les añade un comentario único, el módulo de los engranes
+(primer argumento numérico de sus constructores, en los scripts y en
+/gears) se desplaza una parte en 10^9 y a los STEP subidos se les añade un
+comentario único tras la cabecera, lo que cambia su SHA-256. Con --warm se envían tal cual. El
+informe cuenta las respuestas con X-Cache: HIT y los aciertos y fallos de
+las cachés del servicio durante la carga (GET /cache).
+
+Con --json se guarda el informe, y con --baseline se compara con uno
+anterior: si el p95 de algún endpoint empeora más de --max-regression, el
+programa termina con código 1.
+
+Ejemplos:
+    python cq_bench.py --concurrency 4 --duration 60
+    python cq_bench.py --url http://localhost:8000 --json run.json
+    python cq_bench.py --only analyze-small,analyze-large-quick --baseline run.json
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import defaultdict
+
+import numpy as np
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'cq_bench_corpus.json')
+PERCENTILES = (50, 95, 99)
+
+# Primer argumento numérico de un constructor (SpurGear(1.0, ..., module=1.0, ...)
+GEAR_MODULE = re.compile(r'\b([A-Z]\w*\(\s*(?:module\s*=\s*)?)(\d+(?:\.\d*)?)')
+# Estadísticas de GET /cache cuyos aciertos y fallos se comparan
+SERVER_CACHES = ('result_cache', 'step_cache', 'scripts')
+
+
+# --- DESTINOS ---
+class InProcessTarget:
+    """Envía las peticiones con el cliente de pruebas de Flask."""
+
+    name = 'in-process'
+
+    def __init__(self):
+        import app
+        self._app = app.app
+        self._local = threading.local()
+
+    def request(self, method, path, json_body=None, form=None, files=None, headers=None):
+        import io
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self._app.test_client()
+        data = None
+        if form is not None or files is not None:
+            data = dict(form or {})
+            for field, (file_name, content) in (files or {}).items():
+                data[field] = (io.BytesIO(content), file_name)
+        # El servicio solo acepta X-Client-Id de un proxy de confianza: aquí
+        # cada cliente se presenta con su propia dirección.
+        client_id = (headers or {}).get('X-Client-Id')
+        environ = {'REMOTE_ADDR': client_id} if client_id else {}
+        response = client.open(path, method=method, json=json_body, data=data,
+                               headers=headers, environ_base=environ)
+        return response.status_code, response.get_data(), response.headers.get('X-Cache')
+
+
+class HttpTarget:
+    """Envía las peticiones por HTTP a un servidor ya arrancado."""
+
+    def __init__(self, url, timeout):
+        self.name = url
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def request(self, method, path, json_body=None, form=None, files=None, headers=None):
+        headers = dict(headers or {})
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        elif form is not None or files is not None:
+            body, headers['Content-Type'] = _multipart(form or {}, files or {})
+
+        req = urllib.request.Request(self.url + path, data=body, method=method,
+                                     headers=headers)
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                return response.status, response.read(), response.headers.get('X-Cache')
+        except urllib.error.HTTPError as e:
+            return e.code, e.read(), e.headers.get('X-Cache')
+
+
+def _multipart(form, files):
+    """Codifica un formulario multipart/form-data."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for field, value in form.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; '
+                     f'name="{field}"\r\n\r\n{value}\r\n'.encode('utf-8'))
+    for field, (file_name, content) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; '
+                     f'filename="{file_name}"\r\nContent-Type: application/octet-stream\r\n\r\n'
+                     .encode('utf-8'))
+        parts.append(content)
+        parts.append(b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+# --- CORPUS ---
+def load_corpus(path, only=None):
+    with open(path, encoding='utf-8') as f:
+        corpus = json.load(f)
+    entries = corpus["requests"]
+    if only:
+        unknown = set(only) - {entry["name"] for entry in entries}
+        if unknown:
+            raise SystemExit(f"Peticiones desconocidas en --only: {', '.join(sorted(unknown))}")
+        entries = [entry for entry in entries if entry["name"] in only]
+    return corpus.get("fixtures", {}), entries
+
+
+def build_fixtures(target, fixtures, entries):
+    """Construye con /gears los STEP que usan las peticiones seleccionadas."""
+    needed = {name for entry in entries for name in entry.get("files", {}).values()}
+    built = {}
+    for name in sorted(needed):
+        status, content, _ = target.request('POST', '/gears', json_body=fixtures[name])
+        if status != 200:
+            raise SystemExit(f"No se pudo construir el fixture {name!r}: HTTP {status}")
+        built[name] = content
+        print(f"fixture {name}: {len(content) / 1e6:.2f} MB", file=sys.stderr)
+    return built
+
+
+def _nudged(value, rng):
+    """`value` desplazado una parte en 10^9 como mucho: otro engrane para las cachés."""
+    return float(value) * (1 + rng.randint(1, 10 ** 6) * 1e-15)
+
+
+def _cold_json(json_body, rng):
+    """Altera un cuerpo JSON de /generate o /gears para que ninguna caché lo sirva."""
+    if "script" in json_body:
+        # El comentario cambia la clave de RESULT_CACHE; el módulo, las de
+        # los engranes precalculados y GearBase.build_cache.
+        script = GEAR_MODULE.sub(lambda m: m.group(1) + repr(_nudged(m.group(2), rng)),
+                                 json_body["script"])
+        return dict(json_body, script=script + f"\n# bench {uuid.uuid4().hex}")
+    if json_body.get("args"):
+        args = list(json_body["args"])
+        args[0] = _nudged(args[0], rng)
+        return dict(json_body, args=args)
+    return json_body
+
+
+def _cold_step(content):
+    """Añade a un STEP un comentario único tras su primera línea."""
+    first, rest = content.split(b'\n', 1)
+    return first + f"\n/* bench {uuid.uuid4().hex} */\n".encode('ascii') + rest
+
+
+def _send(target, entry, fixtures, warm, client_id, rng):
+    json_body = entry.get("json")
+    form = entry.get("form")
+    files = {field: (f"{name}.step", fixtures[name])
+             for field, name in entry.get("files", {}).items()} or None
+    if not warm:
+        if json_body is not None:
+            json_body = _cold_json(json_body, rng)
+        if form is not None and "script" in form:
+            # Los scripts de /modify: el comentario evita la caché de scripts
+            form = dict(form, script=form["script"] + f"\n# bench {uuid.uuid4().hex}")
+        if files is not None:
+            files = {field: (file_name, _cold_step(content))
+                     for field, (file_name, content) in files.items()}
+    return target.request(entry.get("method", 'POST'), entry["path"],
+                          json_body=json_body, form=form, files=files,
+                          headers={'X-Client-Id': client_id})
+
+
+def server_cache_stats(target):
+    """Aciertos y fallos de las cachés del servicio (GET /cache), o None."""
+    try:
+        status, content, _ = target.request('GET', '/cache')
+        stats = json.loads(content) if status == 200 else None
+    except Exception:
+        stats = None
+    if stats is None:
+        return None
+    return {name: {"hits": stats[name].get("hits", 0), "misses": stats[name].get("misses", 0)}
+            for name in SERVER_CACHES if name in stats}
+
+
+def cache_delta(before, after):
+    """Diferencia entre dos server_cache_stats."""
+    if before is None or after is None:
+        return None
+    return {name: {counter: after[name][counter] - before[name].get(counter, 0)
+                   for counter in after[name]}
+            for name in after if name in before}
+
+
+# --- EJECUCIÓN ---
+def run(target, entries, fixtures, concurrency, duration, max_requests, warm,
+        clients, seed):
+    """
+    Lanza `concurrency` hilos que envían peticiones sin pausa, elegidas al
+    azar según su peso, hasta agotar `duration` segundos o `max_requests`
+    peticiones. Devuelve una lista de (nombre, ruta, estado, segundos,
+    X-Cache) y el tiempo total.
+    """
+    weights = [entry.get("weight", 1) for entry in entries]
+    samples = []
+    lock = threading.Lock()
+    sent = [0]
+    deadline = time.perf_counter() + duration if duration else None
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        client_id = f"bench-{index % clients}"
+        while True:
+            with lock:
+                if max_requests and sent[0] >= max_requests:
+                    return
+                sent[0] += 1
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            entry = rng.choices(entries, weights)[0]
+            start = time.perf_counter()
+            try:
+                status, _, cache = _send(target, entry, fixtures, warm, client_id, rng)
+            except Exception as e:
+                print(f"{entry['name']}: {e!r}", file=sys.stderr)
+                status, cache = 0, None
+            elapsed = time.perf_counter() - start
+            with lock:
+                samples.append((entry["name"], entry["path"], status, elapsed, cache))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True)
+               for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+
+def summarize(samples, wall_time):
+    """Agrupa las muestras por endpoint y por petición."""
+    groups = defaultdict(list)
+    for name, path, status, elapsed, cache in samples:
+        groups["endpoint", path].append((status, elapsed, cache))
+        groups["request", name].append((status, elapsed, cache))
+
+    report = {"endpoint": {}, "request": {}}
+    for (kind, key), group in sorted(groups.items()):
+        statuses = np.array([status for status, _, _ in group])
+        latencies = np.array([elapsed for status, elapsed, _ in group if 200 <= status < 300])
+        row = {
+            "count": len(group),
+            "ok": len(latencies),
+            "cache_hits": sum(cache == 'HIT' for _, _, cache in group),
+            "rejected": int(np.sum(statuses == 503)),
+            "errors": int(np.sum((statuses < 200) | (statuses >= 300) & (statuses != 503))),
+            "throughput_rps": len(latencies) / wall_time if wall_time else 0.0,
+        }
+        if len(latencies):
+            row["mean_s"] = float(latencies.mean())
+            for p, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES)):
+                row[f"p{p}_s"] = float(value)
+        report[kind][key] = row
+    return report
+
+
+def print_report(report, wall_time, total):
+    print(f"\n{total} peticiones en {wall_time:.1f} s ({total / wall_time:.2f} req/s)")
+    header = f"{'':28} {'n':>6} {'ok':>6} {'hit':>5} {'503':>5} {'err':>5} {'req/s':>7} " + \
+             " ".join(f"{'p%d' % p:>8}" for p in PERCENTILES)
+    for kind, title in (("endpoint", "Por endpoint"), ("request", "Por petición")):
+        print(f"\n{title}\n{header}")
+        for key, row in report[kind].items():
+            latencies = " ".join(f"{row[f'p{p}_s']:8.3f}" if f"p{p}_s" in row else f"{'-':>8}"
+                                 for p in PERCENTILES)
+            print(f"{key:28} {row['count']:6} {row['ok']:6} {row['cache_hits']:5} {row['rejected']:5} "
+                  f"{row['errors']:5} {row['throughput_rps']:7.2f} {latencies}")
+
+
+def print_cache_delta(delta):
+    if delta is None:
+        print("\nCachés del servicio: GET /cache no disponible")
+        return
+    print("\nCachés del servicio durante la carga")
+    for name, counters in delta.items():
+        print(f"{name:28} aciertos {counters['hits']:6}  fallos {counters['misses']:6}")
+
+
+def regressions(report, baseline, max_regression):
+    """Endpoints cuyo p95 empeora más de `max_regression` (fracción)."""
+    found = []
+    for path, row in report["endpoint"].items():
+        before = baseline.get("endpoint", {}).get(path, {}).get("p95_s")
+        after = row.get("p95_s")
+        if before and after and after > before * (1 + max_regression):
+            found.append((path, before, after))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', help="servidor destino; sin --url, en el mismo proceso")
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS)
+    parser.add_argument('--only', help="nombres de petición separados por comas")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=30.0,
+                        help="segundos de carga (0: sin límite de tiempo)")
+    parser.add_argument('--requests', type=int, default=0,
+                        help="número total de peticiones (0: sin límite)")
+    parser.add_argument('--clients', type=int, default=1,
+                        help="clientes distintos (X-Client-Id) entre los que repartir los hilos; "
+                             "con --url el servidor solo los distingue si esta "
+                             "máquina está en CQ_TRUSTED_PROXIES")
+    parser.add_argument('--warm', action='store_true',
+                        help="no alterar los scripts: permite aciertos de caché")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=600.0)
+    parser.add_argument('--json', help="guarda el informe en este archivo")
+    parser.add_argument('--baseline', help="informe anterior con el que comparar")
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    args = parser.parse_args(argv)
+    if not args.duration and not args.requests:
+        parser.error("hace falta --duration o --requests")
+
+    only = set(args.only.split(',')) if args.only else None
+    fixture_specs, entries = load_corpus(args.corpus, only)
+    target = HttpTarget(args.url, args.timeout) if args.url else InProcessTarget()
+    fixtures = build_fixtures(target, fixture_specs, entries)
+
+    print(f"destino {target.name}: {args.concurrency} hilos, {len(entries)} peticiones en el corpus",
+          file=sys.stderr)
+    caches_before = server_cache_stats(target)
+    samples, wall_time = run(target, entries, fixtures, args.concurrency, args.duration,
+                             args.requests, args.warm, max(1, args.clients), args.seed)
+    report = summarize(samples, wall_time)
+    report["server_caches"] = cache_delta(caches_before, server_cache_stats(target))
+    print_report(report, wall_time, len(samples))
+    print_cache_delta(report["server_caches"])
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(dict(report, target=target.name, wall_time_s=wall_time,
+                           concurrency=args.concurrency, warm=args.warm), f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            found = regressions(report, json.load(f), args.max_regression)
+        for path, before, after in found:
+            print(f"REGRESIÓN {path}: p95 {before:.3f} s -> {after:.3f} s")
+        if found:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
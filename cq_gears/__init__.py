@@ -28,6 +28,9 @@ from .rack_gear import RackGear, HerringboneRackGear
 from .worm_gear import Worm
 from .crossed_helical_gear import (CrossedHelicalGear, CrossedGearPair,
                                    HyperbolicGear, HyperbolicGearPair)
+from .cache import BuildCache
+from .profile import tooth_profiles, profile_dtype, PROFILE_KINDS
+from .outline import outline_svg, outline_dxf, OUTLINE_FORMATS
 
 __all__ = [
     'SpurGear',
@@ -45,6 +48,13 @@ __all__ = [
     'CrossedGearPair',
     'HyperbolicGear',
     'HyperbolicGearPair',
+    'BuildCache',
+    'tooth_profiles',
+    'profile_dtype',
+    'PROFILE_KINDS',
+    'outline_svg',
+    'outline_dxf',
+    'OUTLINE_FORMATS',
 ]
 
 
@@ -140,20 +140,6 @@ class BevelGear(GearBase):
         return pts
 
     
-    def gear_points(self):
-        tpts = np.concatenate((self.t_lflank_pts, self.t_tip_pts,
-                               self.t_rflank_pts, self.t_root_pts))
-        pts = tpts.copy()
-        angle = self.tau
-        for i in range(self.z - 1):
-            pts = np.concatenate((pts,
-                                  tpts @ rotation_matrix((0.0, 0.0, 1.0),
-                                                         angle)))
-            angle += self.tau
-        
-        return pts
-
-
     def _build_tooth_faces(self):
         pc_h = np.cos(self.gamma_r) * self.gs_r # pitch cone height
         pc_f = pc_h / np.cos(self.gamma_f) # extended pitch cone flank length
@@ -307,25 +293,28 @@ class BevelGear(GearBase):
 
 
     def _build(self, bore_d=None, trim_bottom=True, trim_top=True, **kv_args):
-        faces = self._build_gear_faces()
+        with self._stage('faces'):
+            faces = self._build_gear_faces()
 
-        shell = make_shell(faces)
-        body = cq.Solid.makeSolid(shell)
+        with self._stage('sewing'):
+            shell = make_shell(faces)
+            body = cq.Solid.makeSolid(shell)
 
-        body = self._trim_bottom(body, trim_bottom)
-        body = self._trim_top(body, trim_top)
+        with self._stage('features'):
+            body = self._trim_bottom(body, trim_bottom)
+            body = self._trim_top(body, trim_top)
 
-        t_align_angle = -self.mp_theta / 2.0 - np.pi / 2.0 + np.pi / self.z
+            t_align_angle = -self.mp_theta / 2.0 - np.pi / 2.0 + np.pi / self.z
 
-        # Put the gear on its bottom and align one of the teeth to x axis
-        body = (cq.Workplane('XY')
-                .add(body)
-                .rotate((0.0, 0.0, 0.0), (1.0, 0.0, 0.0), 180.0)
-                .translate((0.0, 0.0, self.cone_h))
-                .rotate((0.0, 0.0, 0.0), (0.0, 0.0, 1.0),
-                        np.degrees(t_align_angle))).solids().val()
+            # Put the gear on its bottom and align one of the teeth to x axis
+            body = (cq.Workplane('XY')
+                    .add(body)
+                    .rotate((0.0, 0.0, 0.0), (1.0, 0.0, 0.0), 180.0)
+                    .translate((0.0, 0.0, self.cone_h))
+                    .rotate((0.0, 0.0, 0.0), (0.0, 0.0, 1.0),
+                            np.degrees(t_align_angle))).solids().val()
 
-        body = self._make_bore(body, bore_d)
+            body = self._make_bore(body, bore_d)
 
         return body
 
@@ -0,0 +1,186 @@
+#! /usr/bin/python3
+
+'''
+CQ_Gears - CadQuery based involute profile gear generator
+
+Copyright 2021 meadiode@github
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import cadquery as cq
+
+
+def freeze(value):
+    '''Convert a (possibly nested) parameter value into a hashable canonical
+       form, so equal parameter sets always produce equal cache keys
+       value - a number, string, sequence, dict, numpy array, etc.
+       return - nested tuples of plain python values
+    '''
+    if isinstance(value, dict):
+        return ('dict',) + tuple(sorted((str(k), freeze(v))
+                                        for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return ('seq',) + tuple(freeze(v) for v in value)
+    if isinstance(value, np.ndarray):
+        return ('array',) + tuple(freeze(v) for v in value.tolist())
+    if isinstance(value, np.generic):
+        return freeze(value.item())
+    if isinstance(value, float) and value.is_integer():
+        # 20 and 20.0 describe the same gear
+        return int(value)
+    if isinstance(value, cq.Color):
+        return ('color',) + tuple(value.toTuple())
+    return value
+
+
+def make_key(*parts):
+    '''Make a cache key out of arbitrary parameter values
+       parts - values to be frozen and hashed
+       return - hex digest string
+    '''
+    return hashlib.sha256(repr(freeze(parts)).encode('utf-8')).hexdigest()
+
+
+class BuildCache:
+    '''Memoization store for built gear bodies.
+
+       The most recently used bodies are kept in memory; the least recently
+       used ones are evicted, and if cache_dir is set they are spilled into
+       BREP files there, from which they can be loaded back later.
+
+       max_items - number of bodies to keep in memory
+       cache_dir - directory for the BREP file cache, or None to disable it
+       max_disk_bytes - total size the BREP files are pruned down to, least
+                        recently used first, or None for no limit
+    '''
+
+    def __init__(self, max_items=32, cache_dir=None, max_disk_bytes=None):
+        self.max_items = max_items
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._bodies = OrderedDict()
+        self._lock = threading.Lock()
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+
+    def _brep_path(self, key):
+        return os.path.join(self.cache_dir, key + '.brep')
+
+
+    def get(self, key):
+        '''Get a body by its key
+           key - cache key, as returned by make_key
+           return - a copy of the cached body, or None if there is none
+        '''
+        with self._lock:
+            body = self._bodies.get(key)
+            if body is not None:
+                self._bodies.move_to_end(key)
+
+        if body is None and self.cache_dir is not None:
+            path = self._brep_path(key)
+            if os.path.exists(path):
+                body = cq.Shape.importBrep(path)
+                os.utime(path)
+                self.put(key, body)
+
+        if body is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        # The cached body is shared, give away a lightweight copy of it so
+        # in-place operations(e.g. Shape.move) on the result don't affect it
+        return body.moved(cq.Location())
+
+
+    def put(self, key, body):
+        '''Put a body into the cache
+           key - cache key, as returned by make_key
+           body - cq.Shape instance to store
+        '''
+        with self._lock:
+            self._bodies[key] = body
+            self._bodies.move_to_end(key)
+
+            evicted = []
+            while len(self._bodies) > self.max_items:
+                evicted.append(self._bodies.popitem(last=False))
+
+        if self.cache_dir is not None and evicted:
+            for ekey, ebody in evicted:
+                self._spill(ekey, ebody)
+            self._prune()
+
+
+    def _spill(self, key, body):
+        path = self._brep_path(key)
+        if not os.path.exists(path):
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            body.exportBrep(tmp_path)
+            os.replace(tmp_path, path)
+
+
+    def _prune(self):
+        if self.max_disk_bytes is None:
+            return
+
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith('.brep'):
+                st = entry.stat()
+                files.append((st.st_mtime, st.st_size, entry.path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+
+    def flush(self):
+        '''Write the bodies kept in memory into BREP files too, so they
+           outlive a short-lived process; does nothing without cache_dir
+        '''
+        if self.cache_dir is None:
+            return
+
+        with self._lock:
+            bodies = list(self._bodies.items())
+
+        for key, body in bodies:
+            self._spill(key, body)
+        self._prune()
+
+
+    def clear(self):
+        '''Drop all the bodies kept in memory, BREP files are left intact'''
+        with self._lock:
+            self._bodies.clear()
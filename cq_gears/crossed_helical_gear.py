@@ -21,7 +21,7 @@ limitations under the License.
 import numpy as np
 import cadquery as cq
 from .spur_gear import GearBase, SpurGear
-from .utils import circle3d_by3points
+from .profile import tooth_profiles
 
 class CrossedHelicalGear(SpurGear):
     
@@ -36,87 +36,22 @@ class CrossedHelicalGear(SpurGear):
         self.helix_angle = np.radians(helix_angle)
         self.width = width
 
+        # The profile is the transverse one, with the module and the
+        # pressure angle projected through the helix angle
+        self._set_profile(tooth_profiles(module, teeth_number, pressure_angle,
+                                         backlash, clearance, helix_angle,
+                                         self.ka, self.kd, 'crossed',
+                                         self.curve_points))
 
-        at0 = np.arctan(a0 / np.cos(self.helix_angle))
-        mt = m / np.cos(self.helix_angle)
-        
-        d0 = mt * z         # pitch diameter
-        adn = self.ka / (z / d0) # addendum
-        ddn = self.kd / (z / d0) # dedendum
-        da = d0 + 2.0 * adn # addendum circle diameter
-        dd = d0 - 2.0 * ddn - 2.0 * clearance # dedendum circle diameter
-        inv_a0 = np.tan(at0) - at0
-
-        self.r0 = r0 = d0 / 2.0 # pitch radius
-        self.ra = ra = da / 2.0 # addendum radius
-        self.rd = rd = dd / 2.0 # dedendum radius
-        self.rb = rb = np.cos(at0) * r0 # base circle radius
-        self.rr = rr = max(rb, rd) # tooth root radius
-        self.tau = tau = np.pi * 2.0 / z # pitch angle
-
-        s0 =  r0 * np.pi / z # tooth thickness on the pitch circle
-        
-        
         if helix_angle != 0.0:
             self.twist_angle = width / \
-                                (r0 * np.tan(np.pi / 2.0 - self.helix_angle))
+                                (self.r0 * np.tan(np.pi / 2.0 - self.helix_angle))
         else:
             self.surface_splines = 2
             self.twist_angle = 0.0
 
         self.build_params = build_params
 
-        # Calculate involute curve points for the left side of the tooth
-        r = np.linspace(rr, ra, self.curve_points)
-        cos_a = r0 / r * np.cos(at0)
-        a = np.arccos(np.clip(cos_a, -1.0, 1.0))
-        inv_a = np.tan(a) - a
-        s = r * (s0 / d0 + inv_a0 - inv_a)
-        phi = s / r
-        self.t_lflank_pts = np.dstack((np.cos(phi) * r,
-                                       np.sin(phi) * r,
-                                       np.zeros(self.curve_points))).squeeze()
-
-        # Calculate tooth tip points - an arc lying on the addendum circle
-        b = np.linspace(phi[-1], -phi[-1], self.curve_points)
-        self.t_tip_pts = np.dstack((np.cos(b) * ra,
-                                    np.sin(b) * ra,
-                                    np.zeros(self.curve_points))).squeeze()
-
-        # Get right side involute curve points by mirroring the left side
-        self.t_rflank_pts = np.dstack(((np.cos(-phi) * r)[::-1],
-                                       (np.sin(-phi) * r)[::-1],
-                                       np.zeros(self.curve_points))).squeeze()
-
-        # Calculate tooth root points - an arc that starts at the right side of
-        # the tooth and goes to the left side of the next tooth. The mid-point
-        # of that arc lies on the dedendum circle.
-        rho = tau - phi[0] * 2.0
-        # Get the three points defining the arc
-        p1 = np.array((self.t_rflank_pts[-1][0],
-                       self.t_rflank_pts[-1][1],
-                       0.0))
-        p2 = np.array((np.cos(-phi[0] - rho / 2.0) * rd,
-              np.sin(-phi[0] - rho / 2.0) * rd, 0.0))
-        p3 = np.array((np.cos(-phi[0] - rho) * rr,
-              np.sin(-phi[0] - rho) * rr, 0.0))
-
-        # Calculate arc's center and radius
-        bcr, bcxy = circle3d_by3points(p1, p2, p3)
-        # Calculate start and end angles
-        t1 = np.arctan2(p1[1] - bcxy[1], p1[0] - bcxy[0])
-        t2 = np.arctan2(p3[1] - bcxy[1], p3[0] - bcxy[0])
-        if t1 < 0.0:
-            t1 += np.pi * 2.0
-        if t2 < 0.0:
-            t2 += np.pi * 2.0
-        t1, t2 = min(t1, t2), max(t1, t2)
-        t = np.linspace(t1 + np.pi * 2.0, t2 + np.pi * 2.0, self.curve_points)
-
-        self.t_root_pts = np.dstack((bcxy[0] + bcr * np.cos(t),
-                                     bcxy[1] + bcr * np.sin(t),
-                                     np.zeros(self.curve_points))).squeeze()
-
 
 
 class CrossedGearPair(GearBase):
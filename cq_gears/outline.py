@@ -0,0 +1,225 @@
+#! /usr/bin/python3
+
+'''
+CQ_Gears - CadQuery based involute profile gear generator
+
+Copyright 2021 meadiode@github
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import numpy as np
+
+
+# Outlines are closed polylines - arrays of the shape (n, 2), the last point
+# connected to the first one. A gear outline is a list of them: the outer
+# boundary counterclockwise, then the holes clockwise.
+
+
+def arc_points(r, a1, a2, tol, center=(0.0, 0.0)):
+    '''Approximate a circular arc with a polyline
+       r - arc radius
+       a1, a2 - start and end angles (radians), the arc goes from a1 to a2
+                counterclockwise if a2 > a1, clockwise otherwise
+       tol - maximum deviation of the chords from the arc
+       center - arc center
+       return - an array of the shape (n, 2), both ends included
+    '''
+    if r <= tol:
+        step = np.pi / 2.0
+    else:
+        step = 2.0 * np.arccos(1.0 - tol / r)
+    n = max(2, int(np.ceil(abs(a2 - a1) / step)) + 1)
+    t = np.linspace(a1, a2, n)
+
+    return np.stack((center[0] + np.cos(t) * r,
+                     center[1] + np.sin(t) * r), axis=-1)
+
+
+def circle_loop(r, tol, center=(0.0, 0.0)):
+    '''Approximate a circle with a closed polyline, counterclockwise'''
+    return arc_points(r, 0.0, np.pi * 2.0, tol, center)[:-1]
+
+
+def signed_area(loop):
+    '''Get the area enclosed by a closed polyline, positive if the polyline
+       goes counterclockwise
+    '''
+    x, y = loop[:, 0], loop[:, 1]
+    return (np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2.0
+
+
+def oriented(loop, ccw=True):
+    '''Get a closed polyline going in the given direction'''
+    if (signed_area(loop) > 0.0) != ccw:
+        return loop[::-1]
+    return loop
+
+
+def dedup(loop, tol=1e-9):
+    '''Drop the points of a closed polyline coinciding with the next one'''
+    gaps = np.linalg.norm(np.roll(loop, -1, axis=0) - loop, axis=1)
+    return loop[gaps > tol]
+
+
+def cut_sector(loop, a1, a2, r, tol):
+    '''Replace the part of a star-shaped (about the origin) closed polyline
+       lying within an angular sector with an arc, as if the sector beyond
+       the arc radius was cut away
+       loop - an array of the shape (n, 2)
+       a1, a2 - sector bounding angles (radians), a1 < a2 < a1 + 2 * pi
+       r - arc radius
+       tol - maximum deviation of the arc chords
+       return - the resulting closed polyline
+    '''
+    span = a2 - a1
+    rel = np.mod(np.arctan2(loop[:, 1], loop[:, 0]) - a1, np.pi * 2.0)
+    inside = rel < span
+
+    if inside.all():
+        raise ValueError('The sector covers the whole outline')
+    if not inside.any():
+        return loop
+
+    # Start from a point outside of the sector, so the points inside form
+    # a single run
+    loop = np.roll(loop, -int(np.argmin(inside)), axis=0)
+    inside = np.roll(inside, -int(np.argmin(inside)))
+    first = int(np.argmax(inside))
+
+    if signed_area(loop) > 0.0:
+        arc = arc_points(r, a1, a2, tol)
+    else:
+        arc = arc_points(r, a2, a1, tol)
+
+    return np.concatenate((loop[:first], arc, loop[first:][~inside[first:]]))
+
+
+def _fillet(center, r, p1, p2, tol):
+    a1 = np.arctan2(p1[1] - center[1], p1[0] - center[0])
+    a2 = np.arctan2(p2[1] - center[1], p2[0] - center[0])
+    a2 = a1 + (a2 - a1 + np.pi) % (np.pi * 2.0) - np.pi
+
+    return arc_points(r, a1, a2, tol, center)
+
+
+def spoke_cutout(r1, r2, tau, spoke_width, fillet, tol):
+    '''Get the cutout between two neighbouring spokes, the same shape
+       SpurGear._make_spokes cuts out: bounded by the circles r1 and r2 and
+       by the edges of the spokes lying along the angles 0 and tau
+       r1, r2 - inner and outer radii
+       tau - angle between the spokes
+       spoke_width - width of a spoke
+       fillet - radius of the corner fillets, or None
+       tol - maximum deviation of the arc chords
+       return - a closed polyline, counterclockwise
+    '''
+    h = spoke_width / 2.0
+    f = 0.0 if fillet is None else fillet
+
+    # Fillet centers, tangent to the spoke edge y = h and to the inner
+    # (from the outside) or to the outer (from the inside) circle
+    ci = np.array((np.sqrt((r1 + f) ** 2 - (h + f) ** 2), h + f))
+    co_x2 = (r2 - f) ** 2 - (h + f) ** 2
+    assert co_x2 > ci[0] ** 2, 'Spokes do not leave space for the cutouts'
+    co = np.array((np.sqrt(co_x2), h + f))
+
+    # Tangent points: on the inner circle, on the spoke edge (twice) and on
+    # the outer circle
+    ti = ci * r1 / (r1 + f)
+    to = co * r2 / (r2 - f)
+    edge = np.concatenate((_fillet(ci, f, ti, (ci[0], h), tol),
+                           _fillet(co, f, (co[0], h), to, tol)))
+
+    ai = np.arctan2(ti[1], ti[0])
+    ao = np.arctan2(to[1], to[0])
+    assert ao < tau / 2.0, 'Spokes do not leave space for the cutouts'
+
+    # The other side is the mirror image about the bisector of the cutout
+    c2, s2 = np.cos(tau), np.sin(tau)
+    mirror = np.array(((c2, s2), (s2, -c2)))
+
+    loop = np.concatenate((edge,
+                           arc_points(r2, ao, tau - ao, tol)[1:-1],
+                           (edge @ mirror)[::-1],
+                           arc_points(r1, tau - ai, ai, tol)[1:-1]))
+
+    return dedup(loop)
+
+
+def rotated(loop, alpha):
+    '''Rotate a polyline about the origin by alpha radians counterclockwise'''
+    c, s = np.cos(alpha), np.sin(alpha)
+    return loop @ np.array(((c, s), (-s, c)))
+
+
+def _bounds(loops):
+    pts = np.concatenate(loops)
+    return pts.min(axis=0), pts.max(axis=0)
+
+
+def _coords(loop, fmt, sep, flip=False):
+    pts = loop * (1.0, -1.0) if flip else loop
+    return sep.join((fmt,) * len(pts)) % tuple(pts.ravel().tolist())
+
+
+def outline_svg(loops, margin=1.0, stroke_width=0.1):
+    '''Write an outline as an SVG document, one path with the even-odd fill
+       rule, in millimeters (the units of the gear)
+       loops - list of closed polylines
+       margin - space around the outline
+       stroke_width - width of the path stroke
+       return - the document as str
+    '''
+    lo, hi = _bounds(loops)
+    x, y = lo[0] - margin, -hi[1] - margin
+    w, h = hi - lo + margin * 2.0
+
+    d = ' '.join('M' + _coords(loop, '%.4f,%.4f', ' L', flip=True) + ' Z'
+                 for loop in loops)
+
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<svg xmlns="http://www.w3.org/2000/svg" '
+            f'width="{w:.4f}mm" height="{h:.4f}mm" '
+            f'viewBox="{x:.4f} {y:.4f} {w:.4f} {h:.4f}">\n'
+            f'<path fill="none" fill-rule="evenodd" stroke="black" '
+            f'stroke-width="{stroke_width}" d="{d}"/>\n'
+            '</svg>\n')
+
+
+def outline_dxf(loops, layer='0'):
+    '''Write an outline as an ASCII DXF (R12) drawing, one closed POLYLINE
+       entity per loop
+       loops - list of closed polylines
+       layer - layer name of the entities
+       return - the drawing as str
+    '''
+    lines = ['0', 'SECTION', '2', 'HEADER', '9', '$ACADVER', '1', 'AC1009',
+             '0', 'ENDSEC', '0', 'SECTION', '2', 'ENTITIES']
+
+    for loop in loops:
+        lines += ['0', 'POLYLINE', '8', layer, '66', '1',
+                  '10', '0.0', '20', '0.0', '30', '0.0', '70', '1']
+        lines.append(_coords(loop, f'0\nVERTEX\n8\n{layer}\n'
+                                   '10\n%.4f\n20\n%.4f\n30\n0.0', '\n'))
+        lines += ['0', 'SEQEND', '8', layer]
+
+    lines += ['0', 'ENDSEC', '0', 'EOF']
+
+    return '\n'.join(lines) + '\n'
+
+
+OUTLINE_FORMATS = {
+    'svg': outline_svg,
+    'dxf': outline_dxf,
+}
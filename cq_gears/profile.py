@@ -0,0 +1,180 @@
+#! /usr/bin/python3
+
+'''
+CQ_Gears - CadQuery based involute profile gear generator
+
+Copyright 2021 meadiode@github
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import numpy as np
+
+from .utils import circles3d_by3points
+
+
+# external - teeth on the outside (SpurGear)
+# internal - teeth on the inside (RingGear)
+# crossed - transverse profile of a crossed helical gear (CrossedHelicalGear)
+PROFILE_KINDS = ('external', 'internal', 'crossed')
+
+
+def profile_dtype(curve_points=20):
+    '''Get the structured dtype of the records returned by tooth_profiles
+       curve_points - number of points approximating each curve
+       return - numpy dtype with the input parameters, the gear radii, the
+                pitch angle, a validity flag and the four tooth curves,
+                named as the corresponding gear attributes
+    '''
+    pts = (np.float64, (curve_points, 3))
+    return np.dtype([('module', np.float64),
+                     ('teeth_number', np.float64),
+                     ('pressure_angle', np.float64),
+                     ('backlash', np.float64),
+                     ('clearance', np.float64),
+                     ('helix_angle', np.float64),
+                     ('r0', np.float64), # pitch radius
+                     ('ra', np.float64), # addendum radius
+                     ('rd', np.float64), # dedendum radius
+                     ('rb', np.float64), # base circle radius
+                     ('rr', np.float64), # tooth root radius
+                     ('tau', np.float64), # pitch angle
+                     ('valid', np.bool_),
+                     ('t_lflank_pts',) + pts,
+                     ('t_tip_pts',) + pts,
+                     ('t_rflank_pts',) + pts,
+                     ('t_root_pts',) + pts])
+
+
+def _points(x, y):
+    return np.stack((x, y, np.zeros_like(x)), axis=-1)
+
+
+def tooth_profiles(module, teeth_number, pressure_angle=20.0, backlash=0.0,
+                   clearance=0.0, helix_angle=0.0, addendum_coeff=1.0,
+                   dedendum_coeff=1.25, kind='external', curve_points=20):
+    '''Calculate the tooth profiles of many gears at once
+       module, teeth_number, pressure_angle (degrees), backlash, clearance,
+       helix_angle (degrees), addendum_coeff, dedendum_coeff - scalars or
+           arrays, broadcast against each other
+       kind - one of PROFILE_KINDS, the same for all the gears
+       curve_points - number of points approximating each curve
+       return - structured array of the broadcast shape with profile_dtype
+                records; a record is not valid if the dedendum circle
+                collapses or the profile could not be calculated
+    '''
+    if kind not in PROFILE_KINDS:
+        raise ValueError(f'Unknown profile kind {kind!r}, expected one of '
+                         f'{", ".join(PROFILE_KINDS)}')
+
+    params = np.broadcast_arrays(*(np.asarray(p, dtype=np.float64)
+                                   for p in (module, teeth_number,
+                                             pressure_angle, backlash,
+                                             clearance, helix_angle,
+                                             addendum_coeff, dedendum_coeff)))
+    shape = params[0].shape
+    m, z, pa, bl, cl, ha, ka, kd = (p.ravel() for p in params)
+    n = curve_points
+
+    a0 = np.radians(pa)
+    helix = np.radians(ha)
+    sign = -1.0 if kind == 'internal' else 1.0
+
+    if kind == 'crossed':
+        # Transverse pressure angle and module
+        a0 = np.arctan(a0 / np.cos(helix))
+        m = m / np.cos(helix)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d0 = m * z # pitch diameter
+        adn = ka / (z / d0) # addendum
+        ddn = kd / (z / d0) # dedendum
+        da = d0 + sign * 2.0 * adn # addendum circle diameter
+        dd = d0 - sign * (2.0 * ddn + 2.0 * cl) # dedendum circle diameter
+        inv_a0 = np.tan(a0) - a0
+
+        r0 = d0 / 2.0
+        ra = da / 2.0
+        rd = dd / 2.0
+        rb = np.cos(a0) * d0 / 2.0
+        rr = np.maximum(rb, rd)
+        tau = np.pi * 2.0 / z
+
+        # Tooth thickness on the pitch circle
+        if kind == 'crossed':
+            s0 = r0 * np.pi / z
+        else:
+            s0 = m * (np.pi / 2.0 - sign * bl * np.tan(a0))
+
+        # Involute curve points for the left side of the tooth, for internal
+        # teeth the flank goes from the addendum circle outwards
+        if kind == 'internal':
+            r = np.linspace(ra, rr, n, axis=-1)
+        else:
+            r = np.linspace(rr, ra, n, axis=-1)
+        cos_a = r0[:, np.newaxis] / r * np.cos(a0)[:, np.newaxis]
+        a = np.arccos(np.clip(cos_a, -1.0, 1.0))
+        inv_a = np.tan(a) - a
+        s = r * ((s0 / d0 + inv_a0)[:, np.newaxis] - inv_a)
+        phi = s / r
+        lflank = _points(np.cos(phi) * r, np.sin(phi) * r)
+
+        # Tooth tip points - an arc lying on the addendum circle (the
+        # dedendum circle of a ring gear)
+        tip_r = (rd if kind == 'internal' else ra)[:, np.newaxis]
+        b = np.linspace(phi[:, -1], -phi[:, -1], n, axis=-1)
+        tip = _points(np.cos(b) * tip_r, np.sin(b) * tip_r)
+
+        # Right side involute curve points by mirroring the left side
+        rflank = _points((np.cos(-phi) * r)[:, ::-1],
+                         (np.sin(-phi) * r)[:, ::-1])
+
+        # Tooth root points - an arc from the right side of the tooth to the
+        # left side of the next tooth, defined by three points
+        rho = tau - phi[:, 0] * 2.0
+        if kind == 'internal':
+            mid_r, end_r = ra, ra
+        else:
+            mid_r, end_r = rd, rr
+        p1 = rflank[:, -1]
+        p2 = _points(np.cos(-phi[:, 0] - rho / 2.0) * mid_r,
+                     np.sin(-phi[:, 0] - rho / 2.0) * mid_r)
+        p3 = _points(np.cos(-phi[:, 0] - rho) * end_r,
+                     np.sin(-phi[:, 0] - rho) * end_r)
+
+        bcr, bcxy = circles3d_by3points(p1, p2, p3)
+        t1 = np.arctan2(p1[:, 1] - bcxy[:, 1], p1[:, 0] - bcxy[:, 0])
+        t2 = np.arctan2(p3[:, 1] - bcxy[:, 1], p3[:, 0] - bcxy[:, 0])
+        t1 = np.where(t1 < 0.0, t1 + np.pi * 2.0, t1)
+        t2 = np.where(t2 < 0.0, t2 + np.pi * 2.0, t2)
+        t1, t2 = np.minimum(t1, t2), np.maximum(t1, t2)
+        if kind == 'internal':
+            t1, t2 = t2, t1
+        t = np.linspace(t1 + np.pi * 2.0, t2 + np.pi * 2.0, n, axis=-1)
+        root = _points(bcxy[:, 0, np.newaxis] + bcr[:, np.newaxis] * np.cos(t),
+                       bcxy[:, 1, np.newaxis] + bcr[:, np.newaxis] * np.sin(t))
+
+    profiles = np.empty(len(m), dtype=profile_dtype(n))
+    for name, value in (('module', params[0].ravel()), ('teeth_number', z),
+                        ('pressure_angle', pa), ('backlash', bl),
+                        ('clearance', cl), ('helix_angle', ha),
+                        ('r0', r0), ('ra', ra), ('rd', rd), ('rb', rb),
+                        ('rr', rr), ('tau', tau), ('t_lflank_pts', lflank),
+                        ('t_tip_pts', tip), ('t_rflank_pts', rflank),
+                        ('t_root_pts', root)):
+        profiles[name] = value
+
+    curves = np.concatenate((lflank, tip, rflank, root), axis=1)
+    profiles['valid'] = (dd > 0.0) & np.isfinite(curves).all(axis=(1, 2))
+
+    return profiles.reshape(shape)
@@ -21,7 +21,8 @@ limitations under the License.
 import numpy as np
 import cadquery as cq
 
-from .utils import circle3d_by3points, rotation_matrix, make_shell
+from .utils import (circle3d_by3points, rotation_matrix, translated_copies,
+                    make_shell)
 from .spur_gear import GearBase
 
 
@@ -77,17 +78,17 @@ class RackGear(GearBase):
         return pts
 
 
-    def gear_points(self):
-        tpts = np.concatenate((self.t_lflank_pts, self.t_tip_pts,
-                               self.t_rflank_pts, self.t_root_pts))
-        pts = tpts.copy()
+    def gear_points(self, out=None):
+        '''Get the outline points of 11 consecutive teeth along X, all the
+           translations applied at once
+           out - optional preallocated C-contiguous array of the shape
+                 (11 * len(tooth_points()), 3) to write the points into
+           return - an array of the shape (11 * len(tooth_points()), 3)
+        '''
+        offsets = np.zeros((11, 3))
+        offsets[:, 0] = np.arange(11) * np.pi * self.m
 
-        for i in range(10):
-            ttpts = tpts.copy()
-            ttpts[:, 0] += np.pi * self.m * (i + 1)
-            pts = np.concatenate((pts, ttpts))
-
-        return pts
+        return translated_copies(self.tooth_points(), offsets, out)
     
     
     def _build_tooth_faces(self, helix_angle, x_pos, z_pos, width):
@@ -244,14 +245,32 @@ class RackGear(GearBase):
 
 
     def _build(self):
-        faces = self._build_gear_faces()
+        with self._stage('faces'):
+            faces = self._build_gear_faces()
 
-        shell = make_shell(faces)
-        body = cq.Solid.makeSolid(shell)
+        with self._stage('sewing'):
+            shell = make_shell(faces)
+            body = cq.Solid.makeSolid(shell)
 
         return body
 
 
+    def _outline(self, *args, **kv_args):
+        # The teeth along the top edge, trimmed at both ends like the
+        # side faces of the body trim them
+        offsets = np.zeros((self.z + 1, 3))
+        offsets[:, 0] = np.arange(self.z + 1) * np.pi * self.m
+        pts = translated_copies(self.tooth_points(), offsets)[:, :2]
+
+        inside = (pts[:, 0] > 0.0) & (pts[:, 0] < self.length)
+        ends = np.array((0.0, self.length))
+        ends = np.stack((ends, np.interp(ends, pts[:, 0], pts[:, 1])), axis=-1)
+        bottom = self.ld - self.height
+
+        return [np.concatenate((ends[:1], pts[inside], ends[1:],
+                                ((self.length, bottom), (0.0, bottom))))]
+
+
 class HerringboneRackGear(RackGear):
     
     def _build_tooth_faces(self, helix_angle, x_pos, z_pos, width):
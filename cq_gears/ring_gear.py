@@ -22,8 +22,10 @@ import numpy as np
 import cadquery as cq
 import warnings
 
-from .utils import circle3d_by3points, rotation_matrix, make_shell
+from .utils import rotation_matrix, make_shell
 from .spur_gear import GearBase, SpurGear, HerringboneGear
+from .profile import tooth_profiles
+from .outline import circle_loop
 
 
 class RingGear(SpurGear):
@@ -40,84 +42,21 @@ class RingGear(SpurGear):
         self.width = width
         self.rim_width = rim_width
 
-        d0 = m * z         # pitch diameter
-        adn = self.ka / (z / d0) # addendum
-        ddn = self.kd / (z / d0) # dedendum
-        da = d0 - 2.0 * adn # addendum circle diameter
-        dd = d0 + 2.0 * ddn + 2.0 * clearance # dedendum circle diameter
-        s0 = m * (np.pi / 2.0 + backlash * np.tan(a0)) # tooth thickness on
-                                                       # the pitch circle
-        inv_a0 = np.tan(a0) - a0
-
-        self.r0 = r0 = d0 / 2.0 # pitch radius
-        self.ra = ra = da / 2.0 # addendum radius
-        self.rd = rd = dd / 2.0 # dedendum radius
-        self.rb = rb = np.cos(a0) * d0 / 2.0 # base circle radius
-        self.rr = rr = max(rb, rd) # tooth root radius
-        self.tau = tau = np.pi * 2.0 / z # pitch angle
+        self._set_profile(tooth_profiles(module, teeth_number, pressure_angle,
+                                         backlash, clearance, helix_angle,
+                                         self.ka, self.kd, 'internal',
+                                         self.curve_points))
 
         if helix_angle != 0.0:
             self.twist_angle = width / \
-                                (r0 * np.tan(np.pi / 2.0 - self.helix_angle))
+                                (self.r0 * np.tan(np.pi / 2.0 - self.helix_angle))
         else:
             self.surface_splines = 2
             self.twist_angle = 0.0
 
-        self.rim_r = rd + rim_width
+        self.rim_r = self.rd + rim_width
         self.build_params = build_params
 
-        # Calculate involute curve points for the left side of the tooth
-        r = np.linspace(ra, rr, self.curve_points)
-        cos_a = r0 / r * np.cos(a0)
-        a = np.arccos(np.clip(cos_a, -1.0, 1.0))
-        inv_a = np.tan(a) - a
-        s = r * (s0 / d0 + inv_a0 - inv_a)
-        phi = s / r
-        self.t_lflank_pts = np.dstack((np.cos(phi) * r,
-                                       np.sin(phi) * r,
-                                       np.zeros(self.curve_points))).squeeze()
-
-        # Calculate tooth tip points - an arc lying on the addendum circle
-        b = np.linspace(phi[-1], -phi[-1], self.curve_points)
-        self.t_tip_pts = np.dstack((np.cos(b) * rd,
-                                    np.sin(b) * rd,
-                                    np.zeros(self.curve_points))).squeeze()
-
-
-        # Get right side involute curve points by mirroring the left side
-        self.t_rflank_pts = np.dstack(((np.cos(-phi) * r)[::-1],
-                                       (np.sin(-phi) * r)[::-1],
-                                       np.zeros(self.curve_points))).squeeze()
-
-        # Calculate tooth root points - an arc that starts at the right side of
-        # the tooth and goes to the left side of the next tooth. The mid-point
-        # of that arc lies on the dedendum circle.
-        rho = tau - phi[0] * 2.0
-        # Get the three points defining the arc
-        p1 = np.array((self.t_rflank_pts[-1][0],
-                       self.t_rflank_pts[-1][1],
-                       0.0))
-        p2 = np.array((np.cos(-phi[0] - rho / 2.0) * ra,
-              np.sin(-phi[0] - rho / 2.0) * ra, 0.0))
-        p3 = np.array((np.cos(-phi[0] - rho) * ra,
-              np.sin(-phi[0] - rho) * ra, 0.0))
-
-        # Calculate arc's center and radius
-        bcr, bcxy = circle3d_by3points(p1, p2, p3)
-        # Calculate start and end angles
-        t1 = np.arctan2(p1[1] - bcxy[1], p1[0] - bcxy[0])
-        t2 = np.arctan2(p3[1] - bcxy[1], p3[0] - bcxy[0])
-        if t1 < 0.0:
-            t1 += np.pi * 2.0
-        if t2 < 0.0:
-            t2 += np.pi * 2.0
-        t1, t2 = min(t1, t2), max(t1, t2)
-        t = np.linspace(t2 + np.pi * 2.0, t1 + np.pi * 2.0, self.curve_points)
-        
-        self.t_root_pts = np.dstack((bcxy[0] + bcr * np.cos(t),
-                                     bcxy[1] + bcr * np.sin(t),
-                                     np.zeros(self.curve_points))).squeeze()
-
 
     def _build_rim_face(self):
         w1 = cq.Wire.makeCircle(self.rim_r,
@@ -220,16 +159,24 @@ class RingGear(SpurGear):
 
     def _build(self, chamfer=None, chamfer_top=None,
                chamfer_bottom=None, *args, **kv_args):
-        faces = self._build_gear_faces()
+        with self._stage('faces'):
+            faces = self._build_gear_faces()
 
-        shell = make_shell(faces)
-        body = cq.Solid.makeSolid(shell)
-        
-        body = self._make_chamfer(body, chamfer, chamfer_top, chamfer_bottom)
+        with self._stage('sewing'):
+            shell = make_shell(faces)
+            body = cq.Solid.makeSolid(shell)
+
+        with self._stage('features'):
+            body = self._make_chamfer(body, chamfer, chamfer_top, chamfer_bottom)
         
         return body
 
 
+    def _outline(self, *args, **kv_args):
+        return [circle_loop(self.rim_r, self.outline_tol),
+                self.gear_points()[:, :2]]
+
+
 class HerringboneRingGear(RingGear):
 
 
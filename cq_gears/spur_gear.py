@@ -18,10 +18,19 @@ See the License for the specific language governing permissions and
 limitations under the License.
 '''
 
+import time
+from contextlib import contextmanager
+
 import numpy as np
 import cadquery as cq
 
-from .utils import circle3d_by3points, rotation_matrix, make_shell
+from .utils import (rotation_matrix, rotation_matrices, rotated_copies,
+                    make_shell)
+from . import __version__
+from .cache import make_key
+from .profile import tooth_profiles
+from .outline import (OUTLINE_FORMATS, circle_loop, oriented, dedup,
+                      cut_sector, spoke_cutout, rotated)
 
 
 class GearBase:
@@ -37,16 +46,143 @@ class GearBase:
     isection_tol = 1e-7 # Tolerance to find intersections between two surfaces
     spline_approx_min_deg = 3 # Minimum surface spline degree
     spline_approx_max_deg = 8 # Maximum surface spline degree
+    outline_tol = 1e-2 # Maximum chord deviation of the arcs of 2D outlines
+
+    # Optional BuildCache instance to memoize built bodies, disabled by default
+    build_cache = None
+
+    # Optional callable(gear, stage, seconds) to be notified about how long
+    # each stage of _build takes, disabled by default
+    stage_observer = None
+
+    # Class attributes affecting the resulting geometry besides the instance
+    # attributes and the build parameters
+    build_key_attrs = ('ka', 'kd', 'curve_points', 'surface_splines',
+                       'wire_comb_tol', 'spline_approx_tol',
+                       'shell_sewing_tol', 'isection_tol',
+                       'spline_approx_min_deg', 'spline_approx_max_deg')
 
     
     def __init__(self, *args, **kv_args):
         raise NotImplementedError('Constructor is not defined')
 
+
+    @contextmanager
+    def _stage(self, name):
+        observer = type(self).stage_observer
+
+        if observer is None:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            observer(self, name, time.perf_counter() - start)
+
+
+    def gear_points(self, out=None):
+        '''Get the outline points of the whole gear - the tooth points
+           rotated once per tooth about Z, all rotations applied at once
+           out - optional preallocated C-contiguous array of the shape
+                 (z * len(tooth_points()), 3) to write the points into
+           return - an array of the shape (z * len(tooth_points()), 3), one
+                    tooth after another; out.reshape(z, -1, 3) is a per-tooth
+                    view of it
+        '''
+        r_mats = rotation_matrices((0.0, 0.0, 1.0), np.arange(self.z) * self.tau)
+
+        return rotated_copies(self.tooth_points(), r_mats, out)
+
+
+    def _geometry_state(self):
+        # A snapshot of everything the body depends on: the class, all the
+        # instance attributes (nested gears by their own snapshot) and the
+        # class attributes listed in build_key_attrs
+        state = {name: (value._geometry_state()
+                        if isinstance(value, GearBase) else value)
+                 for name, value in vars(self).items()}
+        attrs = {name: getattr(self, name, None)
+                 for name in self.build_key_attrs}
+
+        return (type(self).__module__, type(self).__qualname__, state, attrs)
+
+
+    def _memoizable(self):
+        # Only the classes of cq_gears itself: another class (e.g. a subclass
+        # defined in a script) may override _build under the same name
+        if type(self).__module__.split('.')[0] != __name__.split('.')[0]:
+            return False
+
+        return all(value._memoizable() for value in vars(self).values()
+                   if isinstance(value, GearBase))
+
+
+    def build_key(self, **kv_params):
+        '''Get the memoization key of the body which build(**kv_params)
+           would produce. The key is taken from the current state of the
+           gear, so changing its attributes after construction changes it,
+           and from the cadquery and cq_gears versions
+        '''
+        params = {**self.build_params, **kv_params}
+
+        return make_key(cq.__version__, __version__, self._geometry_state(),
+                        params)
+
     
     def build(self, **kv_params):
         params = {**self.build_params, **kv_params}
-        
-        return self._build(**params)
+
+        if self.build_cache is None or not self._memoizable():
+            return self._build(**params)
+
+        key = self.build_key(**kv_params)
+        body = self.build_cache.get(key)
+
+        if body is None:
+            body = self._build(**params)
+
+            if not isinstance(body, cq.Shape):
+                return body
+
+            self.build_cache.put(key, body)
+            body = body.moved(cq.Location())
+
+        return body
+
+
+    def outline(self, **kv_params):
+        '''Get the flat outline of the gear - its section at Z = 0, without
+           building the body. The build parameters cutting through the whole
+           body are applied as 2D polygon operations, the rest are ignored
+           kv_params - build parameters, on top of the constructor ones
+           return - a list of closed polylines, arrays of the shape (n, 2)
+                    with the last point connected to the first one: the
+                    outer boundary counterclockwise, then the holes clockwise
+        '''
+        params = {**self.build_params, **kv_params}
+        loops = [dedup(loop) for loop in self._outline(**params)]
+
+        return [oriented(loop, i == 0) for i, loop in enumerate(loops)]
+
+
+    def _outline(self, *args, **kv_args):
+        raise NotImplementedError(
+            f'2D outline is not available for {type(self).__name__}')
+
+
+    def export_outline(self, fmt='svg', **kv_params):
+        '''Write the flat outline of the gear, see outline()
+           fmt - one of OUTLINE_FORMATS: 'svg' or 'dxf'
+           kv_params - build parameters, on top of the constructor ones
+           return - the document as str
+        '''
+        if fmt not in OUTLINE_FORMATS:
+            raise ValueError(f'Unknown outline format {fmt!r}, expected one '
+                             f'of {", ".join(OUTLINE_FORMATS)}')
+
+        return OUTLINE_FORMATS[fmt](self.outline(**kv_params))
 
 
 
@@ -71,87 +207,37 @@ class SpurGear(GearBase):
         self.helix_angle = np.radians(helix_angle)
         self.width = width
 
-        d0 = m * z         # pitch diameter
-        adn = self.ka / (z / d0) # addendum
-        ddn = self.kd / (z / d0) # dedendum
+        profile = tooth_profiles(module, teeth_number, pressure_angle,
+                                 backlash, clearance, helix_angle,
+                                 self.ka, self.kd, 'external',
+                                 self.curve_points)
 
-        if 2.0 * ddn + 2.0 * clearance >= d0:
+        if profile['rd'] <= 0.0:
             raise ValueError(
                 "Invalid dedendum or clearance: resulting dedendum circle diameter is negative or zero."
             )
 
-        da = d0 + 2.0 * adn # addendum circle diameter
-        dd = d0 - 2.0 * ddn - 2.0 * clearance # dedendum circle diameter
-        s0 = m * (np.pi / 2.0 - backlash * np.tan(a0)) # tooth thickness on
-                                                       # the pitch circle
-        inv_a0 = np.tan(a0) - a0
-
-        self.r0 = r0 = d0 / 2.0 # pitch radius
-        self.ra = ra = da / 2.0 # addendum radius
-        self.rd = rd = dd / 2.0 # dedendum radius
-        self.rb = rb = np.cos(a0) * d0 / 2.0 # base circle radius
-        self.rr = rr = max(rb, rd) # tooth root radius
-        self.tau = tau = np.pi * 2.0 / z # pitch angle
+        self._set_profile(profile)
 
         if helix_angle != 0.0:
             self.twist_angle = width / \
-                                (r0 * np.tan(np.pi / 2.0 - self.helix_angle))
+                                (self.r0 * np.tan(np.pi / 2.0 - self.helix_angle))
         else:
             self.surface_splines = 2
             self.twist_angle = 0.0
 
         self.build_params = build_params
 
-        # Calculate involute curve points for the left side of the tooth
-        r = np.linspace(rr, ra, self.curve_points)
-        cos_a = r0 / r * np.cos(a0)
-        a = np.arccos(np.clip(cos_a, -1.0, 1.0))
-        inv_a = np.tan(a) - a
-        s = r * (s0 / d0 + inv_a0 - inv_a)
-        phi = s / r
-        self.t_lflank_pts = np.dstack((np.cos(phi) * r,
-                                       np.sin(phi) * r,
-                                       np.zeros(self.curve_points))).squeeze()
-
-        # Calculate tooth tip points - an arc lying on the addendum circle
-        b = np.linspace(phi[-1], -phi[-1], self.curve_points)
-        self.t_tip_pts = np.dstack((np.cos(b) * ra,
-                                    np.sin(b) * ra,
-                                    np.zeros(self.curve_points))).squeeze()
-
-        # Get right side involute curve points by mirroring the left side
-        self.t_rflank_pts = np.dstack(((np.cos(-phi) * r)[::-1],
-                                       (np.sin(-phi) * r)[::-1],
-                                       np.zeros(self.curve_points))).squeeze()
-
-        # Calculate tooth root points - an arc that starts at the right side of
-        # the tooth and goes to the left side of the next tooth. The mid-point
-        # of that arc lies on the dedendum circle.
-        rho = tau - phi[0] * 2.0
-        # Get the three points defining the arc
-        p1 = np.array((self.t_rflank_pts[-1][0],
-                       self.t_rflank_pts[-1][1],
-                       0.0))
-        p2 = np.array((np.cos(-phi[0] - rho / 2.0) * rd,
-              np.sin(-phi[0] - rho / 2.0) * rd, 0.0))
-        p3 = np.array((np.cos(-phi[0] - rho) * rr,
-              np.sin(-phi[0] - rho) * rr, 0.0))
-
-        # Calculate arc's center and radius
-        bcr, bcxy = circle3d_by3points(p1, p2, p3)
-        # Calculate start and end angles
-        t1 = np.arctan2(p1[1] - bcxy[1], p1[0] - bcxy[0])
-        t2 = np.arctan2(p3[1] - bcxy[1], p3[0] - bcxy[0])
-        if t1 < 0.0:
-            t1 += np.pi * 2.0
-        if t2 < 0.0:
-            t2 += np.pi * 2.0
-        t1, t2 = min(t1, t2), max(t1, t2)
-        t = np.linspace(t1 + np.pi * 2.0, t2 + np.pi * 2.0, self.curve_points)
-
-        self.t_root_pts = np.dstack((bcxy[0] + bcr * np.cos(t),
-                                     bcxy[1] + bcr * np.sin(t),
-                                     np.zeros(self.curve_points))).squeeze()
+
+    def _set_profile(self, profile):
+        '''Take the radii, the pitch angle and the tooth curves from a
+           tooth_profiles record
+        '''
+        for name in ('r0', 'ra', 'rd', 'rb', 'rr', 'tau'):
+            setattr(self, name, float(profile[name]))
+
+        for name in ('t_lflank_pts', 't_tip_pts', 't_rflank_pts', 't_root_pts'):
+            setattr(self, name, np.array(profile[name]))
 
 
     def tooth_points(self):
@@ -160,20 +246,6 @@ class SpurGear(GearBase):
         return pts
 
 
-    def gear_points(self):
-        tpts = np.concatenate((self.t_lflank_pts, self.t_tip_pts,
-                               self.t_rflank_pts, self.t_root_pts))
-        pts = tpts.copy()
-        angle = self.tau
-        for i in range(self.z - 1):
-            pts = np.concatenate((pts,
-                                  tpts @ rotation_matrix((0.0, 0.0, 1.0),
-                                                         angle)))
-            angle += self.tau
-
-        return pts
-
-    
     def _build_tooth_faces(self, twist_angle_a, twist_angle_b, z_pos, width):
         surf_splines = int(np.ceil(abs(self.twist_angle) / np.pi))
         surf_splines = max(1, surf_splines) * self.surface_splines
@@ -464,33 +536,80 @@ class SpurGear(GearBase):
                n_spokes=None, spoke_width=None, spoke_fillet=None,
                spokes_id=None, spokes_od=None, chamfer=None, chamfer_top=None,
                chamfer_bottom=None, *args, **kv_args):
-            faces = self._build_gear_faces()
-
-            shell = make_shell(faces, tol=self.shell_sewing_tol)
-            body = cq.Solid.makeSolid(shell)
-
-            body = self._make_chamfer(body, chamfer, chamfer_top, chamfer_bottom)
-            body = self._make_bore(body, bore_d)
-            body = self._make_missing_teeth(body, missing_teeth)
-            body = self._make_recess(body, hub_d, recess_d, recess,
-                             bottom_recess=bottom_recess,
-                             bottom_hub_d=bottom_hub_d,
-                             bottom_recess_d=bottom_recess_d)
-            body = self._make_hub(body, hub_d, hub_length, bore_d)
-            
-            if spokes_id is None:
-                spokes_id = hub_d
+            with self._stage('faces'):
+                faces = self._build_gear_faces()
+
+            with self._stage('sewing'):
+                shell = make_shell(faces, tol=self.shell_sewing_tol)
+                body = cq.Solid.makeSolid(shell)
+
+            with self._stage('features'):
+                body = self._make_chamfer(body, chamfer, chamfer_top, chamfer_bottom)
+                body = self._make_bore(body, bore_d)
+                body = self._make_missing_teeth(body, missing_teeth)
+                body = self._make_recess(body, hub_d, recess_d, recess,
+                                 bottom_recess=bottom_recess,
+                                 bottom_hub_d=bottom_hub_d,
+                                 bottom_recess_d=bottom_recess_d)
+                body = self._make_hub(body, hub_d, hub_length, bore_d)
 
-            if spokes_od is None:
-                spokes_od = recess_d
+                if spokes_id is None:
+                    spokes_id = hub_d
 
-            body = self._make_spokes(body, spokes_id, spokes_od, n_spokes,
-                                     spoke_width, spoke_fillet)
+                if spokes_od is None:
+                    spokes_od = recess_d
+
+                body = self._make_spokes(body, spokes_id, spokes_od, n_spokes,
+                                         spoke_width, spoke_fillet)
 
 
             return body
 
 
+    def _outline(self, bore_d=None, missing_teeth=None, hub_d=None,
+                 recess_d=None, n_spokes=None, spoke_width=None,
+                 spoke_fillet=None, spokes_id=None, spokes_od=None,
+                 *args, **kv_args):
+        tol = self.outline_tol
+        loops = [self.gear_points()[:, :2]]
+
+        if missing_teeth is not None:
+            if not isinstance(missing_teeth[0], (list, tuple)):
+                missing_teeth = (missing_teeth,)
+
+            # The same sectors _remove_teeth cuts out, down to the dedendum
+            # circle
+            for t1, t2 in missing_teeth:
+                a1, a2 = sorted((t1 * self.tau + self.tau / 2.0,
+                                 t2 * self.tau + self.tau / 2.0))
+                loops[0] = cut_sector(loops[0], a1, a2, self.rd, tol)
+
+        if bore_d is not None:
+            loops.append(circle_loop(bore_d / 2.0, tol))
+
+        if spokes_id is None:
+            spokes_id = hub_d
+
+        if spokes_od is None:
+            spokes_od = recess_d
+
+        if n_spokes is not None:
+            assert n_spokes > 1, 'Number of spokes must be > 1'
+            assert spoke_width is not None, 'Spoke width is not set'
+            assert spokes_od is not None, 'Outer spokes diameter is not set'
+
+            r1 = spoke_width / 2.0
+            if spokes_id is not None:
+                r1 = max(r1, spokes_id / 2.0)
+
+            tau = np.pi * 2.0 / n_spokes
+            cutout = spoke_cutout(r1, spokes_od / 2.0, tau, spoke_width,
+                                  spoke_fillet, tol)
+            loops += [rotated(cutout, tau * i) for i in range(n_spokes)]
+
+        return loops
+
+
 class HerringboneGear(SpurGear):
 
 
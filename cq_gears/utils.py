@@ -104,6 +104,29 @@ def circle3d_by3points(a, b, c):
     return r, cc
 
 
+def circles3d_by3points(a, b, c):
+    '''Find many circles in 3d space at once, each defined by 3 points
+       a, b, c - arrays of the shape (n, 3), the points a, b and c of each
+                 circle
+       return - an array of n circle radii, an array of the shape (n, 3) of
+                circle centers
+    '''
+    u = b - a
+    w = np.cross(c - a, u)
+    u = u / np.linalg.norm(u, axis=-1, keepdims=True)
+    w = w / np.linalg.norm(w, axis=-1, keepdims=True)
+    v = np.cross(w, u)
+
+    bx = np.sum((b - a) * u, axis=-1)
+    cx, cy = np.sum((c - a) * u, axis=-1), np.sum((c - a) * v, axis=-1)
+
+    h = ((cx - bx / 2.0) ** 2 + cy ** 2 - (bx / 2.0) ** 2) / (2.0 * cy)
+    cc = a + u * (bx / 2.0)[..., np.newaxis] + v * h[..., np.newaxis]
+    r = np.linalg.norm(a - cc, axis=-1)
+
+    return r, cc
+
+
 def rotation_matrix(axis, alpha):
     '''Construct a 3d rotation transform matrix
        axis - a 3d-axis to rotate about
@@ -127,6 +150,77 @@ def rotation_matrix(axis, alpha):
     return r_mat
 
 
+def rotation_matrices(axis, alphas):
+    '''Construct a stack of 3d rotation transform matrices about one axis
+       axis - a 3d-axis to rotate about
+       alphas - an array of n angles to rotate to
+       return - an array of the shape (n, 3, 3), the same matrices
+                rotation_matrix would return for each angle
+    '''
+    ux, uy, uz = axis
+    alphas = np.asarray(alphas, dtype=float)
+    sina, cosa = np.sin(alphas), np.cos(alphas)
+    versa = 1.0 - cosa
+
+    r_mats = np.empty(alphas.shape + (3, 3))
+    r_mats[..., 0, 0] = cosa + versa * ux ** 2
+    r_mats[..., 0, 1] = ux * uy * versa - uz * sina
+    r_mats[..., 0, 2] = ux * uz * versa + uy * sina
+    r_mats[..., 1, 0] = uy * ux * versa + uz * sina
+    r_mats[..., 1, 1] = cosa + versa * uy ** 2
+    r_mats[..., 1, 2] = uy * uz * versa - ux * sina
+    r_mats[..., 2, 0] = uz * ux * versa - uy * sina
+    r_mats[..., 2, 1] = uz * uy * versa + ux * sina
+    r_mats[..., 2, 2] = cosa + versa * uz ** 2
+
+    return r_mats
+
+
+def _copies_out(out, k, n):
+    if out is None:
+        return np.empty((k * n, 3))
+
+    if out.shape != (k * n, 3) or not out.flags.c_contiguous:
+        raise ValueError(f'out must be a C-contiguous array of the shape '
+                         f'({k * n}, 3), got {out.shape}')
+    return out
+
+
+def rotated_copies(pts, r_mats, out=None):
+    '''Transform a set of points by each matrix of a stack at once, the
+       copies laid out one after another
+       pts - an array of the shape (n, 3)
+       r_mats - an array of the shape (k, 3, 3)
+       out - optional preallocated C-contiguous array of the shape
+             (k * n, 3) to write the result into
+       return - an array of the shape (k * n, 3): pts @ r_mats[0],
+                pts @ r_mats[1], ... (out itself, if given)
+    '''
+    k, n = len(r_mats), len(pts)
+    out = _copies_out(out, k, n)
+    np.matmul(pts, r_mats, out=out.reshape(k, n, 3))
+
+    return out
+
+
+def translated_copies(pts, offsets, out=None):
+    '''Translate a set of points by each offset at once, the copies laid out
+       one after another
+       pts - an array of the shape (n, 3)
+       offsets - an array of the shape (k, 3)
+       out - optional preallocated C-contiguous array of the shape
+             (k * n, 3) to write the result into
+       return - an array of the shape (k * n, 3): pts + offsets[0],
+                pts + offsets[1], ... (out itself, if given)
+    '''
+    offsets = np.asarray(offsets, dtype=float)
+    k, n = len(offsets), len(pts)
+    out = _copies_out(out, k, n)
+    np.add(pts, offsets[:, np.newaxis, :], out=out.reshape(k, n, 3))
+
+    return out
+
+
 def angle_between(o, a, b):
     '''Find an angle between two vectors - OA and OB
        o, a, b - 3d-points defining the vectors OA and OB
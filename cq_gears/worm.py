@@ -21,7 +21,8 @@ limitations under the License.
 import numpy as np
 import cadquery as cq
 
-from .utils import rotation_matrix, make_shell, make_cross_section_face
+from .utils import (rotation_matrix, translated_copies, make_shell,
+                    make_cross_section_face)
 from .spur_gear import GearBase
 
 
@@ -83,17 +84,17 @@ class Worm(GearBase):
         return pts
 
 
-    def gear_points(self):
-        tpts = np.concatenate((self.t_lflank_pts, self.t_tip_pts,
-                               self.t_rflank_pts, self.t_root_pts))
-        pts = tpts.copy()
+    def gear_points(self, out=None):
+        '''Get the outline points of 11 consecutive teeth along X, all the
+           translations applied at once
+           out - optional preallocated C-contiguous array of the shape
+                 (11 * len(tooth_points()), 3) to write the points into
+           return - an array of the shape (11 * len(tooth_points()), 3)
+        '''
+        offsets = np.zeros((11, 3))
+        offsets[:, 0] = np.arange(11) * np.pi * self.m
 
-        for i in range(10):
-            ttpts = tpts.copy()
-            ttpts[:, 0] += np.pi * self.m * (i + 1)
-            pts = np.concatenate((pts, ttpts))
-
-        return pts
+        return translated_copies(self.tooth_points(), offsets, out)
     
     
     def _build_tooth_faces(self):
@@ -218,12 +219,15 @@ class Worm(GearBase):
 
 
     def _build(self, bore_d=None):
-        faces = self._build_gear_faces()
+        with self._stage('faces'):
+            faces = self._build_gear_faces()
 
-        shell = make_shell(faces, tol=self.shell_sewing_tol)
-        body = cq.Solid.makeSolid(shell)
+        with self._stage('sewing'):
+            shell = make_shell(faces, tol=self.shell_sewing_tol)
+            body = cq.Solid.makeSolid(shell)
 
-        body = self._make_bore(body, bore_d)
+        with self._stage('features'):
+            body = self._make_bore(body, bore_d)
 
         return body
 
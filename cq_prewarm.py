@@ -0,0 +1,19 @@
+"""
+Módulo precargado por el fork-server de la cola de trabajos (CQ_EXEC_MODE=forkserver).
+
+Al importarlo se cargan cadquery, OCP, cqkit y cq_gears (a través de app) y
+se construye un engrane de referencia para calentar el kernel de OCC. Los
+workers se crean por fork desde ese proceso y heredan todo ese estado.
+"""
+import os
+import sys
+
+# El fork-server no hereda el sys.path del servidor: app y cq_gears están
+# junto a este archivo.
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+if _APP_DIR not in sys.path:
+    sys.path.insert(0, _APP_DIR)
+
+import app
+
+app.warm_up()
@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+
+import app
+from app import AdmissionController, Lane, ServiceOverloadedError
+
+
+def _controller(slots=1, max_queue=8, max_client_queue=4, queue_timeout=5):
+    return AdmissionController([Lane('build', slots, max_queue, max_client_queue)],
+                               queue_timeout=queue_timeout)
+
+
+def _enqueue(controller, client, order):
+    lane = controller.lanes['build']
+    queued = lane.queued
+
+    def wait_turn():
+        turn = controller.acquire('build', client)
+        order.append(client)
+        controller.release(turn)
+
+    thread = threading.Thread(target=wait_turn)
+    thread.start()
+    while lane.queued == queued:
+        time.sleep(0.001)
+    return thread
+
+
+def test_round_robin_between_clients():
+    controller = _controller()
+    first = controller.acquire('build', 'a')
+
+    order = []
+    threads = [_enqueue(controller, client, order)
+               for client in ('a', 'a', 'a', 'b', 'c', 'b')]
+    controller.release(first)
+    for thread in threads:
+        thread.join()
+
+    assert order == ['a', 'b', 'c', 'a', 'b', 'a']
+    assert controller.stats()['build']['active'] == 0
+
+
+def test_queue_limits():
+    controller = _controller(max_queue=3, max_client_queue=2)
+    first = controller.acquire('build', 'a')
+
+    order = []
+    threads = [_enqueue(controller, 'a', order), _enqueue(controller, 'a', order)]
+    with pytest.raises(ServiceOverloadedError):
+        controller.acquire('build', 'a')
+    threads.append(_enqueue(controller, 'b', order))
+    with pytest.raises(ServiceOverloadedError):
+        controller.acquire('build', 'c')
+
+    controller.release(first)
+    for thread in threads:
+        thread.join()
+    assert order == ['a', 'b', 'a']
+    assert controller.stats()['build']['rejected'] == 2
+
+
+def test_queue_timeout():
+    controller = _controller(queue_timeout=0.05)
+    first = controller.acquire('build', 'a')
+
+    with pytest.raises(ServiceOverloadedError):
+        controller.acquire('build', 'b')
+    stats = controller.stats()['build']
+    assert (stats['queued'], stats['timeouts']) == (0, 1)
+
+    controller.release(first)
+    controller.release(controller.acquire('build', 'b'))
+
+
+def test_client_id_is_the_peer_address(monkeypatch):
+    headers = {'X-Client-Id': 'tenant', 'X-Forwarded-For': '10.0.0.9'}
+    environ = {'REMOTE_ADDR': '192.0.2.1'}
+
+    with app.app.test_request_context('/', headers=headers, environ_base=environ):
+        assert app._client_id() == '192.0.2.1'
+
+    monkeypatch.setattr(app, 'TRUSTED_PROXIES', frozenset({'192.0.2.1'}))
+    with app.app.test_request_context('/', headers=headers, environ_base=environ):
+        assert app._client_id() == 'tenant'
+    with app.app.test_request_context('/', headers={'X-Forwarded-For': '10.0.0.9'},
+                                      environ_base=environ):
+        assert app._client_id() == '10.0.0.9'
+    with app.app.test_request_context('/', environ_base=environ):
+        assert app._client_id() == '192.0.2.1'
+
+
+def test_forwarded_for_is_read_from_the_right(monkeypatch):
+    monkeypatch.setattr(app, 'TRUSTED_PROXIES', frozenset({'192.0.2.1', '192.0.2.2'}))
+    environ = {'REMOTE_ADDR': '192.0.2.1'}
+
+    # The client made up the left-most entries; the proxies appended the rest
+    spoofed = {'X-Forwarded-For': 'victim, 198.51.100.7, 192.0.2.2'}
+    with app.app.test_request_context('/', headers=spoofed, environ_base=environ):
+        assert app._client_id() == '198.51.100.7'
+
+    lines = [('X-Forwarded-For', 'victim'), ('X-Forwarded-For', '198.51.100.7')]
+    with app.app.test_request_context('/', headers=lines, environ_base=environ):
+        assert app._client_id() == '198.51.100.7'
@@ -0,0 +1,56 @@
+import io
+import zipfile
+
+import pytest
+
+import app
+
+
+STEP = (b"ISO-10303-21;\nHEADER;\nFILE_DESCRIPTION((''),'2;1');\n"
+        b"FILE_NAME('part.stp','',(''),(''),'','','');\n"
+        b"FILE_SCHEMA(('AUTOMOTIVE_DESIGN'));\nENDSEC;\nDATA;\n"
+        b"#1=MANIFOLD_SOLID_BREP('',#2);\nENDSEC;\nEND-ISO-10303-21;\n")
+
+
+def _zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def _analyze(data):
+    client = app.app.test_client()
+    return client.post('/analyze', data={
+        'mode': 'quick', 'step_file': (io.BytesIO(data), 'batch.zip')})
+
+
+@pytest.fixture
+def small_limit(monkeypatch):
+    monkeypatch.setattr(app, 'MAX_UPLOAD_MB', 1)
+
+
+def test_zip_members_are_analyzed(small_limit):
+    response = _analyze(_zip({'a.step': STEP, 'b.stp': STEP, 'notes.txt': b'x'}))
+
+    assert response.status_code == 200
+    report = response.get_json()
+    assert report["summary"]["total_files"] == 2
+    assert report["summary"]["total_solids"] == 2
+
+
+def test_zip_bomb_member_is_rejected(small_limit):
+    # 2 MB of padding compress to a few KB
+    bomb = _zip({'bomb.step': STEP + b' ' * (2 * 1024 * 1024)})
+    assert len(bomb) < 64 * 1024
+
+    assert _analyze(bomb).status_code == 413
+
+
+def test_zip_total_is_capped(small_limit):
+    member = STEP + b' ' * (400 * 1024)
+    members = {f'part{i}.step': member for i in range(3)}
+
+    assert _analyze(_zip(members)).status_code == 413
+    assert _analyze(_zip(dict(list(members.items())[:2]))).status_code == 200
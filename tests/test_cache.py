@@ -0,0 +1,131 @@
+import os
+
+import numpy as np
+import cadquery as cq
+import pytest
+
+from cq_gears import BuildCache, SpurGear
+from cq_gears.cache import make_key
+from cq_gears.spur_gear import GearBase
+
+
+def _box(size=1.0):
+    return cq.Workplane('XY').box(size, size, size).val()
+
+
+def test_make_key_canonical_forms():
+    assert make_key(20) == make_key(20.0) == make_key(np.int64(20))
+    assert make_key({'a': 1, 'b': 2}) == make_key({'b': 2, 'a': 1})
+    assert make_key(np.array((1.0, 2.5))) == make_key(np.array((1, 2.5)))
+    assert make_key((1, 2)) == make_key([1, 2])
+
+
+def test_make_key_distinguishes_values():
+    keys = {make_key(1.0), make_key(1.5), make_key('1'), make_key((1,)),
+            make_key({'a': 1}), make_key({'a': 2}), make_key(1.0, 2.0)}
+    assert len(keys) == 7
+
+
+def test_round_trip_in_memory():
+    cache = BuildCache(max_items=2)
+    body = _box()
+    cache.put('k', body)
+
+    got = cache.get('k')
+    assert got is not body
+    assert got.wrapped.IsPartner(body.wrapped)
+    assert got.Volume() == pytest.approx(1.0)
+    assert cache.get('missing') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_cached_body_is_a_copy():
+    cache = BuildCache()
+    cache.put('k', _box())
+
+    cache.get('k').move(cq.Location(cq.Vector(10.0, 0.0, 0.0)))
+    assert cache.get('k').Center().x == pytest.approx(0.0)
+
+
+def test_evicted_bodies_are_loaded_back_from_disk(tmp_path):
+    cache = BuildCache(max_items=1, cache_dir=str(tmp_path))
+    cache.put('a', _box(1.0))
+    cache.put('b', _box(2.0))
+    assert os.listdir(tmp_path) == ['a.brep']
+
+    got = cache.get('a')
+    assert got is not None
+    assert got.Volume() == pytest.approx(1.0)
+    assert cache.hits == 1
+
+
+def test_flush_and_prune(tmp_path):
+    cache = BuildCache(cache_dir=str(tmp_path))
+    cache.put('a', _box())
+    cache.flush()
+    assert os.listdir(tmp_path) == ['a.brep']
+
+    other = BuildCache(cache_dir=str(tmp_path))
+    assert other.get('a').Volume() == pytest.approx(1.0)
+
+    pruned = BuildCache(max_items=0, cache_dir=str(tmp_path), max_disk_bytes=0)
+    pruned.put('b', _box())
+    assert os.listdir(tmp_path) == []
+
+
+def test_gear_build_memoization(monkeypatch):
+    cache = BuildCache()
+    monkeypatch.setattr(GearBase, 'build_cache', cache)
+
+    gear = SpurGear(1.0, 12, 2.0, bore_d=3.0)
+    first = gear.build()
+    second = SpurGear(1.0, 12.0, 2.0, bore_d=3.0).build()
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert second.Volume() == pytest.approx(first.Volume())
+
+    SpurGear(1.0, 12, 2.0, bore_d=4.0).build()
+    assert cache.misses == 2
+    assert gear.build_key() != gear.build_key(bore_d=4.0)
+
+
+def test_gear_key_follows_the_instance_state():
+    gear = SpurGear(1.0, 12, 2.0)
+    key = gear.build_key()
+
+    gear.width = 6.0
+    assert gear.build_key() != key
+
+    gear = SpurGear(1.0, 12, 2.0)
+    gear.curve_points = 40
+    assert gear.build_key() != key
+    assert SpurGear(1.0, 12, 2.0).build_key() == key
+
+
+def test_gear_key_includes_the_library_versions(monkeypatch):
+    key = SpurGear(1.0, 12, 2.0).build_key()
+
+    monkeypatch.setattr(cq, '__version__', cq.__version__ + '.dev')
+    assert SpurGear(1.0, 12, 2.0).build_key() != key
+
+
+def test_width_changed_after_construction_is_built(monkeypatch):
+    cache = BuildCache()
+    monkeypatch.setattr(GearBase, 'build_cache', cache)
+
+    thin = SpurGear(1.0, 12, 2.0).build()
+    gear = SpurGear(1.0, 12, 2.0)
+    gear.width = 6.0
+    thick = gear.build()
+    assert thick.Volume() == pytest.approx(thin.Volume() * 3.0, rel=1e-3)
+
+
+def test_classes_outside_cq_gears_are_not_memoized(monkeypatch):
+    cache = BuildCache()
+    monkeypatch.setattr(GearBase, 'build_cache', cache)
+
+    class MyGear(SpurGear):
+        pass
+
+    MyGear(1.0, 12, 2.0).build()
+    MyGear(1.0, 12, 2.0).build()
+    assert (cache.hits, cache.misses, len(cache._bodies)) == (0, 0, 0)
@@ -0,0 +1,62 @@
+import gzip
+import io
+
+from werkzeug.datastructures import FileStorage
+from werkzeug.test import encode_multipart
+
+import app
+from tests.test_batch_upload import STEP
+
+
+def _analyze(data, filename, headers=None):
+    client = app.app.test_client()
+    return client.post('/analyze', data={
+        'mode': 'quick', 'step_file': (io.BytesIO(data), filename)}, headers=headers)
+
+
+def _analyze_encoded(body):
+    boundary, form = encode_multipart({
+        'mode': 'quick', 'step_file': FileStorage(io.BytesIO(STEP), 'part.step')})
+    data = gzip.compress(form)
+    client = app.app.test_client()
+    return client.post('/analyze', data=body(data), headers={
+        'Content-Encoding': 'gzip',
+        'Content-Type': f'multipart/form-data; boundary={boundary}'})
+
+
+def test_compressed_file_is_decompressed():
+    response = _analyze(gzip.compress(STEP), 'part.stp.gz')
+
+    assert response.status_code == 200
+    assert response.get_json()["summary"]["total_solids"] == 1
+
+
+def test_truncated_compressed_file_is_rejected():
+    data = gzip.compress(STEP + b' ' * 4096)
+
+    # Without the trailer the whole STEP still decompresses
+    response = _analyze(data[:-8], 'part.stp.gz')
+    assert response.status_code == 400
+    assert 'incompleta' in response.get_json()["error"]
+
+    assert _analyze(data[:len(data) // 2], 'part.stp.gz').status_code == 400
+
+
+def test_encoded_request_body_is_decompressed():
+    assert _analyze_encoded(lambda data: data).status_code == 200
+
+
+def test_truncated_request_body_is_rejected():
+    response = _analyze_encoded(lambda data: data[:-8])
+
+    assert response.status_code == 400
+    assert 'incompleta' in response.get_json()["error"]
+
+
+def test_any_truncated_file_rejects_the_request():
+    data = gzip.compress(STEP)
+    client = app.app.test_client()
+    response = client.post('/analyze', data={'mode': 'quick', 'step_file': [
+        (io.BytesIO(data), 'a.stp.gz'), (io.BytesIO(data[:-8]), 'b.stp.gz')]})
+
+    assert response.status_code == 400
@@ -0,0 +1,35 @@
+import ast
+
+import pytest
+
+import app
+
+
+def _specs(source):
+    return app.find_gear_specs(ast.parse(source))
+
+
+@pytest.mark.parametrize('source', (
+    "result = cq.Workplane('XY').gear(SpurGear(1.0, 12, 2.0), bore_d=2.0)",
+    "result = SpurGear(1.0, 12, 2.0).build(bore_d=2.0)",
+    "g = SpurGear(1.0, 12, 2.0)\nresult = cq.Workplane('XY').gear(g, bore_d=2.0)",
+    "g = SpurGear(1.0, 12, 2.0)\nresult = cq.Workplane('XY').addGear(g, bore_d=2.0)",
+    "g = SpurGear(1.0, 12, 2.0)\nresult = g.build(bore_d=2.0)",
+))
+def test_literal_gears_are_found(source):
+    assert _specs(source) == [{"class": 'SpurGear', "args": [1.0, 12, 2.0],
+                               "kwargs": {}, "build_args": {"bore_d": 2.0}}]
+
+
+@pytest.mark.parametrize('source', (
+    "g = SpurGear(1.0, 12, 2.0)\ng = SpurGear(1.0, 14, 2.0)\nresult = g.build()",
+    "g = SpurGear(1.0, 12, 2.0)\ng.width = 6.0\nresult = g.build()",
+    "g = SpurGear(1.0, 12, 2.0)\ng.width += 1.0\nresult = g.build()",
+    "g = SpurGear(1.0, 12, 2.0)\nsetattr(g, 'width', 6.0)\nresult = g.build()",
+    "g = SpurGear(1.0, 12, 2.0)\ntweak(g)\nresult = g.build()",
+    "g = SpurGear(1.0, 12, 2.0)\ng.tweak()\nresult = g.build()",
+    "n = 12\nresult = SpurGear(1.0, n, 2.0).build()",
+    "result = SpurGear(1.0, 12, 2.0).build(**params)",
+))
+def test_gears_that_may_change_are_skipped(source):
+    assert _specs(source) == []
@@ -0,0 +1,82 @@
+import time
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    queue = app.JobQueue(max_workers=2)
+    monkeypatch.setattr(app, 'JOB_QUEUE', queue)
+    monkeypatch.setattr(app, 'SCRIPT_SANDBOX', app.ScriptSandbox(timeout=60))
+    return queue
+
+
+def _wait(client, job_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while True:
+        status = client.get(f'/jobs/{job_id}').get_json()
+        if status["status"] in ('done', 'error') or time.monotonic() > deadline:
+            return status
+        time.sleep(0.05)
+
+
+def test_generate_job_result_is_downloaded(jobs):
+    client = app.app.test_client()
+    script = ("import time\ntime.sleep(1)\n"
+              "result = cq.Workplane('XY').box(2, 3, 4)\n")
+
+    response = client.post('/jobs/generate', json={'script': script, 'format': 'brep'})
+    assert response.status_code == 202
+    job_id = response.get_json()["job_id"]
+    assert response.get_json()["status"] in ('queued', 'running')
+    assert client.get(f'/jobs/{job_id}/result').status_code == 409
+
+    assert _wait(client, job_id)["status"] == 'done'
+    response = client.get(f'/jobs/{job_id}/result')
+    assert response.status_code == 200
+    [shape] = app._shapes_from_brep(response.get_data())
+    assert shape.Volume() == pytest.approx(24.0)
+
+    # The result went to RESULT_CACHE: the same script is done at once
+    response = client.post('/jobs/generate', json={'script': script, 'format': 'brep'})
+    assert response.get_json()["status"] == 'done'
+
+
+def test_failed_job_reports_its_error(jobs):
+    client = app.app.test_client()
+
+    response = client.post('/jobs/generate', json={'script': "raise ValueError('broken')"})
+    status = _wait(client, response.get_json()["job_id"])
+
+    assert status["status"] == 'error'
+    assert 'broken' in status["error"]
+    assert client.get(f'/jobs/{status["job_id"]}/result').status_code == 500
+
+
+def test_unknown_job_is_not_found(jobs):
+    client = app.app.test_client()
+
+    assert client.get('/jobs/missing').status_code == 404
+    assert client.get('/jobs/missing/result').status_code == 404
+
+
+def test_finished_jobs_expire():
+    queue = app.JobQueue(max_workers=1, ttl=0)
+    results = []
+    job_id = queue.submit('generate', 'a.step', lambda n: n * 2, 21,
+                          on_success=results.append, local=True)
+
+    # on_success runs last, once the job is marked as done
+    deadline = time.monotonic() + 10
+    while not results and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert queue.get(job_id)["status"] == 'done'
+    assert queue.get(job_id)["result"] == 42
+    assert results == [42]
+    assert queue.pending == 0
+
+    time.sleep(0.01)
+    queue.complete('generate', 'b.step', b'')
+    assert queue.get(job_id) is None
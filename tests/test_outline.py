@@ -0,0 +1,87 @@
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pytest
+
+from cq_gears import SpurGear, RingGear, RackGear
+from cq_gears.outline import (arc_points, circle_loop, signed_area, cut_sector,
+                              spoke_cutout, outline_svg, outline_dxf)
+
+
+def _area(loops):
+    return sum(signed_area(loop) for loop in loops)
+
+
+@pytest.mark.parametrize('gear, build_params', (
+    (SpurGear(1.0, 20, 4.0), {}),
+    (SpurGear(1.0, 20, 4.0), {'bore_d': 5.0}),
+    (SpurGear(1.0, 24, 4.0), {'missing_teeth': (0, 3)}),
+    (SpurGear(2.0, 40, 5.0), {'bore_d': 10.0, 'n_spokes': 5,
+                              'spoke_width': 6.0, 'spokes_id': 20.0,
+                              'spokes_od': 60.0, 'spoke_fillet': 3.0}),
+    (RingGear(1.0, 40, 4.0, 3.0), {}),
+    (RackGear(1.0, 30.0, 4.0, 5.0), {}),
+))
+def test_area_matches_the_solid(gear, build_params):
+    # Straight gears are prisms: the section area is the volume over the width
+    loops = gear.outline(**build_params)
+    body = gear.build(**build_params)
+
+    assert _area(loops) == pytest.approx(body.Volume() / gear.width, rel=3e-3)
+
+
+def test_loop_orientation():
+    loops = SpurGear(2.0, 40, 5.0, bore_d=10.0, n_spokes=4, spoke_width=6.0,
+                     spokes_id=20.0, spokes_od=60.0).outline()
+
+    assert len(loops) == 6
+    assert signed_area(loops[0]) > 0.0
+    assert all(signed_area(loop) < 0.0 for loop in loops[1:])
+
+
+def test_arcs_stay_within_tolerance():
+    pts = arc_points(10.0, 0.0, np.pi, 1e-3)
+    chords = (pts[:-1] + pts[1:]) / 2.0
+    assert np.linalg.norm(pts, axis=1) == pytest.approx(10.0)
+    assert 10.0 - np.linalg.norm(chords, axis=1).min() <= 1e-3
+
+    circle = circle_loop(5.0, 1e-3)
+    assert signed_area(circle) == pytest.approx(np.pi * 25.0, rel=1e-3)
+
+
+def test_cut_sector_area():
+    square = np.array(((-2.0, -2.0), (2.0, -2.0), (2.0, 2.0), (-2.0, 2.0)))
+    square = np.concatenate([np.linspace(square[i], square[(i + 1) % 4], 1000,
+                                         endpoint=False) for i in range(4)])
+    cut = cut_sector(square, 0.0, np.pi / 2.0, 1.0, 1e-4)
+
+    assert signed_area(cut) == pytest.approx(16.0 - 4.0 + np.pi / 4.0, rel=1e-3)
+
+    with pytest.raises(ValueError):
+        cut_sector(square, -1.0, np.pi * 2.0 - 1.0, 1.0, 1e-4)
+
+
+def test_spoke_cutout_is_counterclockwise():
+    cutout = spoke_cutout(5.0, 20.0, np.pi / 2.0, 4.0, 1.0, 1e-3)
+    assert signed_area(cutout) > 0.0
+
+
+def test_svg_and_dxf():
+    loops = SpurGear(1.0, 12, 3.0).outline(bore_d=3.0)
+
+    svg = ET.fromstring(outline_svg(loops))
+    d = svg.find('{http://www.w3.org/2000/svg}path').get('d')
+    assert d.count('M') == d.count('Z') == 2
+    assert d.count('L') == sum(len(loop) - 1 for loop in loops)
+
+    dxf = outline_dxf(loops).split('\n')
+    assert dxf.count('POLYLINE') == 2
+    assert dxf.count('VERTEX') == sum(len(loop) for loop in loops)
+    assert dxf[-2:] == ['EOF', '']
+
+
+def test_gears_without_outline():
+    from cq_gears import BevelGear
+
+    with pytest.raises(NotImplementedError):
+        BevelGear(1.0, 20, 20, 5.0).outline()
@@ -0,0 +1,116 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from cq_gears import (SpurGear, RingGear, CrossedHelicalGear, tooth_profiles,
+                      profile_dtype)
+from cq_gears.utils import circle3d_by3points
+
+
+CURVES = ('t_lflank_pts', 't_tip_pts', 't_rflank_pts', 't_root_pts')
+
+
+def _scalar_external(m, z, pressure_angle, backlash, clearance, ka=1.0,
+                     kd=1.25, n=20):
+    # The per-gear math SpurGear used before tooth_profiles
+    a0 = np.radians(pressure_angle)
+    d0 = m * z
+    adn = ka / (z / d0)
+    ddn = kd / (z / d0)
+    da = d0 + 2.0 * adn
+    dd = d0 - 2.0 * ddn - 2.0 * clearance
+    s0 = m * (np.pi / 2.0 - backlash * np.tan(a0))
+    inv_a0 = np.tan(a0) - a0
+
+    r0, ra, rd = d0 / 2.0, da / 2.0, dd / 2.0
+    rb = np.cos(a0) * d0 / 2.0
+    rr = max(rb, rd)
+    tau = np.pi * 2.0 / z
+
+    r = np.linspace(rr, ra, n)
+    a = np.arccos(np.clip(r0 / r * np.cos(a0), -1.0, 1.0))
+    s = r * (s0 / d0 + inv_a0 - (np.tan(a) - a))
+    phi = s / r
+    zeros = np.zeros(n)
+    lflank = np.dstack((np.cos(phi) * r, np.sin(phi) * r, zeros)).squeeze()
+
+    b = np.linspace(phi[-1], -phi[-1], n)
+    tip = np.dstack((np.cos(b) * ra, np.sin(b) * ra, zeros)).squeeze()
+
+    rflank = np.dstack(((np.cos(-phi) * r)[::-1], (np.sin(-phi) * r)[::-1],
+                        zeros)).squeeze()
+
+    rho = tau - phi[0] * 2.0
+    p1 = np.array((rflank[-1][0], rflank[-1][1], 0.0))
+    p2 = np.array((np.cos(-phi[0] - rho / 2.0) * rd,
+                   np.sin(-phi[0] - rho / 2.0) * rd, 0.0))
+    p3 = np.array((np.cos(-phi[0] - rho) * rr,
+                   np.sin(-phi[0] - rho) * rr, 0.0))
+    bcr, bcxy = circle3d_by3points(p1, p2, p3)
+    t1 = np.arctan2(p1[1] - bcxy[1], p1[0] - bcxy[0]) % (np.pi * 2.0)
+    t2 = np.arctan2(p3[1] - bcxy[1], p3[0] - bcxy[0]) % (np.pi * 2.0)
+    t1, t2 = min(t1, t2), max(t1, t2)
+    t = np.linspace(t1 + np.pi * 2.0, t2 + np.pi * 2.0, n)
+    root = np.dstack((bcxy[0] + bcr * np.cos(t), bcxy[1] + bcr * np.sin(t),
+                      zeros)).squeeze()
+
+    return {'r0': r0, 'ra': ra, 'rd': rd, 'rb': rb, 'rr': rr, 'tau': tau,
+            't_lflank_pts': lflank, 't_tip_pts': tip,
+            't_rflank_pts': rflank, 't_root_pts': root}
+
+
+@pytest.mark.parametrize('m, z, pressure_angle, backlash, clearance',
+                         itertools.product((0.5, 1.0, 2.5), (8, 17, 60),
+                                           (14.5, 20.0, 25.0), (0.0, 0.05),
+                                           (0.0, 0.1)))
+def test_external_matches_scalar(m, z, pressure_angle, backlash, clearance):
+    profile = tooth_profiles(m, z, pressure_angle, backlash, clearance)
+    expected = _scalar_external(m, z, pressure_angle, backlash, clearance)
+
+    assert profile['valid']
+    for name, value in expected.items():
+        np.testing.assert_allclose(profile[name], value, rtol=1e-12,
+                                   atol=1e-12, err_msg=name)
+
+
+@pytest.mark.parametrize('kind', ('external', 'internal', 'crossed'))
+def test_batch_matches_single_calls(kind):
+    m = np.array((0.5, 1.0, 2.0))[:, np.newaxis, np.newaxis]
+    z = np.array((12, 31))[:, np.newaxis]
+    helix = np.array((0.0, 15.0, 30.0))
+    batch = tooth_profiles(m, z, 20.0, 0.02, 0.05, helix, kind=kind)
+    assert batch.shape == (3, 2, 3)
+    assert batch.dtype == profile_dtype()
+
+    for i, j, k in np.ndindex(batch.shape):
+        single = tooth_profiles(m.flat[i], z.flat[j], 20.0, 0.02, 0.05,
+                                helix[k], kind=kind)
+        for name in batch.dtype.names:
+            np.testing.assert_array_equal(batch[i, j, k][name], single[name],
+                                          err_msg=name)
+
+
+@pytest.mark.parametrize('gear, kind', (
+    (SpurGear(1.5, 19, 5.0, pressure_angle=22.0, backlash=0.03,
+              clearance=0.1), 'external'),
+    (RingGear(1.0, 42, 5.0, 5.0, backlash=0.02), 'internal'),
+    (CrossedHelicalGear(1.25, 15, 8.0, helix_angle=30.0), 'crossed'),
+))
+def test_gears_take_the_kernel_profile(gear, kind):
+    profile = tooth_profiles(gear.m, gear.z, np.degrees(gear.a0),
+                             gear.backlash, gear.clearance,
+                             np.degrees(gear.helix_angle), gear.ka, gear.kd,
+                             kind, gear.curve_points)
+
+    for name in ('r0', 'ra', 'rd', 'rb', 'rr', 'tau') + CURVES:
+        np.testing.assert_allclose(getattr(gear, name), profile[name],
+                                   rtol=1e-12, atol=1e-12, err_msg=name)
+
+
+def test_invalid_profiles_are_flagged():
+    profiles = tooth_profiles(1.0, (2, 20), clearance=(5.0, 0.0))
+    assert profiles['valid'].tolist() == [False, True]
+
+    with pytest.raises(ValueError):
+        tooth_profiles(1.0, 20, kind='bevel')
@@ -0,0 +1,78 @@
+import cadquery as cq
+import pytest
+
+import app
+from cq_gears import SpurGear
+
+
+STEP = b"""ISO-10303-21;
+HEADER;
+FILE_DESCRIPTION(('demo'),'2;1');
+FILE_NAME('part.stp','2026-01-01T00:00:00',('Ana O''Neil'),('ACME'),'pp','sys','');
+FILE_SCHEMA(('AUTOMOTIVE_DESIGN { 1 0 10303 214 1 1 1 1 }'));
+ENDSEC;
+DATA;
+#1=PRODUCT('asm','Assembly \\X2\\00C1\\X0\\','',(#9));
+#2=PRODUCT_DEFINITION_FORMATION('','',#1);
+#3=PRODUCT_DEFINITION('design','',#2,#10);
+#4=PRODUCT('bolt','Bolt','',(#9));
+#5=PRODUCT_DEFINITION_FORMATION('','',#4);
+#6=PRODUCT_DEFINITION('design','',#5,#10);
+#7=NEXT_ASSEMBLY_USAGE_OCCURRENCE('1','','',#3,#6,$);
+#8=NEXT_ASSEMBLY_USAGE_OCCURRENCE('2','','',#3,#6,$);
+/* #99=MANIFOLD_SOLID_BREP('commented out',#12); */
+#11=MANIFOLD_SOLID_BREP('a;b',#12);
+#12=BREP_WITH_VOIDS('',#13,());
+#13=(GEOMETRIC_REPRESENTATION_CONTEXT(3) REPRESENTATION_CONTEXT('',''));
+ENDSEC;
+END-ISO-10303-21;
+"""
+
+
+@pytest.fixture(params=('memory', 'file'))
+def upload(request, tmp_path):
+    if request.param == 'memory':
+        return app.StepUpload(STEP)
+    path = tmp_path / 'part.stp'
+    path.write_bytes(STEP)
+    return app.StepUpload(path=str(path), digest='x', size=len(STEP))
+
+
+def test_header_and_counts(upload):
+    report = app.quick_scan_step('part.stp', upload)
+
+    assert report["header"]["name"] == 'part.stp'
+    assert report["header"]["author"] == ["Ana O'Neil"]
+    assert report["schema"] == ['AUTOMOTIVE_DESIGN { 1 0 10303 214 1 1 1 1 }']
+    assert report["summary"] == {"total_solids": 2, "total_entities": 11,
+                                 "complex_entities": 1, "products": 2}
+    assert report["entity_types"]["NEXT_ASSEMBLY_USAGE_OCCURRENCE"] == 2
+
+
+def test_assembly(upload):
+    report = app.quick_scan_step('part.stp', upload)
+
+    assert [p["name"] for p in report["products"]] == ['Assembly Á', 'Bolt']
+    assert report["assembly"] == {
+        "roots": ['Assembly Á'],
+        "occurrences": 2,
+        "components": [{"parent": 'Assembly Á', "child": 'Bolt',
+                        "quantity": 2}],
+    }
+
+
+def test_solids_match_the_full_analysis():
+    gears = (cq.Workplane('XY').gear(SpurGear(1.0, 12, 2.0))
+             .add(cq.Workplane('XY').box(2.0, 2.0, 2.0).translate((20.0, 0.0, 0.0))))
+    upload = app.StepUpload(app._export_step_bytes(gears))
+
+    quick = app.quick_scan_step('gears.stp', upload)
+    full = app.analyze_step_file('gears.stp', upload)
+    assert quick["summary"]["total_solids"] == full["summary"]["total_solids"] == 2
+
+
+@pytest.mark.parametrize('data', (b'', b'solid cube\nendsolid\n',
+                                  b'ISO-10303-21;\nDATA;\nENDSEC;\n'))
+def test_not_step(data):
+    with pytest.raises(app.NotStepError):
+        app.quick_scan_step('bad.stp', app.StepUpload(data))
@@ -0,0 +1,136 @@
+import multiprocessing
+import os
+import signal
+from types import SimpleNamespace
+
+import cadquery as cq
+import pytest
+
+import app
+
+
+GEAR_SCRIPT = ("g = SpurGear(1.0, 12, 2.0)\ng.width = 3.0\n"
+               "result = cq.Workplane('XY').gear(g)\n")
+
+
+@pytest.fixture
+def sandbox(monkeypatch):
+    def configure(**limits):
+        monkeypatch.setattr(app, 'SCRIPT_SANDBOX', app.ScriptSandbox(**limits))
+    return configure
+
+
+def _generate(script, address='198.51.100.1'):
+    client = app.app.test_client()
+    return client.post('/generate', json={'script': script, 'format': 'brep'},
+                       environ_base={'REMOTE_ADDR': address})
+
+
+def _volume(response):
+    assert response.status_code == 200, response.get_data()
+    return app._shapes_from_brep(response.get_data())[0].Volume()
+
+
+def test_script_result_is_returned(sandbox):
+    sandbox(timeout=60, max_memory=2048 * 1024 * 1024)
+
+    response = _generate("result = cq.Workplane('XY').box(1, 2, 3)")
+
+    assert _volume(response) == pytest.approx(6.0)
+
+
+def test_script_over_the_timeout_is_stopped(sandbox):
+    sandbox(timeout=1)
+
+    response = _generate("while True:\n    pass\n")
+
+    assert response.status_code == 422
+    assert response.get_json()["resource"] == "wall_time"
+    assert app.SCRIPT_SANDBOX.exceeded["wall_time"] == 1
+
+
+def test_script_over_the_cpu_limit_is_stopped(sandbox):
+    sandbox(timeout=60, cpu_seconds=1)
+
+    response = _generate("n = 0\nwhile True:\n    n += 1\n")
+
+    assert response.status_code == 422
+    assert response.get_json()["resource"] == "cpu_time"
+
+
+def test_script_over_the_memory_limit_is_stopped(sandbox):
+    sandbox(timeout=60, max_memory=2048 * 1024 * 1024)
+
+    response = _generate("data = bytearray(8 * 1024 ** 3)\n"
+                         "result = cq.Workplane('XY').box(1, 1, 1)\n")
+
+    assert response.status_code == 422
+    assert response.get_json() == {
+        "error": "El trabajo superó la memoria máxima (2048 MB).",
+        "error_type": "resource_exceeded", "resource": "memory",
+        "limit": "2048 MB"}
+
+
+def test_gear_cache_is_not_shared_between_clients(sandbox, monkeypatch, tmp_path):
+    # Children forked from this process see the patched configuration; the
+    # fork-server ones would import app again
+    monkeypatch.setattr(app, '_forkserver_context',
+                        lambda: multiprocessing.get_context('fork'))
+    monkeypatch.setattr(app, 'SANDBOX_GEAR_CACHE', True)
+    monkeypatch.setattr(app, 'GEAR_CACHE_DIR', str(tmp_path))
+    sandbox(timeout=60)
+    clients = tmp_path / 'clients'
+
+    volume = _volume(_generate(GEAR_SCRIPT))
+    [first] = os.listdir(clients)
+    [entry] = os.listdir(clients / first)
+
+    # Replace the first client's gear with a box: only that client sees it
+    cq.Workplane('XY').box(1, 1, 1).val().exportBrep(str(clients / first / entry))
+    assert _volume(_generate(GEAR_SCRIPT + "# again\n")) == pytest.approx(1.0)
+
+    other = _generate(GEAR_SCRIPT + "# other\n", address='198.51.100.2')
+    assert _volume(other) == pytest.approx(volume)
+    assert len(os.listdir(clients)) == 2
+
+
+def test_no_gear_cache_directory_outside_a_request(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, 'SANDBOX_GEAR_CACHE', True)
+    monkeypatch.setattr(app, 'GEAR_CACHE_DIR', str(tmp_path))
+
+    assert app._sandbox_gear_cache_dir() is None
+    with app.app.test_request_context('/', environ_base={'REMOTE_ADDR': '198.51.100.1'}):
+        first = app._sandbox_gear_cache_dir()
+    with app.app.test_request_context('/', environ_base={'REMOTE_ADDR': '198.51.100.2'}):
+        assert app._sandbox_gear_cache_dir() != first
+
+
+def _died(sandbox, exitcode, cpu_used=None):
+    sandbox._died(SimpleNamespace(exitcode=exitcode), cpu_used)
+
+
+def test_kill_is_memory_only_with_a_memory_limit():
+    sandbox = app.ScriptSandbox(timeout=10, max_memory=512 * 1024 * 1024)
+    with pytest.raises(app.ResourceExceededError) as info:
+        _died(sandbox, -signal.SIGKILL)
+    assert info.value.to_dict()["resource"] == "memory"
+
+    sandbox = app.ScriptSandbox(timeout=10)
+    with pytest.raises(RuntimeError, match=r"señal 9 \(SIGKILL\)"):
+        _died(sandbox, -signal.SIGKILL)
+    assert not sandbox.exceeded
+
+
+def test_kill_past_the_cpu_limit_is_cpu_time():
+    sandbox = app.ScriptSandbox(cpu_seconds=2, max_memory=512 * 1024 * 1024)
+    with pytest.raises(app.ResourceExceededError) as info:
+        _died(sandbox, -signal.SIGKILL, cpu_used=3)
+    assert info.value.to_dict()["resource"] == "cpu_time"
+
+
+def test_other_signals_are_reported():
+    sandbox = app.ScriptSandbox(timeout=10, max_memory=512 * 1024 * 1024)
+    with pytest.raises(RuntimeError, match=r"señal 11 \(SIGSEGV\)"):
+        _died(sandbox, -signal.SIGSEGV)
+    with pytest.raises(RuntimeError, match="código 3"):
+        _died(sandbox, 3)
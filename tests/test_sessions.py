@@ -0,0 +1,95 @@
+import io
+import math
+import tempfile
+import time
+
+import cadquery as cq
+import pytest
+
+import app
+
+
+HOLE = "model = model.faces('>Z').workplane().pushPoints([{}]).hole(2.0)"
+
+
+@pytest.fixture(scope='module')
+def box_step():
+    with tempfile.NamedTemporaryFile(suffix='.step') as f:
+        cq.exporters.export(cq.Workplane('XY').box(10, 10, 10), f.name)
+        return f.read()
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    managers = []
+
+    def configure(**options):
+        manager = app.SessionManager(app.ScriptSandbox(timeout=60), **options)
+        monkeypatch.setattr(app, 'SESSIONS', manager)
+        managers.append(manager)
+        return manager
+
+    yield configure
+    for manager in managers:
+        manager.idle_timeout = 0
+        manager.reap()
+
+
+def _open(client, step):
+    response = client.post('/sessions', data={
+        'step_file': (io.BytesIO(step), 'box.step')})
+    assert response.status_code == 201, response.get_data()
+    return response.get_json()
+
+
+def test_session_keeps_the_model_between_edits(sessions, box_step):
+    sessions()
+    client = app.app.test_client()
+
+    opened = _open(client, box_step)
+    assert opened["objects"] == 1 and opened["edits"] == 0
+    session_id = opened["session_id"]
+
+    for edits, point in ((1, (0, 0)), (2, (3, 3))):
+        response = client.post(f'/sessions/{session_id}/modify',
+                               json={'script': HOLE.format(point)})
+        assert response.status_code == 200, response.get_data()
+        assert response.get_json()["edits"] == edits
+
+    response = client.get(f'/sessions/{session_id}/model?format=brep')
+    assert response.status_code == 200
+    [shape] = app._shapes_from_brep(response.get_data())
+    # The second edit drilled the model left by the first
+    assert shape.Volume() == pytest.approx(1000 - 2 * math.pi * 10, rel=1e-3)
+
+    assert client.delete(f'/sessions/{session_id}').status_code == 204
+    response = client.post(f'/sessions/{session_id}/modify',
+                           json={'script': HOLE.format((0, 0))})
+    assert response.status_code == 404
+
+
+def test_idle_sessions_are_reaped(sessions, box_step):
+    manager = sessions(idle_timeout=60)
+    client = app.app.test_client()
+    session_id = _open(client, box_step)["session_id"]
+
+    assert manager.reap() == 0
+    manager.idle_timeout = 0
+    time.sleep(0.01)
+    assert manager.reap() == 1
+
+    assert manager.stats()["evicted"] == {"idle": 1}
+    assert client.get(f'/sessions/{session_id}/model').status_code == 404
+
+
+def test_least_recently_used_session_is_evicted(sessions, box_step):
+    manager = sessions(max_sessions=1)
+    client = app.app.test_client()
+
+    first = _open(client, box_step)["session_id"]
+    second = _open(client, box_step)["session_id"]
+
+    assert manager.stats()["sessions"] == 1
+    assert manager.stats()["evicted"] == {"lru": 1}
+    assert client.get(f'/sessions/{first}/model').status_code == 404
+    assert client.get(f'/sessions/{second}/model').status_code == 200